@@ -0,0 +1,366 @@
+"""
+Gateway in front of the OpenAI API.
+
+Every AI call in the project goes through here. The gateway owns:
+
+- one OpenAI client per process with a tuned HTTP connection pool and timeouts;
+- a per-process and a per-user concurrency limit, so a slow provider cannot
+  tie up every worker;
+- retries with jittered exponential backoff for 429 / 5xx / network errors;
+- a circuit breaker that fails fast while the provider is down, letting the
+  views answer with their usual fallback reply straight away;
+- per-user and per-hospital token budgets (chat.budgets), checked before
+  the provider is contacted;
+- per-call telemetry (chat.telemetry): queue wait, latency, tokens, retries.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+from django.conf import settings
+from dotenv import load_dotenv
+
+from . import budgets
+from .context import message_tokens
+from .telemetry import CallMetrics
+
+try:
+    import httpx
+except ImportError:  # newer openai releases ship httpx2
+    import httpx2 as httpx
+
+load_dotenv()
+
+
+class AIGatewayError(Exception):
+    """Base error raised by the gateway itself (not by the provider)"""
+
+
+class AIUnavailableError(AIGatewayError):
+    """The circuit breaker is open - the provider is treated as down"""
+
+
+class AIBusyError(AIGatewayError):
+    """No concurrency slot became free within AI_QUEUE_TIMEOUT"""
+
+
+class AIBudgetExceeded(AIGatewayError):
+    """The user's or hospital's token budget does not cover this call"""
+
+    def __init__(self, scope, limit, retry_after):
+        self.scope = scope
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f"AI {limit} budget exceeded for {scope}, retry in {retry_after}s")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+
+    After failure_threshold consecutive upstream failures the circuit opens
+    and calls fail immediately for reset_timeout seconds; then a single
+    trial call is let through and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self.trial_in_flight):
+                raise AIUnavailableError("OpenAI circuit is open, failing fast")
+            if state == "half-open":
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_client_error(self):
+        """A 4xx says nothing about the provider: keep the state, end the trial"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class AIGateway:
+    def __init__(self):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self._client = None
+        self._client_lock = threading.Lock()
+
+        self.max_retries = _setting("AI_MAX_RETRIES", 3)
+        self.backoff_base = _setting("AI_BACKOFF_BASE", 0.5)
+        self.backoff_cap = _setting("AI_BACKOFF_CAP", 8.0)
+        self.queue_timeout = _setting("AI_QUEUE_TIMEOUT", 30)
+
+        self.process_slots = threading.BoundedSemaphore(_setting("AI_MAX_CONCURRENCY", 8))
+        self.per_user_limit = _setting("AI_MAX_CONCURRENCY_PER_USER", 2)
+        self.user_slots = {}
+        self.user_slots_lock = threading.Lock()
+
+        self.breaker = CircuitBreaker(
+            failure_threshold=_setting("AI_CIRCUIT_FAILURE_THRESHOLD", 5),
+            reset_timeout=_setting("AI_CIRCUIT_RESET_TIMEOUT", 30),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
+        fake_mode = _setting("AI_FAKE_MODE", False)
+        if not self.api_key and not fake_mode:
+            raise AIGatewayError("OpenAI client not initialized - API key missing")
+
+        extra = {}
+        if fake_mode:
+            # Answer in-process from chat.fake_openai, no network involved
+            from .fake_openai import make_transport
+
+            extra["transport"] = make_transport()
+
+        http_client = openai.DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=_setting("AI_HTTP_MAX_CONNECTIONS", 20),
+                max_keepalive_connections=_setting("AI_HTTP_MAX_KEEPALIVE", 10),
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(
+                _setting("AI_HTTP_READ_TIMEOUT", 120),
+                connect=_setting("AI_HTTP_CONNECT_TIMEOUT", 5),
+            ),
+            **extra,
+        )
+        # Retries are ours (with jitter and the circuit breaker), not the SDK's
+        return openai.OpenAI(
+            api_key=self.api_key or "fake-key",
+            base_url=_setting("OPENAI_BASE_URL", None) or None,
+            http_client=http_client,
+            max_retries=0,
+        )
+
+    def _user_semaphore(self, user_id):
+        """The user's semaphore, counted as in use until _release_user"""
+        with self.user_slots_lock:
+            entry = self.user_slots.get(user_id)
+            if entry is None:
+                entry = self.user_slots[user_id] = [threading.BoundedSemaphore(self.per_user_limit), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release_user(self, user_id):
+        with self.user_slots_lock:
+            entry = self.user_slots[user_id]
+            entry[1] -= 1
+            if not entry[1]:
+                # Nobody holds or waits for this user's slots - forget them
+                del self.user_slots[user_id]
+
+    @contextmanager
+    def user_slot(self, user_id):
+        """Hold one of the user's concurrency slots (an image series holds one for all its calls)"""
+        user_semaphore = self._user_semaphore(user_id)
+        try:
+            if not user_semaphore.acquire(timeout=self.queue_timeout):
+                raise AIBusyError("Too many concurrent AI requests for this user")
+            try:
+                yield
+            finally:
+                user_semaphore.release()
+        finally:
+            self._release_user(user_id)
+
+    @contextmanager
+    def slot(self, user_id=None, per_user=True):
+        """
+        Hold one per-user and one per-process concurrency slot.
+
+        per_user=False takes only the process slot, for calls made under a
+        user_slot the caller already holds.
+        """
+        if user_id is None or not per_user:
+            with self._process_slot(self.queue_timeout):
+                yield
+            return
+
+        deadline = time.monotonic() + self.queue_timeout
+        with self.user_slot(user_id):
+            with self._process_slot(max(0, deadline - time.monotonic())):
+                yield
+
+    @contextmanager
+    def _process_slot(self, timeout):
+        if not self.process_slots.acquire(timeout=timeout):
+            raise AIBusyError("AI gateway is saturated")
+        try:
+            yield
+        finally:
+            self.process_slots.release()
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.RateLimitError):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    def _backoff(self, attempt, error):
+        # Honour Retry-After from 429s when the provider sends it
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        # Full jitter: uniform(0, base * 2^attempt), capped
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _create(self, metrics=None, **params):
+        """chat.completions.create with breaker and retries"""
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self.client.chat.completions.create(**params)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # 4xx are our fault, not the provider's
+                    self.breaker.record_client_error()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                print(f"OpenAI call failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                if metrics is not None:
+                    metrics.retries = attempt
+            else:
+                self.breaker.record_success()
+                return result
+
+    @staticmethod
+    def _reserve(messages, model, max_tokens, user_id):
+        """Take the worst-case cost of a call from the user's and hospital's budgets"""
+        cost = sum(message_tokens(m, model) for m in messages) + max_tokens
+        return budgets.reserve(user_id, cost)
+
+    def complete(self, messages, model="gpt-4o", max_tokens=3000, user_id=None, per_user_slot=True, **params):
+        """Run a chat completion and return the reply text (see slot for per_user_slot)"""
+        params.setdefault("temperature", 0.3)
+        params.setdefault("top_p", 0.9)
+        reservation = self._reserve(messages, model, max_tokens, user_id)
+        metrics = CallMetrics(model, user_id)
+        reply = ""
+        try:
+            with self.slot(user_id, per_user=per_user_slot):
+                metrics.acquired()
+                response = self._create(
+                    metrics, model=model, messages=messages, max_tokens=max_tokens, **params
+                )
+            metrics.set_usage(response.usage)
+            reply = response.choices[0].message.content
+            return reply
+        except BaseException as e:
+            metrics.fail(e)
+            raise
+        finally:
+            metrics.save(messages, reply or "")
+            reservation.settle(metrics.billed_tokens)
+
+    def stream(self, messages, model="gpt-4o", max_tokens=3000, user_id=None, **params):
+        """
+        Iterator of reply text deltas; the concurrency slot is held until the stream ends.
+
+        The budget is reserved right away, so a refused call raises
+        AIBudgetExceeded here, before the caller has started a response.
+        """
+        params.setdefault("temperature", 0.3)
+        params.setdefault("top_p", 0.9)
+        # The last chunk then carries token usage
+        params.setdefault("stream_options", {"include_usage": True})
+        reservation = self._reserve(messages, model, max_tokens, user_id)
+        return self._stream(reservation, messages, model, max_tokens, user_id, params)
+
+    def _stream(self, reservation, messages, model, max_tokens, user_id, params):
+        metrics = CallMetrics(model, user_id, streamed=True)
+        parts = []
+        try:
+            with self.slot(user_id):
+                metrics.acquired()
+                # Only opening the stream is retried - a half-sent reply is not replayed
+                stream = self._create(
+                    metrics, model=model, messages=messages, max_tokens=max_tokens, stream=True, **params
+                )
+                try:
+                    for chunk in stream:
+                        if getattr(chunk, "usage", None) is not None:
+                            metrics.set_usage(chunk.usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            metrics.first_token()
+                            parts.append(delta)
+                            yield delta
+                finally:
+                    # Release the upstream connection if the client went away mid-stream
+                    stream.close()
+        except BaseException as e:
+            metrics.fail(e)
+            raise
+        finally:
+            metrics.save(messages, "".join(parts))
+            reservation.settle(metrics.billed_tokens)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Process-wide AIGateway instance"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = AIGateway()
+    return _gateway
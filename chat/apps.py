@@ -4,3 +4,29 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # Coalescing across workers needs a shared cache
+        from django.core import checks
+
+        from .coalescing import check_shared_cache
+
+        checks.register(check_shared_cache, "caches")
+
+        # Case histories feed the recall index (chat/recall.py), indexed by Celery
+        from functools import partial
+
+        from django.db import transaction
+        from django.db.models.signals import post_save
+        from patients.models import KasallikTarixi
+
+        from .tasks import delay_or_run, index_case_history
+
+        post_save.connect(
+            lambda sender, instance, **kwargs: transaction.on_commit(
+                partial(delay_or_run, index_case_history, instance.id)
+            ),
+            sender=KasallikTarixi,
+            weak=False,
+            dispatch_uid="chat.tasks.index_case_history",
+        )
@@ -0,0 +1,334 @@
+"""
+AI token budgets per user and per hospital.
+
+Every gateway call first reserves its worst-case token cost (prompt tokens
+plus max_tokens, the same way OpenAI's own TPM limiter counts) from:
+
+- a token bucket (tokens per minute, with a burst capacity);
+- a daily token quota.
+
+Both are kept for the doctor (User) and for their Doctor.hospital. A call
+that does not fit raises AIBudgetExceeded before OpenAI is contacted. Once
+the call finishes, the reservation is settled against the real usage and
+the difference is given back.
+
+Counters live in Redis (AI_BUDGET_BACKEND = "redis"), shared by all
+processes. The "memory" backend keeps them in-process, for tests and
+single-process setups. If Redis is unreachable, calls are let through
+rather than failing every AI request.
+
+Views answer a refused call with exceeded_response() (429 with
+Retry-After) and store no fallback reply. AIBudgetHeadersMiddleware
+reports what is left as X-AI-Budget-* response headers, and still turns
+the generic 5xx of a view that did not catch the refusal into that 429.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+
+from . import telemetry
+
+
+DEFAULT_BUDGETS = {
+    "user": {"tokens_per_minute": 60000, "burst": 60000, "daily_tokens": 1000000},
+    "hospital": {"tokens_per_minute": 400000, "burst": 400000, "daily_tokens": 20000000},
+}
+
+DAY_TTL = 2 * 24 * 3600
+HOSPITAL_CACHE_TTL = 300
+
+# Atomic check-and-reserve for one scope.
+# KEYS: bucket hash, day counter
+# ARGV: burst, refill per second, now, cost, daily quota, day key TTL
+# Returns: allowed (1/0), bucket level, tokens used today, seconds to wait
+RESERVE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local quota = tonumber(ARGV[5])
+
+local state = redis.call('HMGET', KEYS[1], 'level', 'ts')
+local level = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+level = math.min(burst, level + math.max(0, now - ts) * rate)
+local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+
+if burst > 0 and level < math.min(cost, burst) then
+    return {0, tostring(level), used, tostring((math.min(cost, burst) - level) / rate)}
+end
+if quota > 0 and used + cost > quota then
+    return {0, tostring(level), used, '-1'}
+end
+
+if burst > 0 then
+    level = level - cost
+    redis.call('HSET', KEYS[1], 'level', level, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+end
+used = redis.call('INCRBY', KEYS[2], cost)
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[6]))
+return {1, tostring(level), used, '0'}
+"""
+
+# Give back (delta < 0: charge more) tokens once the real usage is known.
+# Keys that expired meanwhile are left alone - recreating them would leave
+# counters without a TTL - and the remaining TTL is kept on the others.
+# KEYS: bucket hash, day counter
+# ARGV: burst, delta
+SETTLE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local delta = tonumber(ARGV[2])
+
+local ttl = redis.call('PTTL', KEYS[1])
+if burst > 0 and ttl ~= -2 then
+    local level = tonumber(redis.call('HGET', KEYS[1], 'level')) or burst
+    redis.call('HSET', KEYS[1], 'level', tostring(math.min(burst, level + delta)))
+    if ttl > 0 then
+        redis.call('PEXPIRE', KEYS[1], ttl)
+    end
+end
+
+ttl = redis.call('PTTL', KEYS[2])
+if ttl ~= -2 then
+    local used = math.max(0, tonumber(redis.call('GET', KEYS[2]) or '0') - delta)
+    if ttl > 0 then
+        redis.call('SET', KEYS[2], used, 'PX', ttl)
+    else
+        redis.call('SET', KEYS[2], used)
+    end
+end
+return 1
+"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _limits(scope_kind):
+    limits = dict(DEFAULT_BUDGETS[scope_kind])
+    limits.update(_setting("AI_BUDGETS", {}).get(scope_kind, {}))
+    return limits
+
+
+def _seconds_to_midnight():
+    now = timezone.localtime()
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((tomorrow - now).total_seconds()) + 1
+
+
+class MemoryCounters:
+    """In-process counters with the same semantics as the Redis script"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.days = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, bucket_key, day_key, burst, rate, now, cost, quota):
+        with self.lock:
+            level, ts = self.buckets.get(bucket_key, (burst, now))
+            level = min(burst, level + max(0, now - ts) * rate)
+            used = self.days.get(day_key, 0)
+            if burst > 0 and level < min(cost, burst):
+                return False, level, used, (min(cost, burst) - level) / rate
+            if quota > 0 and used + cost > quota:
+                return False, level, used, -1
+            if burst > 0:
+                level -= cost
+                self.buckets[bucket_key] = (level, now)
+            self.days[day_key] = used + cost
+            return True, level, used + cost, 0
+
+    def adjust(self, bucket_key, day_key, burst, delta):
+        """Give back (delta < 0: charge more) tokens after the real usage is known"""
+        with self.lock:
+            if bucket_key in self.buckets:
+                level, ts = self.buckets[bucket_key]
+                self.buckets[bucket_key] = (min(burst, level + delta), ts)
+            if day_key in self.days:
+                self.days[day_key] = max(0, self.days[day_key] - delta)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.days.clear()
+
+
+class RedisCounters:
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.script = self.client.register_script(RESERVE_SCRIPT)
+        self.settle_script = self.client.register_script(SETTLE_SCRIPT)
+
+    def reserve(self, bucket_key, day_key, burst, rate, now, cost, quota):
+        allowed, level, used, wait = self.script(
+            keys=[bucket_key, day_key], args=[burst, rate, now, cost, quota, DAY_TTL]
+        )
+        return bool(allowed), float(level), int(used), float(wait)
+
+    def adjust(self, bucket_key, day_key, burst, delta):
+        self.settle_script(keys=[bucket_key, day_key], args=[burst, int(delta)])
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def get_counters():
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                if _setting("AI_BUDGET_BACKEND", "redis") == "memory":
+                    _counters = MemoryCounters()
+                else:
+                    _counters = RedisCounters(_setting("AI_BUDGET_REDIS_URL", "redis://localhost:6379/0"))
+    return _counters
+
+
+_MISSING = object()
+
+
+def hospital_for_user(user_id):
+    """Doctor.hospital id for a user (cached for a few minutes), or None"""
+    from doctors.models import Doctor
+
+    cache_key = f"ai-budget-hospital-{user_id}"
+    hospital_id = cache.get(cache_key, _MISSING)
+    if hospital_id is not _MISSING:
+        return hospital_id
+    hospital_id = (
+        Doctor.objects.filter(user_id=user_id).values_list("hospital_id", flat=True).first()
+    )
+    cache.set(cache_key, hospital_id, HOSPITAL_CACHE_TTL)
+    return hospital_id
+
+
+class Reservation:
+    """Tokens reserved for one call in each scope; settle() once usage is known"""
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.entries = []  # (bucket key, day key, burst)
+
+    def settle(self, used_tokens):
+        delta = self.cost - (used_tokens if used_tokens is not None else self.cost)
+        if not delta or not self.entries:
+            return
+        try:
+            counters = get_counters()
+            for bucket_key, day_key, burst in self.entries:
+                counters.adjust(bucket_key, day_key, burst, delta)
+        except Exception as e:
+            print(f"AI budget settle failed: {e}")
+
+
+def reserve(user_id, cost):
+    """
+    Reserve cost tokens for user_id and their hospital.
+
+    Raises AIBudgetExceeded if any scope is over its rate or daily quota;
+    whatever was already reserved in the other scope is given back.
+    """
+    from .ai_gateway import AIBudgetExceeded
+
+    reservation = Reservation(cost)
+    if user_id is None or not _setting("AI_BUDGETS_ENABLED", True):
+        return reservation
+
+    scopes = [("user", user_id)]
+    hospital_id = hospital_for_user(user_id)
+    if hospital_id is not None:
+        scopes.append(("hospital", hospital_id))
+
+    day = timezone.localdate().strftime("%Y%m%d")
+    now = time.time()
+    remaining = {}
+    try:
+        counters = get_counters()
+        for kind, scope_id in scopes:
+            limits = _limits(kind)
+            # tokens_per_minute / daily_tokens of 0 or None switch that limit off
+            rate = (limits["tokens_per_minute"] or 0) / 60.0
+            burst = (limits["burst"] or limits["tokens_per_minute"]) if rate else 0
+            quota = limits["daily_tokens"] or 0
+            bucket_key = f"ai-budget:bucket:{kind}:{scope_id}"
+            day_key = f"ai-budget:day:{kind}:{scope_id}:{day}"
+
+            allowed, level, used, wait = counters.reserve(
+                bucket_key, day_key, burst, rate or 1.0, now, cost, quota
+            )
+            if not allowed:
+                if wait < 0:
+                    raise AIBudgetExceeded(kind, "daily", _seconds_to_midnight())
+                raise AIBudgetExceeded(kind, "rate", max(1, int(wait + 0.999)))
+
+            reservation.entries.append((bucket_key, day_key, burst))
+            if quota:
+                remaining[f"{kind}_daily"] = max(0, quota - used)
+            if burst:
+                remaining[f"{kind}_minute"] = max(0, int(level))
+    except AIBudgetExceeded as e:
+        reservation.settle(0)
+        telemetry.annotate(budget_exceeded=e)
+        raise
+    except Exception as e:
+        # Counters down: fail open rather than refuse every AI call
+        print(f"AI budget check skipped: {e}")
+        return reservation
+
+    telemetry.annotate(budget_remaining=remaining)
+    return reservation
+
+
+def exceeded_response(exceeded):
+    """429 with Retry-After for a call refused with AIBudgetExceeded"""
+    response = JsonResponse(
+        {
+            "error": "AI token budget exceeded",
+            "scope": exceeded.scope,
+            "limit": exceeded.limit,
+            "retry_after": exceeded.retry_after,
+            "status": "error",
+        },
+        status=429,
+    )
+    response["Retry-After"] = str(exceeded.retry_after)
+    return response
+
+
+class AIBudgetHeadersMiddleware(MiddlewareMixin):
+    """
+    X-AI-Budget-Remaining-Daily / -Minute headers (lowest across user and
+    hospital) for requests that called the AI, and 429 for refused calls.
+
+    Must come after AITelemetryMiddleware in MIDDLEWARE, so it handles the
+    response while the request's AI context is still there.
+    """
+
+    def process_response(self, request, response):
+        context = telemetry.current() or {}
+        exceeded = context.get("budget_exceeded")
+        if exceeded is not None and not response.streaming and response.status_code >= 500:
+            # The view caught the error and answered with its generic fallback
+            response = exceeded_response(exceeded)
+
+        remaining = context.get("budget_remaining")
+        if remaining:
+            daily = [v for k, v in remaining.items() if k.endswith("_daily")]
+            minute = [v for k, v in remaining.items() if k.endswith("_minute")]
+            if daily:
+                response["X-AI-Budget-Remaining-Daily"] = str(min(daily))
+            if minute:
+                response["X-AI-Budget-Remaining-Minute"] = str(min(minute))
+        return response
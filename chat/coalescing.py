@@ -0,0 +1,247 @@
+"""
+Request coalescing for AI endpoints.
+
+Double-clicks and frontend retries often send the same analysis or chat
+message twice. Views wrapped with ``coalesced`` are keyed on a hash of
+(user, endpoint, normalized payload):
+
+- concurrent duplicates wait for the first request and get a copy of its
+  response instead of starting their own completion (single flight);
+- once the first request has finished, the same payload runs again - a
+  doctor may well send "ok" twice on purpose;
+- with an ``Idempotency-Key`` header the response is kept for
+  AI_IDEMPOTENCY_TTL seconds and any retry with that key replays it.
+
+Results are shared across processes through the Django cache; waiting for
+an in-flight request in the same process uses an event, not polling. With
+several workers the default cache must be shared (CACHE_BACKEND=redis): a
+per-process cache such as LocMemCache only coalesces requests that land on
+the same worker, and Idempotency-Key retries routed elsewhere run again.
+check_shared_cache warns about that at startup.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.http import HttpRequest
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# Backends that keep entries inside one process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    """System check: coalescing across workers needs a shared default cache"""
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    if not _setting("AI_COALESCE_ENABLED", True) or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        checks.Warning(
+            f"AI request coalescing uses the process-local cache {backend}",
+            hint="Duplicates and Idempotency-Key retries are only caught within one worker; "
+            "set CACHE_BACKEND=redis when running several.",
+            id="chat.W001",
+        )
+    ]
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _file_digest(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def request_fingerprint(request, endpoint, view_kwargs=None):
+    """SHA-256 of user, endpoint, URL kwargs, query string and normalized body"""
+    data = request.data
+    if hasattr(data, "lists"):  # QueryDict from form / multipart
+        body = {key: values if len(values) > 1 else values[0] for key, values in data.lists()}
+    else:
+        body = data
+    files = {key: [_file_digest(upload) for upload in uploads] for key, uploads in request.FILES.lists()}
+    body = {k: v for k, v in (body or {}).items() if k not in files}
+
+    payload = json.dumps(
+        {
+            "user": request.user.pk,
+            "endpoint": endpoint,
+            "kwargs": _normalize(view_kwargs or {}),
+            "query": sorted(request.query_params.items()),
+            "body": _normalize(body),
+            "files": files,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _snapshot(response):
+    """Shareable copy of a DRF response, or None if it cannot be replayed"""
+    if not isinstance(response, Response) or response.status_code >= 500:
+        return None
+    return {"status": response.status_code, "data": response.data}
+
+
+def _replay(snapshot, request, replayed_header):
+    from .views import add_cors_headers
+
+    response = Response(snapshot["data"], status=snapshot["status"])
+    response[replayed_header] = "true"
+    return add_cors_headers(response, request)
+
+
+def _wait_elsewhere(result_key, inflight_key):
+    """Wait for another process running the same request; its snapshot or None"""
+    deadline = time.monotonic() + _setting("AI_COALESCE_WAIT", 120)
+    while time.monotonic() < deadline:
+        snapshot = cache.get(result_key)
+        if snapshot is not None:
+            return snapshot
+        if cache.get(inflight_key) is None:
+            # The other request failed or its lock expired
+            return cache.get(result_key)
+        time.sleep(0.2)
+    return None
+
+
+def _run_once(fingerprint, run):
+    """
+    Single flight: the first caller runs the view, duplicates that arrive
+    while it runs get its snapshot.
+
+    Returns (response, snapshot); response is None for followers. The
+    snapshot is only published for AI_COALESCE_WINDOW seconds, long enough
+    for followers polling from other processes to pick it up.
+    """
+    result_key = f"ai-coalesce-result-{fingerprint}"
+    inflight_key = f"ai-coalesce-inflight-{fingerprint}"
+
+    with _calls_lock:
+        call = _calls.get(fingerprint)
+        leader = call is None
+        if leader:
+            call = _calls[fingerprint] = _Call()
+
+    if not leader:
+        call.done.wait(_setting("AI_COALESCE_WAIT", 120))
+        if call.snapshot is not None:
+            return None, call.snapshot
+        # The first request failed - try on our own
+        return run(), None
+
+    try:
+        if cache.add(inflight_key, True, _setting("AI_COALESCE_WAIT", 120)):
+            # A result left by an earlier, finished run is not ours to replay
+            cache.delete(result_key)
+        else:
+            snapshot = _wait_elsewhere(result_key, inflight_key)
+            if snapshot is not None:
+                call.snapshot = snapshot
+                return None, snapshot
+        try:
+            response = run()
+            call.snapshot = _snapshot(response)
+            if call.snapshot is not None:
+                cache.set(result_key, call.snapshot, _setting("AI_COALESCE_WINDOW", 10))
+            return response, call.snapshot
+        finally:
+            cache.delete(inflight_key)
+    finally:
+        with _calls_lock:
+            _calls.pop(fingerprint, None)
+        call.done.set()
+
+
+def coalesced(endpoint):
+    """
+    Decorator for POST views and viewset actions that call the AI.
+
+    Put it under @api_view / @action so the request is already a DRF
+    request. Streaming responses are never shared.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = next(a for a in args if isinstance(a, (Request, HttpRequest)))
+            if (
+                request.method != "POST"
+                or not request.user.is_authenticated
+                or not _setting("AI_COALESCE_ENABLED", True)
+                or request.query_params.get("stream") in ("1", "true")
+            ):
+                return view(*args, **kwargs)
+
+            fingerprint = request_fingerprint(request, endpoint, kwargs)
+            idempotency_key = request.headers.get("Idempotency-Key")
+            stored_key = None
+            if idempotency_key:
+                key_hash = hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+                stored_key = f"ai-idempotency-{request.user.pk}-{endpoint}-{key_hash}"
+                stored = cache.get(stored_key)
+                if stored is not None:
+                    if stored["fingerprint"] != fingerprint:
+                        from .views import add_cors_headers
+
+                        response = Response(
+                            {"error": "Idempotency-Key was already used with a different request"},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        )
+                        return add_cors_headers(response, request)
+                    return _replay(stored["response"], request, "Idempotent-Replayed")
+
+            response, snapshot = _run_once(fingerprint, lambda: view(*args, **kwargs))
+
+            if stored_key and snapshot is not None:
+                cache.set(
+                    stored_key,
+                    {"fingerprint": fingerprint, "response": snapshot},
+                    _setting("AI_IDEMPOTENCY_TTL", 24 * 3600),
+                )
+            if response is None:
+                print(f"Coalesced duplicate {endpoint} request from user {request.user.pk}")
+                return _replay(snapshot, request, "X-Coalesced")
+            return response
+
+        return wrapper
+
+    return decorator
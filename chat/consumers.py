@@ -0,0 +1,67 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from . import realtime
+from .models import Chat
+
+# Close codes in the 4000 range are free for applications
+CLOSE_FORBIDDEN = 4403
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Live events of one doctor–patient Chat (see chat/realtime.py).
+
+    Clients send {"type": "typing", "is_typing": true}, {"type": "read"} or
+    {"type": "ping"}; messages themselves are sent through the REST API.
+    """
+
+    async def connect(self):
+        self.chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
+        self.group_name = None
+        user = self.scope.get("user")
+        self.sender_type = None
+        if user is not None and user.is_authenticated:
+            self.sender_type = await self._participant_type(user)
+        if self.sender_type is None:
+            await self.close(code=CLOSE_FORBIDDEN)
+            return
+
+        self.user_id = user.id
+        self.group_name = realtime.group_name(self.chat_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        kind = content.get("type") if isinstance(content, dict) else None
+        if kind == "typing":
+            data = {
+                "user_id": self.user_id,
+                "sender_type": self.sender_type,
+                "is_typing": bool(content.get("is_typing", True)),
+            }
+            await self.channel_layer.group_send(
+                self.group_name, realtime.event_message("typing", data, exclude=self.channel_name)
+            )
+        elif kind == "read":
+            await self._mark_read()
+        elif kind == "ping":
+            await self.send_json({"type": "pong"})
+
+    async def chat_event(self, event):
+        if event.get("exclude") == self.channel_name:
+            return
+        await self.send_json({"type": event["event"], "data": event["data"]})
+
+    @database_sync_to_async
+    def _participant_type(self, user):
+        chat = Chat.objects.filter(id=self.chat_id).select_related("doctor", "patient").first()
+        return realtime.participant_type(user, chat) if chat else None
+
+    @database_sync_to_async
+    def _mark_read(self):
+        realtime.mark_read(Chat.objects.get(id=self.chat_id), self.sender_type, self.user_id)
@@ -0,0 +1,161 @@
+"""
+Token-aware context window builder for OpenAI chat requests.
+
+Messages are packed newest-first into a per-model token budget that leaves
+room for the completion (max_tokens). Token counts of stored chat messages
+are cached on Message.token_count, so each turn only tokenizes new text.
+"""
+import math
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, fall back to an estimate
+    tiktoken = None
+
+
+# Extra tokens OpenAI adds around every chat message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Flat estimate for an image part (high detail, ~1 tile set)
+IMAGE_PART_TOKENS = 765
+# Never pack the window completely full
+SAFETY_MARGIN_TOKENS = 256
+
+# Header of the system message carrying ChatSession.summary
+SUMMARY_PREFIX = "Краткое содержание предыдущей части консультации:\n"
+
+DEFAULT_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # BPE files could not be loaded (offline box) - use the estimate
+        print(f"tiktoken unavailable, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Number of tokens in text for the given model"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    # ~4 chars per token for Latin text, ~3 for Cyrillic; errs on the high side
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5)
+
+
+def message_tokens(message, model="gpt-4o"):
+    """Tokens used by one OpenAI chat message dict, including image parts"""
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for part in content:
+        if part.get("type") == "image_url":
+            tokens += IMAGE_PART_TOKENS
+        else:
+            tokens += count_tokens(part.get("text", ""), model)
+    return tokens
+
+
+def context_budget(model, max_tokens):
+    """Prompt tokens available for the model once max_tokens is reserved"""
+    window = getattr(settings, "AI_CONTEXT_WINDOWS", {}).get(
+        model, DEFAULT_CONTEXT_WINDOWS.get(model, 128000)
+    )
+    budget = getattr(settings, "AI_CONTEXT_BUDGETS", {}).get(model, window)
+    return min(budget, window - max_tokens) - SAFETY_MARGIN_TOKENS
+
+
+def fit_messages(messages, model="gpt-4o", max_tokens=3000):
+    """
+    Trim an OpenAI message list to the model budget.
+
+    System messages are always kept; the rest are kept newest-first while
+    they fit, so the current question is never dropped.
+    """
+    budget = context_budget(model, max_tokens)
+    system = [m for m in messages if m.get("role") == "system"]
+    used = sum(message_tokens(m, model) for m in system)
+
+    kept = []
+    for message in reversed([m for m in messages if m.get("role") != "system"]):
+        tokens = message_tokens(message, model)
+        if kept and used + tokens > budget:
+            break
+        kept.append(message)
+        used += tokens
+
+    if len(kept) + len(system) < len(messages):
+        print(f"Context trimmed to {len(kept)} messages (~{used} tokens)")
+    return system + kept[::-1]
+
+
+def build_session_context(
+    session, system_prompt, model="gpt-4o", max_tokens=3000, page_size=50, system_tokens=None
+):
+    """
+    OpenAI messages for a ChatSession: the system prompt, the rolling
+    summary of older turns (if any) and as much of the remaining recent
+    history as fits in the budget, oldest first.
+
+    History is read newest-first in pages and only until the budget is
+    full, using the cached Message.token_count values. system_tokens is the
+    precomputed size of a registry prompt (see chat.prompts).
+    """
+    budget = context_budget(model, max_tokens)
+    if system_tokens is None:
+        system_tokens = count_tokens(system_prompt, model)
+    used = system_tokens + MESSAGE_OVERHEAD_TOKENS
+    prefix = [{"role": "system", "content": system_prompt}]
+
+    history = []
+    queryset = session.messages.order_by("-created_at", "-id").only(
+        "id", "role", "content", "token_count"
+    )
+    if session.summary and session.summary_upto_id:
+        summary_message = {"role": "system", "content": SUMMARY_PREFIX + session.summary}
+        prefix.append(summary_message)
+        used += message_tokens(summary_message, model)
+        queryset = queryset.filter(id__gt=session.summary_upto_id)
+    offset = 0
+    full = False
+    while not full:
+        page = list(queryset[offset:offset + page_size])
+        if not page:
+            break
+        offset += page_size
+
+        stale = []
+        for msg in page:
+            if msg.token_count is None:
+                msg.token_count = count_tokens(msg.content, model)
+                stale.append(msg)
+            tokens = msg.token_count + MESSAGE_OVERHEAD_TOKENS
+            if history and used + tokens > budget:
+                full = True
+                break
+            history.append({"role": msg.role, "content": msg.content})
+            used += tokens
+
+        if stale:
+            # Backfill rows saved before token counts were cached
+            type(stale[0]).objects.bulk_update(stale, ["token_count"])
+
+    return prefix + history[::-1]
@@ -0,0 +1,206 @@
+"""
+OpenAI-compatible stand-in for /v1/chat/completions, for load and latency
+benchmarks without spending real tokens.
+
+Two ways to use it:
+
+- as a server: ``python manage.py run_fake_openai --port 8765`` and point the
+  app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1;
+- in-process: AI_FAKE_MODE=True makes the AI gateway answer from the same
+  code through an httpx mock transport, with no sockets involved.
+
+Replies are canned (``reply``) or sized in proportion to the prompt, capped by
+max_tokens. Latency, per-token streaming delay and error injection are set in
+the AI_FAKE_OPENAI settings dict or on the command line.
+"""
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+from .context import count_tokens, message_tokens
+
+try:
+    import httpx
+except ImportError:  # newer openai releases ship httpx2
+    import httpx2 as httpx
+
+
+FILLER_WORDS = (
+    "Анализирую медицинские данные. Предварительный диагноз требует уточнения. "
+    "Рекомендую следующие исследования: общий анализ крови, биохимия, УЗИ. "
+    "Тактика лечения зависит от результатов обследования."
+).split()
+
+DEFAULT_CONFIG = {
+    "latency": 0.3,  # seconds before the first byte
+    "token_delay": 0.005,  # seconds between streamed tokens
+    "error_rate": 0.0,  # share of requests answered with error_status
+    "error_status": 503,
+    "retry_after": None,  # Retry-After header sent with injected errors
+    "reply": None,  # fixed reply text; None = size-proportional filler
+    "completion_ratio": 0.5,  # completion tokens per prompt token
+    "min_completion_tokens": 20,
+}
+
+
+def get_config(**overrides):
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, "AI_FAKE_OPENAI", {}))
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+class FakeChatCompletions:
+    def __init__(self, **overrides):
+        self.config = get_config(**overrides)
+
+    def _reply_tokens(self, body):
+        if self.config["reply"] is not None:
+            return self.config["reply"].split(" ")
+
+        model = body.get("model", "gpt-4o")
+        prompt_tokens = sum(message_tokens(m, model) for m in body.get("messages", []))
+        wanted = max(
+            self.config["min_completion_tokens"],
+            int(prompt_tokens * self.config["completion_ratio"]),
+        )
+        wanted = min(wanted, body.get("max_tokens") or wanted)
+        return [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(wanted)]
+
+    def _usage(self, body, text):
+        model = body.get("model", "gpt-4o")
+        prompt_tokens = sum(message_tokens(m, model) for m in body.get("messages", []))
+        completion_tokens = count_tokens(text, model)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _error(self):
+        status = self.config["error_status"]
+        headers = {"content-type": "application/json"}
+        if self.config["retry_after"] is not None:
+            headers["retry-after"] = str(self.config["retry_after"])
+        body = {
+            "error": {
+                "message": f"Injected fake error ({status})",
+                "type": "rate_limit_error" if status == 429 else "server_error",
+                "code": None,
+            }
+        }
+        return status, headers, [json.dumps(body).encode()]
+
+    def handle(self, body):
+        """Answer one chat.completions request: (status, headers, body chunks)"""
+        time.sleep(self.config["latency"])
+        if self.config["error_rate"] and random.random() < self.config["error_rate"]:
+            return self._error()
+
+        words = self._reply_tokens(body)
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "gpt-4o")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            text = " ".join(words)
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": self._usage(body, text),
+            }
+            return 200, {"content-type": "application/json"}, [json.dumps(payload).encode()]
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        return 200, {"content-type": "text/event-stream"}, self._stream(
+            body, words, completion_id, model, created, include_usage
+        )
+
+    def _stream(self, body, words, completion_id, model, created, include_usage):
+        def chunk(delta, finish_reason=None, usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if usage else [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            if usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+        yield chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            if self.config["token_delay"]:
+                time.sleep(self.config["token_delay"])
+            yield chunk({"content": word if i == 0 else f" {word}"})
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk({}, usage=self._usage(body, " ".join(words)))
+        yield b"data: [DONE]\n\n"
+
+
+def make_transport(**overrides):
+    """httpx transport that answers OpenAI requests in-process"""
+    fake = FakeChatCompletions(**overrides)
+
+    def handler(request):
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": "Not found"}})
+        status, headers, chunks = fake.handle(json.loads(request.content or b"{}"))
+        return httpx.Response(status, headers=headers, content=iter(chunks))
+
+    return httpx.MockTransport(handler)
+
+
+def make_server(host="127.0.0.1", port=8765, **overrides):
+    """Threaded HTTP server speaking the chat.completions API"""
+    fake = FakeChatCompletions(**overrides)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            status, headers, chunks = fake.handle(body)
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if headers.get("content-type") == "text/event-stream":
+                # Stream until the end, then close the connection
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for data in chunks:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                self.close_connection = True
+            else:
+                data = b"".join(chunks)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
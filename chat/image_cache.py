@@ -0,0 +1,125 @@
+"""
+Content-addressed cache of medical image analyses.
+
+The key is the SHA-256 of the image bytes combined with the prompt text,
+language and model, so re-uploading the same study with the same request
+returns the stored analysis instead of another vision call. A small
+in-process LRU sits in front of the persistent ImageAnalysisCache table;
+both honour AI_IMAGE_CACHE_TTL.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ImageAnalysisCache
+
+
+CacheKey = namedtuple("CacheKey", ["digest", "image_sha256", "model", "language"])
+
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, "AI_IMAGE_CACHE_TTL", 30 * 24 * 3600))
+
+
+def _max_entries():
+    return getattr(settings, "AI_IMAGE_CACHE_MAX_ENTRIES", 256)
+
+
+def _prompt_text(messages):
+    """All text sent with the image (system prompt, instructions, user text)"""
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(f"{message.get('role')}:{content}")
+        else:
+            for part in content or []:
+                if part.get("type") == "text":
+                    parts.append(f"{message.get('role')}:{part.get('text', '')}")
+    return "\n".join(parts)
+
+
+def make_key(image_bytes, messages, model="gpt-4o", language="ru"):
+    image_sha256 = hashlib.sha256(image_bytes).hexdigest()
+    prompt_sha256 = hashlib.sha256(_prompt_text(messages).encode("utf-8")).hexdigest()
+    digest = hashlib.sha256(
+        f"{image_sha256}|{prompt_sha256}|{language}|{model}".encode("utf-8")
+    ).hexdigest()
+    return CacheKey(digest, image_sha256, model, language)
+
+
+def _remember(digest, result, created_at):
+    with _memory_lock:
+        _memory[digest] = (result, created_at)
+        _memory.move_to_end(digest)
+        while len(_memory) > _max_entries():
+            _memory.popitem(last=False)
+
+
+def get(key):
+    """Cached analysis for key, or None"""
+    oldest = timezone.now() - _ttl()
+
+    with _memory_lock:
+        entry = _memory.get(key.digest)
+        if entry is not None:
+            if entry[1] >= oldest:
+                _memory.move_to_end(key.digest)
+            else:
+                del _memory[key.digest]
+                entry = None
+
+    if entry is None:
+        row = (
+            ImageAnalysisCache.objects.filter(key=key.digest, created_at__gte=oldest)
+            .only("result", "created_at")
+            .first()
+        )
+        if row is None:
+            return None
+        entry = (row.result, row.created_at)
+        _remember(key.digest, *entry)
+
+    ImageAnalysisCache.objects.filter(key=key.digest).update(
+        hits=F("hits") + 1, last_used_at=timezone.now()
+    )
+    return entry[0]
+
+
+def store(key, result):
+    now = timezone.now()
+    ImageAnalysisCache.objects.update_or_create(
+        key=key.digest,
+        defaults={
+            "image_sha256": key.image_sha256,
+            "model": key.model,
+            "language": key.language,
+            "result": result,
+            "created_at": now,
+            "last_used_at": now,
+        },
+    )
+    _remember(key.digest, result, now)
+
+
+def prune():
+    """Delete expired rows and, past AI_IMAGE_CACHE_MAX_ROWS, the least recently used"""
+    deleted, _ = ImageAnalysisCache.objects.filter(
+        created_at__lt=timezone.now() - _ttl()
+    ).delete()
+
+    max_rows = getattr(settings, "AI_IMAGE_CACHE_MAX_ROWS", 50000)
+    stale_ids = list(
+        ImageAnalysisCache.objects.order_by("-last_used_at").values_list("id", flat=True)[max_rows:]
+    )
+    if stale_ids:
+        deleted += ImageAnalysisCache.objects.filter(id__in=stale_ids).delete()[0]
+    return deleted
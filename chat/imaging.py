@@ -0,0 +1,139 @@
+"""
+Image preprocessing before vision calls.
+
+Uploads (often 8-12 MB phone photos or PNG scans) are normalized before they
+are base64-encoded: EXIF orientation is applied, the image is downscaled to
+the largest edge the model actually uses, radiographs and other effectively
+grayscale images are stored as single-channel, and the result is re-encoded
+as JPEG with the correct MIME type. Work runs in a small bounded thread pool
+so a burst of uploads cannot exhaust CPU or memory.
+"""
+import base64
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageChops, ImageOps, UnidentifiedImageError
+
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+# Max per-pixel channel difference still treated as gray (JPEG noise, scanner tint)
+GRAYSCALE_TOLERANCE = 12
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "AI_IMAGE_WORKERS", 2),
+    thread_name_prefix="image-prep",
+)
+
+
+class RejectedImage(ValueError):
+    """The upload is an image Pillow refuses to decode (a decompression bomb)"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_grayscale(image):
+    """True if every pixel of an RGB image has (nearly) equal channels"""
+    if image.mode in ("1", "L", "LA", "I", "F") or image.mode.startswith("I;16"):
+        return True
+    sample = image.convert("RGB")
+    sample.thumbnail((256, 256))
+    r, g, b = sample.split()
+    return (
+        ImageChops.difference(r, g).getextrema()[1] <= GRAYSCALE_TOLERANCE
+        and ImageChops.difference(g, b).getextrema()[1] <= GRAYSCALE_TOLERANCE
+    )
+
+
+def to_8bit(image):
+    """
+    8-bit "L" copy of a 16-bit or float grayscale image (other modes unchanged).
+
+    convert("L") clips these modes at 255, which turns most of a 16-bit
+    radiograph white: 16-bit values are scaled down by 256 and 32-bit int /
+    float ones are stretched from their own min..max.
+    """
+    if image.mode.startswith("I;16"):
+        return image.convert("I").point(lambda v: v / 256).convert("L")
+    if image.mode in ("I", "F"):
+        image = image.convert("F")
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 0
+        return image.point(lambda v: (v - low) * scale).convert("L")
+    return image
+
+
+def normalize_image(image_bytes, max_edge=None, quality=None):
+    """
+    Return (bytes, mime) ready for a vision request.
+
+    Unreadable files are passed through unchanged; decompression bombs
+    (more than Image.MAX_IMAGE_PIXELS, or warned about under -W error)
+    raise RejectedImage. If the image needs no resize or rotation and
+    re-encoding would not make it smaller, the original is kept (with its
+    real MIME type).
+    """
+    max_edge = max_edge or _setting("AI_IMAGE_MAX_EDGE", 2048)
+    quality = quality or _setting("AI_IMAGE_JPEG_QUALITY", 85)
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        source_format = image.format
+        # Originals that need no resize or rotation may be sent as they are
+        untouched = max(image.size) <= max_edge and image.getexif().get(0x0112, 1) == 1
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft(image.mode, (max_edge, max_edge))
+        image = to_8bit(ImageOps.exif_transpose(image))
+
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        if image.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency onto white - JPEG has no alpha
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+
+        image = image.convert("L") if is_grayscale(image) else image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+        encoded = output.getvalue()
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        # Decoding would allocate gigabytes - never pass these on either
+        raise RejectedImage(str(e)) from e
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        # Not something Pillow can read (or truncated) - send it as it came
+        print(f"Image normalization skipped: {e}")
+        return image_bytes, "image/jpeg"
+
+    if untouched and len(encoded) >= len(image_bytes) and source_format in MIME_TYPES:
+        return image_bytes, MIME_TYPES[source_format]
+    return encoded, "image/jpeg"
+
+
+def prepare_image_data_url(image_bytes):
+    """Normalize an upload in the image pool and return it as a data: URL"""
+    timeout = _setting("AI_IMAGE_PREP_TIMEOUT", 30)
+    data, mime = _executor.submit(normalize_image, image_bytes).result(timeout=timeout)
+    return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def attach_image(messages, image_bytes):
+    """
+    Append the normalized upload to the last message of an OpenAI request.
+
+    Views build the text part first, so the image cache (keyed on the raw
+    bytes and the prompt) is checked before any normalization work.
+    """
+    image_part = {"type": "image_url", "image_url": {"url": prepare_image_data_url(image_bytes)}}
+    messages[-1]["content"].append(image_part)
+    return messages
@@ -0,0 +1,289 @@
+"""
+Reference ranges and H/L flags for medical form lab values.
+
+Every numeric oak_* / bio_* / imm_* / oam_* value of the form is evaluated in
+one NumPy pass: values are converted to the unit the table uses (g/dL ->
+g/L, mg/dL -> µmol/L, ...), compared with the reference range for the
+patient's sex and age, and get a z-score (the range taken as mean +- 1.96
+SD) and an "H" / "L" flag.
+
+A range printed on the lab sheet itself ("(норма 120-160)", added by
+chat/labs.py) wins over the table, since reagents and analyzers differ
+between laboratories. Values with a unit the table cannot convert and no
+sheet range are left unflagged.
+
+format_medical_form_data sends flagged values with their range and folds
+normal ones into a single line; /api/chat/lab-flags/ returns the same
+evaluation to the frontend without waiting for the AI.
+"""
+import re
+from datetime import date, datetime
+
+import numpy as np
+
+
+ADULT = 18
+
+# field: (label, unit, {unit key: factor to unit}, [(sex, min age, max age, low, high)])
+# sex None matches both; ages in years, max exclusive. The first matching row is used.
+REFERENCE_RANGES = {
+    # ОАК
+    "oak_wbc": ("WBC", "10^9/L", {"10^9/l": 1, "10^3/ul": 1, "g/l": 1}, [
+        (None, 0, 6, 5.0, 12.0), (None, 6, ADULT, 4.5, 10.0), (None, ADULT, None, 4.0, 9.0)]),
+    "oak_rbc": ("RBC", "10^12/L", {"10^12/l": 1, "10^6/ul": 1, "t/l": 1}, [
+        (None, 0, ADULT, 3.9, 5.3), ("m", ADULT, None, 4.0, 5.5), ("f", ADULT, None, 3.7, 4.7),
+        (None, ADULT, None, 3.7, 5.5)]),
+    "oak_hgb": ("HGB", "g/L", {"g/l": 1, "g/dl": 10}, [
+        (None, 0, 6, 110, 140), (None, 6, ADULT, 115, 150), ("m", ADULT, None, 130, 170),
+        ("f", ADULT, None, 120, 150), (None, ADULT, None, 120, 170)]),
+    "oak_hct": ("HCT", "%", {"%": 1, "l/l": 100}, [
+        (None, 0, ADULT, 33, 44), ("m", ADULT, None, 40, 50), ("f", ADULT, None, 36, 46),
+        (None, ADULT, None, 36, 50)]),
+    "oak_mcv": ("MCV", "fL", {"fl": 1, "um^3": 1}, [(None, 0, None, 80, 100)]),
+    "oak_mch": ("MCH", "pg", {"pg": 1}, [(None, 0, None, 27, 34)]),
+    "oak_mchc": ("MCHC", "g/L", {"g/l": 1, "g/dl": 10}, [(None, 0, None, 320, 360)]),
+    "oak_rdw_cv": ("RDW-CV", "%", {"%": 1}, [(None, 0, None, 11.5, 14.5)]),
+    "oak_rdw_sd": ("RDW-SD", "fL", {"fl": 1}, [(None, 0, None, 37, 54)]),
+    "oak_plt": ("PLT", "10^9/L", {"10^9/l": 1, "10^3/ul": 1, "g/l": 1}, [(None, 0, None, 150, 400)]),
+    "oak_pct": ("PCT", "%", {"%": 1}, [(None, 0, None, 0.15, 0.40)]),
+    "oak_mpv": ("MPV", "fL", {"fl": 1}, [(None, 0, None, 7.4, 10.4)]),
+    "oak_pdw": ("PDW", "fL", {"fl": 1}, [(None, 0, None, 10, 17)]),
+    # Биохимия
+    "bio_bilt": ("BIL-T", "µmol/L", {"umol/l": 1, "mg/dl": 17.1}, [(None, 0, None, 3.4, 20.5)]),
+    "bio_bild": ("BIL-D", "µmol/L", {"umol/l": 1, "mg/dl": 17.1}, [(None, 0, None, 0, 5.1)]),
+    "bio_ast": ("AST", "U/L", {"u/l": 1, "iu/l": 1}, [
+        ("m", ADULT, None, 0, 40), ("f", ADULT, None, 0, 32), (None, 0, None, 0, 40)]),
+    "bio_alt": ("ALT", "U/L", {"u/l": 1, "iu/l": 1}, [
+        ("m", ADULT, None, 0, 41), ("f", ADULT, None, 0, 33), (None, 0, None, 0, 41)]),
+    "bio_urea": ("UREA", "mmol/L", {"mmol/l": 1, "mg/dl": 0.357}, [(None, 0, None, 2.5, 8.3)]),
+    "bio_crea": ("CREA", "µmol/L", {"umol/l": 1, "mg/dl": 88.4}, [
+        (None, 0, ADULT, 27, 88), ("m", ADULT, None, 62, 106), ("f", ADULT, None, 44, 80),
+        (None, ADULT, None, 44, 106)]),
+    "bio_tp": ("TP", "g/L", {"g/l": 1, "g/dl": 10}, [(None, 0, None, 64, 83)]),
+    "bio_alb": ("ALB", "g/L", {"g/l": 1, "g/dl": 10}, [(None, 0, None, 35, 52)]),
+    "bio_glob": ("GLOB", "g/L", {"g/l": 1, "g/dl": 10}, [(None, 0, None, 20, 35)]),
+    "bio_alb_glob": ("A/G", "", {}, [(None, 0, None, 1.1, 2.1)]),
+    "bio_alp": ("ALP", "U/L", {"u/l": 1, "iu/l": 1}, [
+        (None, 0, ADULT, 0, 500), ("m", ADULT, None, 40, 130), ("f", ADULT, None, 35, 105),
+        (None, ADULT, None, 35, 130)]),
+    "bio_amy": ("AMY", "U/L", {"u/l": 1, "iu/l": 1}, [(None, 0, None, 28, 100)]),
+    "bio_glue": ("GLU", "mmol/L", {"mmol/l": 1, "mg/dl": 0.0555}, [(None, 0, None, 3.9, 6.1)]),
+    "bio_ldh": ("LDH", "U/L", {"u/l": 1, "iu/l": 1}, [(None, 0, None, 135, 225)]),
+    "bio_ritis": ("AST/ALT", "", {}, [(None, 0, None, 0.9, 1.75)]),
+    # Иммунология
+    "imm_leukocytes": ("Leukocytes", "10^9/L", {"10^9/l": 1, "10^3/ul": 1}, [(None, 0, None, 4.0, 9.0)]),
+    "imm_lymphocytes_percent": ("Lymphocytes", "%", {"%": 1}, [(None, 0, None, 19, 37)]),
+    "imm_cd3": ("CD3", "%", {"%": 1}, [(None, 0, None, 55, 84)]),
+    "imm_cd19": ("CD19", "%", {"%": 1}, [(None, 0, None, 6, 25)]),
+    "imm_cd16_cd56": ("CD16+CD56", "%", {"%": 1}, [(None, 0, None, 5, 27)]),
+    "imm_cd4_cd8_ratio": ("CD4/CD8", "", {}, [(None, 0, None, 1.0, 2.5)]),
+    "imm_igg": ("IgG", "g/L", {"g/l": 1, "mg/dl": 0.01}, [(None, 0, None, 7.0, 16.0)]),
+    "imm_igm": ("IgM", "g/L", {"g/l": 1, "mg/dl": 0.01}, [(None, 0, None, 0.4, 2.3)]),
+    "imm_iga": ("IgA", "g/L", {"g/l": 1, "mg/dl": 0.01}, [(None, 0, None, 0.7, 4.0)]),
+    # ОАМ (numeric fields only)
+    "oam_ph": ("pH", "", {}, [(None, 0, None, 5.0, 7.0)]),
+    "oam_specific_gravity": ("SG", "", {}, [(None, 0, None, 1.010, 1.025)]),
+}
+
+# Spellings on Russian/Uzbek/English sheets -> unit keys of REFERENCE_RANGES
+UNIT_REPLACEMENTS = (
+    ("×10^", "10^"), ("x10^", "10^"), ("*10^", "10^"), ("т/л", "t/l"),
+    ("×", "^"), ("x10", "10^"), ("*10", "10^"), ("10*", "10^"), ("10е", "10^"), ("10e", "10^"),
+    ("мкмоль", "umol"), ("μmol", "umol"), ("µmol", "umol"), ("ммоль", "mmol"), ("моль", "mol"),
+    ("мкл", "ul"), ("μl", "ul"), ("µl", "ul"), ("мк", "u"), ("μ", "u"), ("µ", "u"),
+    ("ме/", "iu/"), ("ед/", "u/"), ("фл", "fl"), ("пг", "pg"),
+    ("мг", "mg"), ("дл", "dl"), ("г/", "g/"), ("/л", "/l"),
+)
+VALUE_RE = re.compile(r"^\s*[<>]?\s*(-?\d+(?:[.,]\d+)?)\s*(.*)$")
+SHEET_RANGE_RE = re.compile(r"\((?:норма|norma|ref\.?|reference)\s*([^)]*)\)", re.IGNORECASE)
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+# Share of the reference interval on either side of the mean: 95 % = +-1.96 SD
+Z_HALF_WIDTH = 1.96
+
+
+def unit_key(unit):
+    key = unit.strip().lower().replace(" ", "")
+    for old, new in UNIT_REPLACEMENTS:
+        key = key.replace(old, new)
+    return key
+
+
+def parse_sex(value):
+    """"m" / "f" from form values like "male", "Мужской", "erkak", "ayol", or None"""
+    value = str(value or "").strip().lower()
+    if value[:1] in ("m", "м", "e") and not value.startswith("mix"):
+        return "m"
+    if value[:1] in ("f", "ж", "a", "w"):
+        return "f"
+    return None
+
+
+def parse_age(birth_date, on=None):
+    """Age in full years from "YYYY-MM-DD" / "DD.MM.YYYY", or None"""
+    if not birth_date:
+        return None
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            born = datetime.strptime(str(birth_date)[:10], fmt).date()
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    on = on or date.today()
+    return on.year - born.year - ((on.month, on.day) < (born.month, born.day))
+
+
+def _sheet_range(text):
+    """(low, high) from "(норма 120-160)" / "(норма ≤41)" / "(норма ≥5)", or None"""
+    match = SHEET_RANGE_RE.search(text)
+    if not match:
+        return None
+    spec = match.group(1)
+    numbers = [float(n.replace(",", ".")) for n in NUMBER_RE.findall(spec)]
+    if len(numbers) >= 2:
+        return numbers[0], numbers[1]
+    if len(numbers) == 1:
+        if "≥" in spec or ">" in spec:
+            return numbers[0], np.inf
+        return 0.0, numbers[0]
+    return None
+
+
+def _table_range(ranges, sex, age):
+    for row_sex, min_age, max_age, low, high in ranges:
+        if row_sex is not None and row_sex != sex:
+            continue
+        if age is not None and (age < min_age or (max_age is not None and age >= max_age)):
+            continue
+        if age is None and max_age is not None:
+            # Without an age, skip paediatric rows
+            continue
+        return low, high
+    return None
+
+
+def _scale_guess(field, value, unit):
+    """Fix up values typed without a unit in the other common scale"""
+    if field == "oam_specific_gravity" and value > 100:
+        return value / 1000  # "1015" -> 1.015
+    if field == "oak_hct" and not unit and value < 1:
+        return value * 100  # 0.42 L/L -> 42 %
+    return value
+
+
+def evaluate(form_data, sex=None, age=None):
+    """
+    Flag every numeric lab value of form_data.
+
+    Returns a list of dicts (field, label, value, unit, low, high, z, flag,
+    source) in REFERENCE_RANGES order; source is "sheet" or "table".
+    """
+    fields, labels, units, sources = [], [], [], []
+    raw, factor, low, high = [], [], [], []
+    for field, (label, unit, conversions, ranges) in REFERENCE_RANGES.items():
+        text = form_data.get(field)
+        if text is None or text == "":
+            continue
+        match = VALUE_RE.match(str(text))
+        if not match:
+            continue
+        value = float(match.group(1).replace(",", "."))
+        sheet_unit = SHEET_RANGE_RE.sub("", match.group(2)).strip()
+        key = unit_key(sheet_unit)
+
+        if not key or key == unit_key(unit):
+            to_table = 1.0
+        elif key in conversions:
+            to_table = float(conversions[key])
+        else:
+            to_table = None
+
+        reference = _sheet_range(str(text))
+        if reference is not None:
+            # The sheet range is in the sheet's unit
+            source = "sheet"
+            if to_table is None:
+                to_table, unit = 1.0, sheet_unit
+        else:
+            source = "table"
+            reference = _table_range(ranges, sex, age)
+            if reference is None or to_table is None:
+                continue
+            reference = (reference[0] / to_table, reference[1] / to_table)
+
+        fields.append(field)
+        labels.append(label)
+        units.append(unit)
+        sources.append(source)
+        raw.append(_scale_guess(field, value, sheet_unit))
+        factor.append(to_table)
+        low.append(reference[0])
+        high.append(reference[1])
+
+    if not fields:
+        return []
+
+    factor = np.array(factor)
+    values = np.array(raw) * factor
+    low = np.array(low, dtype=float) * factor
+    high = np.array(high, dtype=float) * factor
+
+    finite = np.isfinite(high)
+    mean = np.where(finite, (low + high) / 2, np.nan)
+    sd = np.where(finite, (high - low) / (2 * Z_HALF_WIDTH), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(sd > 0, (values - mean) / sd, np.nan)
+    flags = np.where(values < low, "L", np.where(values > high, "H", ""))
+
+    return [
+        {
+            "field": fields[i],
+            "label": labels[i],
+            "value": round(float(values[i]), 3),
+            "unit": units[i],
+            "low": round(float(low[i]), 3),
+            "high": round(float(high[i]), 3) if finite[i] else None,
+            "z": round(float(z[i]), 2) if np.isfinite(z[i]) else None,
+            "flag": str(flags[i]),
+            "source": sources[i],
+        }
+        for i in range(len(fields))
+    ]
+
+
+def evaluate_form(form_data):
+    """evaluate() with sex and age taken from the form's gender / birthDate"""
+    on = None
+    if form_data.get("admissionDate"):
+        try:
+            on = datetime.strptime(str(form_data["admissionDate"])[:10], "%Y-%m-%d").date()
+        except ValueError:
+            on = None
+    return evaluate(
+        form_data,
+        sex=parse_sex(form_data.get("gender")),
+        age=parse_age(form_data.get("birthDate"), on),
+    )
+
+
+def _number(value):
+    return f"{value:g}"
+
+
+def describe(row):
+    """Compact text for one evaluated value: "98 g/L L (норма 120-170, z=-5.1)" """
+    text = f"{_number(row['value'])} {row['unit']}".strip()
+    if row["flag"]:
+        text += f" {row['flag']}"
+    if row["high"] is None:
+        reference = f"≥{_number(row['low'])}"
+    elif row["low"] == 0:
+        reference = f"≤{_number(row['high'])}"
+    else:
+        reference = f"{_number(row['low'])}-{_number(row['high'])}"
+    text += f" (норма {reference}"
+    if row["flag"] and row["z"] is not None:
+        text += f", z={row['z']:+.1f}"
+    return text + ")"
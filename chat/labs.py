@@ -0,0 +1,215 @@
+"""
+Lab sheet extraction for the medical form.
+
+OCR text of a lab printout (chat/ocr.py) is parsed line by line into
+(analyte, value, unit, reference range) and mapped onto the oak_* / oam_* /
+bio_* fields that format_medical_form_data already knows. The medical form
+analysis then sends a few compact lines per panel instead of the photo.
+
+Lines look like "Гемоглобин (HGB) 135 г/л 120-160", "WBC 6.5 10^9/L 4.0-10.0"
+or "АЛТ 25 Ед/л до 41". Headers such as "Общий анализ мочи" switch the
+current panel, which decides what ambiguous names (glucose, protein,
+leukocytes, bilirubin) mean. Numeric lines that match no known analyte are
+kept as they are so nothing read from the sheet is lost.
+"""
+import re
+from collections import namedtuple
+
+
+LabResult = namedtuple("LabResult", "field analyte value unit reference line")
+
+# Panel headers, in the order they are tried
+PANELS = (
+    ("bio", r"биохим|bioxim|biochem"),
+    ("oam", r"анализ\s+мочи|\bОАМ\b|\bsiydik\b|urinalysis|\burine\b"),
+    ("oak", r"анализ\s+крови|\bОАК\b|\bqon\s+tahlili\b|blood\s+count|\bCBC\b|гемограмм"),
+)
+
+# (field, panel, aliases). Aliases of the current panel win, then the longest
+# one, so "билирубин прямой" beats "билирубин". Matching ignores case.
+ANALYTES = (
+    # ОАК
+    ("oak_wbc", "oak", ("WBC", "лейкоциты", "leykotsitlar", "leukocytes", "white blood cells")),
+    ("oak_rbc", "oak", ("RBC", "эритроциты", "eritrotsitlar", "erythrocytes", "red blood cells")),
+    ("oak_hgb", "oak", ("HGB", "HB", "гемоглобин", "gemoglobin", "hemoglobin", "haemoglobin")),
+    ("oak_hct", "oak", ("HCT", "гематокрит", "gematokrit", "hematocrit")),
+    ("oak_mcv", "oak", ("MCV", "средний объем эритроцита", "средний объём эритроцита")),
+    ("oak_mchc", "oak", ("MCHC", "средняя концентрация гемоглобина")),
+    ("oak_mch", "oak", ("MCH", "среднее содержание гемоглобина")),
+    ("oak_rdw_cv", "oak", ("RDW-CV", "RDW CV", "RDW")),
+    ("oak_rdw_sd", "oak", ("RDW-SD", "RDW SD")),
+    ("oak_plt", "oak", ("PLT", "тромбоциты", "trombotsitlar", "platelets")),
+    ("oak_pct", "oak", ("PCT", "тромбокрит", "trombokrit", "plateletcrit")),
+    ("oak_mpv", "oak", ("MPV", "средний объем тромбоцита", "средний объём тромбоцита")),
+    ("oak_pdw", "oak", ("PDW",)),
+    # Биохимия
+    ("bio_bild", "bio", ("BIL-D", "DBIL", "D-BIL", "билирубин прямой", "прямой билирубин", "direct bilirubin")),
+    ("bio_bilt", "bio", ("BIL-T", "TBIL", "T-BIL", "билирубин общий", "общий билирубин", "total bilirubin", "bilirubin", "билирубин")),
+    ("bio_ast", "bio", ("AST", "АСТ", "АсАТ", "аспартатаминотрансфераза")),
+    ("bio_alt", "bio", ("ALT", "АЛТ", "АлАТ", "аланинаминотрансфераза")),
+    ("bio_urea", "bio", ("UREA", "мочевина", "mochevina", "urea", "BUN")),
+    ("bio_crea", "bio", ("CREA", "CREAT", "креатинин", "kreatinin", "creatinine")),
+    ("bio_tp", "bio", ("TP", "общий белок", "umumiy oqsil", "total protein", "белок")),
+    ("bio_alb_glob", "bio", ("A/G", "альбумин/глобулин", "альбумин-глобулиновый коэффициент")),
+    ("bio_alb", "bio", ("ALB", "альбумин", "albumin")),
+    ("bio_glob", "bio", ("GLOB", "глобулин", "globulin")),
+    ("bio_alp", "bio", ("ALP", "щелочная фосфатаза", "ЩФ", "alkaline phosphatase")),
+    ("bio_amy", "bio", ("AMY", "амилаза", "amilaza", "amylase")),
+    ("bio_glue", "bio", ("GLU", "GLUC", "глюкоза", "glyukoza", "glucose", "сахар")),
+    ("bio_ldh", "bio", ("LDH", "ЛДГ", "лактатдегидрогеназа")),
+    ("bio_ritis", "bio", ("де Ритиса", "de Ritis", "AST/ALT", "АСТ/АЛТ")),
+    # ОАМ
+    ("oam_color", "oam", ("цвет", "rangi", "color", "colour")),
+    ("oam_transparency", "oam", ("прозрачность", "tiniqligi", "clarity", "transparency")),
+    ("oam_sediment", "oam", ("осадок", "cho'kma", "sediment")),
+    ("oam_specific_gravity", "oam", ("SG", "удельный вес", "относительная плотность", "плотность", "specific gravity")),
+    ("oam_ph", "oam", ("pH", "реакция")),
+    ("oam_protein", "oam", ("PRO", "белок", "oqsil", "protein")),
+    ("oam_glucose", "oam", ("GLU", "глюкоза", "glyukoza", "glucose")),
+    ("oam_ketones", "oam", ("KET", "кетоновые тела", "кетоны", "ketones")),
+    ("oam_bilirubin", "oam", ("BIL", "билирубин", "bilirubin")),
+    ("oam_urobilinogen", "oam", ("UBG", "URO", "уробилиноген", "urobilinogen")),
+    ("oam_ascorbic_acid", "oam", ("VC", "ASC", "аскорбиновая кислота", "ascorbic acid")),
+    ("oam_blood", "oam", ("BLD", "кровь", "blood")),
+    ("oam_nitrites", "oam", ("NIT", "нитриты", "nitrites")),
+    ("oam_leukocytes_digital", "oam", ("LEU", "LEU (тест-полоска)")),
+    ("oam_leukocytes_microscopy", "oam", ("лейкоциты", "leykotsitlar", "leukocytes", "WBC")),
+    ("oam_erythrocytes_changed", "oam", ("эритроциты измененные", "эритроциты изменённые")),
+    ("oam_erythrocytes_unchanged", "oam", ("эритроциты неизмененные", "эритроциты неизменённые", "эритроциты", "eritrotsitlar", "erythrocytes", "RBC")),
+    ("oam_epithelium", "oam", ("эпителий плоский", "эпителий", "epiteliy", "epithelium")),
+    ("oam_bacteria", "oam", ("бактерии", "bakteriyalar", "bacteria")),
+    ("oam_mucus", "oam", ("слизь", "shilliq", "mucus")),
+)
+
+# Urine values are often words ("соломенно-желтый", "отр.", "1-2 в п/з"), kept as written
+QUALITATIVE_PANELS = {"oam"}
+
+NUMBER = r"[<>]?\s*\d+(?:[.,]\d+)?"
+VALUE_RE = re.compile(rf"^\s*(?P<value>{NUMBER})")
+REFERENCE_RE = re.compile(
+    r"(?P<reference>"
+    r"от\s*\d+(?:[.,]\d+)?\s*до\s*\d+(?:[.,]\d+)?"
+    r"|\d+(?:[.,]\d+)?\s*[-–—]\s*\d+(?:[.,]\d+)?"
+    r"|(?:до|<|≤|menee|less than|up to)\s*\d+(?:[.,]\d+)?"
+    r"|(?:>|≥|более|от)\s*\d+(?:[.,]\d+)?"
+    r")\s*[A-Za-zА-Яа-я/^*0-9%]*\s*$"
+)
+# H/L/↑/↓ markers printed by analyzers next to out-of-range values
+FLAG_RE = re.compile(r"(?:^|\s)(?:[HLВН]|↑|↓|\*)(?=\s|$)")
+CODE_RE = re.compile(r"^\s*\([^)]{1,20}\)")
+NUMBERING_RE = re.compile(r"^\s*(?:\d{1,2}[.)]\s+|[-•*]\s*)")
+
+
+def _alias_pattern(alias):
+    # Latin codes and words must end at a word boundary; "ALT" is not "ALTA"
+    return re.compile(rf"^{re.escape(alias)}(?![\w])", re.IGNORECASE)
+
+
+_ALIASES = sorted(
+    (
+        (len(alias), _alias_pattern(alias), field, panel)
+        for field, panel, aliases in ANALYTES
+        for alias in aliases
+    ),
+    key=lambda entry: entry[0],
+    reverse=True,
+)
+
+
+def detect_panel(line):
+    for panel, pattern in PANELS:
+        if re.search(pattern, line, re.IGNORECASE):
+            return panel
+    return None
+
+
+def _match_analyte(line, panel):
+    """(field, matched alias text, rest of line) for the best alias, or None"""
+    matches = []
+    for _, pattern, field, field_panel in _ALIASES:
+        match = pattern.match(line)
+        if match:
+            matches.append((field_panel == panel, match.end(), field))
+    if not matches:
+        return None
+    # Same panel first, then the longest alias
+    in_panel, end, field = max(matches, key=lambda m: (m[0], m[1]))
+    return field, line[:end].strip(), line[end:]
+
+
+def _split_value(rest, qualitative):
+    """(value, unit, reference) from the text after the analyte name"""
+    rest = CODE_RE.sub("", rest.strip(" :\t"), count=1).strip(" :\t")
+    reference = ""
+    ref_match = REFERENCE_RE.search(rest)
+    # The reference must come after the value, not be the value itself ("1-2 в п/з")
+    if ref_match and ref_match.start() > 0:
+        reference = re.sub(r"\s+", "", ref_match.group("reference")).replace(",", ".")
+        range_match = re.fullmatch(r"от([\d.]+)до([\d.]+)", reference)
+        if range_match:
+            reference = f"{range_match.group(1)}-{range_match.group(2)}"
+        reference = reference.replace("до", "≤").replace("от", "≥")
+        rest = rest[: ref_match.start()]
+    rest = FLAG_RE.sub(" ", rest).strip()
+
+    if qualitative:
+        return rest, "", reference
+
+    value_match = VALUE_RE.match(rest)
+    if not value_match:
+        return None
+    value = value_match.group("value").replace(" ", "").replace(",", ".")
+    unit = rest[value_match.end():].strip()
+    return value, unit, reference
+
+
+def parse_lab_text(text):
+    """
+    Lab values found in OCR text of a lab sheet.
+
+    Returns (results, unmatched): LabResult tuples for known analytes (first
+    occurrence per field wins) and the numeric lines that matched nothing.
+    """
+    results = {}
+    unmatched = []
+    panel = None
+    for raw_line in (text or "").splitlines():
+        line = NUMBERING_RE.sub("", raw_line).strip()
+        if len(line) < 2:
+            continue
+
+        has_digits = re.search(r"\d", line) is not None
+        header = None if has_digits else detect_panel(line)
+        if header:
+            panel = header
+            continue
+
+        found = _match_analyte(line, panel)
+        if found is None:
+            if has_digits:
+                unmatched.append(line)
+            continue
+
+        field, analyte, rest = found
+        field_panel = field.split("_", 1)[0]
+        parsed = _split_value(rest, field_panel in QUALITATIVE_PANELS)
+        if not parsed or not parsed[0]:
+            continue
+        if field not in results:
+            value, unit, reference = parsed
+            results[field] = LabResult(field, analyte, value, unit, reference, line)
+
+    return list(results.values()), unmatched
+
+
+def form_value(result):
+    """Compact form field text: "135 г/л (норма 120-160)" """
+    text = f"{result.value} {result.unit}".strip()
+    if result.reference:
+        text += f" (норма {result.reference})"
+    return text
+
+
+def form_fields(results):
+    """{form field: value text} for format_medical_form_data"""
+    return {result.field: form_value(result) for result in results}
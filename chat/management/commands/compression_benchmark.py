@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from healthcare_api.compression import compress, decompress
+
+
+def sample_texts(limit):
+    """Newest assistant messages and case-history analyses, decompressed"""
+    from chat.models import Message
+    from patients.models import KasallikTarixi
+
+    # values_list returns the stored bytes, not the lazily decompressed text
+    raw = list(
+        Message.objects.filter(role="assistant").order_by("-id").values_list("content", flat=True)[:limit]
+    )
+    raw += list(
+        KasallikTarixi.objects.exclude(ai_tahlil=None).order_by("-id").values_list("ai_tahlil", flat=True)[:limit]
+    )
+    return [text for text in map(decompress, raw) if text]
+
+
+class Command(BaseCommand):
+    help = 'Compare storage size and read latency of AI answers: plain, zlib, zlib + shared dictionary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500, help='Rows sampled per table')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs per text')
+
+    def handle(self, *args, **options):
+        texts = sample_texts(options['limit'])
+        if not texts:
+            raise CommandError("No AI answers in the database to benchmark")
+
+        dictionary_id = getattr(settings, 'COMPRESSED_TEXT_DICTIONARY', 1)
+        variants = [("plain", None), ("zlib", 0), (f"zlib+dict {dictionary_id}", dictionary_id)]
+        plain_total = sum(len(text.encode("utf-8")) for text in texts)
+
+        self.stdout.write(
+            f"{len(texts)} texts, {plain_total / 1024:.1f} KB plain, "
+            f"median {statistics.median(len(t) for t in texts)} chars"
+        )
+        self.stdout.write(f"{'variant':<16}{'KB':>10}{'ratio':>8}{'write µs':>11}{'read µs':>10}")
+        for name, variant_id in variants:
+            write_times, read_times, total = [], [], 0
+            for text in texts:
+                if variant_id is None:
+                    stored = text.encode("utf-8")
+                    total += len(stored)
+                    continue
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    stored = compress(text, dictionary_id=variant_id)
+                write_times.append((time.perf_counter() - start) / options['repeat'])
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    decompress(stored)
+                read_times.append((time.perf_counter() - start) / options['repeat'])
+                total += len(stored)
+
+            write_us = f"{statistics.median(write_times) * 1e6:.0f}" if write_times else "-"
+            read_us = f"{statistics.median(read_times) * 1e6:.0f}" if read_times else "-"
+            self.stdout.write(
+                f"{name:<16}{total / 1024:>10.1f}{plain_total / total:>8.2f}{write_us:>11}{read_us:>10}"
+            )
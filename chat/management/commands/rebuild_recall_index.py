@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from chat import recall
+from chat.models import Message, RecallChunk
+from patients.models import KasallikTarixi
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the recall index chunks from all AI chat messages and case histories'
+
+    def handle(self, *args, **options):
+        RecallChunk.objects.all().delete()
+
+        messages = Message.objects.select_related('session').only(
+            'id', 'session__id', 'session__user_id', 'created_at', 'content'
+        )
+        message_count = 0
+        for message in messages.iterator(chunk_size=500):
+            recall.index_message(message)
+            message_count += 1
+
+        history_count = 0
+        for record in KasallikTarixi.objects.select_related('patient').iterator(chunk_size=200):
+            recall.index_history(record)
+            history_count += 1
+
+        # Refit and publish here: the old models point at deleted chunks
+        user_ids = RecallChunk.objects.order_by().values_list('user_id', flat=True).distinct()
+        for user_id in user_ids:
+            recall.refresh_index(user_id, refit=True)
+
+        self.stdout.write(
+            f"Indexed {message_count} messages and {history_count} case histories "
+            f"into {RecallChunk.objects.count()} chunks for {len(user_ids)} doctors"
+        )
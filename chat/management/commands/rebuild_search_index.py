@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import search
+from chat.models import ChatSession, Message
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the chat history search index from all sessions and messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows indexed per statement')
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("Chat search needs SQLite (FTS5) or PostgreSQL")
+        batch_size = options['batch_size']
+
+        search.clear()
+        titles = [
+            (user_id, session_id, None, created_at, title)
+            for session_id, user_id, created_at, title in ChatSession.objects.exclude(title__isnull=True)
+            .exclude(title='')
+            .values_list('id', 'user_id', 'created_at', 'title')
+        ]
+        for start in range(0, len(titles), batch_size):
+            search.index_rows(titles[start : start + batch_size])
+
+        count, batch = 0, []
+        messages = Message.objects.select_related('session').only(
+            'id', 'session__id', 'session__user_id', 'created_at', 'content'
+        )
+        for message in messages.iterator(chunk_size=batch_size):
+            batch.append(
+                (message.session.user_id, message.session_id, message.id, message.created_at, message.content)
+            )
+            if len(batch) >= batch_size:
+                search.index_rows(batch)
+                count += len(batch)
+                batch = []
+        search.index_rows(batch)
+        count += len(batch)
+
+        self.stdout.write(f"Indexed {len(titles)} session titles and {count} messages")
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from chat.models import Chat, ChatParticipant, Message1
+
+
+def unread_count(reader_type):
+    """The other side's messages after the reader's last_read_at (index on chat, created_at)"""
+    sender_type = 'patient' if reader_type == 'doctor' else 'doctor'
+    read_at = ChatParticipant.objects.filter(
+        chat=OuterRef(OuterRef('pk')),
+        **{f'user__{reader_type}_profile': OuterRef(OuterRef(reader_type))},
+    ).values('last_read_at')[:1]
+    unread = (
+        Message1.objects.filter(chat=OuterRef('pk'), sender_type=sender_type, created_at__gt=Subquery(read_at))
+        .order_by()
+        .values('chat')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    return Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recompute last_message and the unread counters of doctor–patient chats from their messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('chat_ids', nargs='*', type=int, help='Only these chats (default: all)')
+
+    def handle(self, *args, **options):
+        chats = Chat.objects.all()
+        if options['chat_ids']:
+            chats = chats.filter(id__in=options['chat_ids'])
+
+        # Missing participants have read nothing yet
+        participants = [
+            ChatParticipant(chat_id=chat_id, user_id=user_id, last_read_at=created_at)
+            for chat_id, doctor_user_id, patient_user_id, created_at in chats.values_list(
+                'id', 'doctor__user_id', 'patient__user_id', 'created_at'
+            )
+            for user_id in (doctor_user_id, patient_user_id)
+        ]
+        ChatParticipant.objects.bulk_create(participants, ignore_conflicts=True, batch_size=500)
+
+        last_message = Message1.objects.filter(chat=OuterRef('pk')).order_by('-created_at', '-id')
+        updated = chats.update(
+            last_message=Subquery(last_message.values('id')[:1]),
+            unread_for_doctor=unread_count('doctor'),
+            unread_for_patient=unread_count('patient'),
+        )
+        self.stdout.write(f"Repaired {updated} chats")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chat.fake_openai import get_config, make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local OpenAI-compatible chat completions server for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, help='Seconds before the first byte')
+        parser.add_argument('--token-delay', type=float, help='Seconds between streamed tokens')
+        parser.add_argument('--error-rate', type=float, help='Share of requests that fail (0..1)')
+        parser.add_argument('--error-status', type=int, help='HTTP status of injected errors')
+        parser.add_argument('--retry-after', type=float, help='Retry-After sent with injected errors')
+        parser.add_argument('--reply', help='Fixed reply text instead of size-proportional filler')
+
+    def handle(self, *args, **options):
+        overrides = {
+            'latency': options['latency'],
+            'token_delay': options['token_delay'],
+            'error_rate': options['error_rate'],
+            'error_status': options['error_status'],
+            'retry_after': options['retry_after'],
+            'reply': options['reply'],
+        }
+        server = make_server(options['host'], options['port'], **overrides)
+
+        self.stdout.write(f"Fake OpenAI listening on http://{options['host']}:{options['port']}/v1")
+        self.stdout.write(f"Config: {get_config(**overrides)}")
+        self.stdout.write(f"Point the app at it with OPENAI_BASE_URL=http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from healthcare_api.compression import DEFAULT_DICTIONARY_SIZE, DICTIONARY_DIR, train_dictionary
+from chat.management.commands.compression_benchmark import sample_texts
+
+
+class Command(BaseCommand):
+    help = 'Build a new shared compression dictionary from stored AI answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=2000, help='Rows sampled per table')
+        parser.add_argument('--size', type=int, default=DEFAULT_DICTIONARY_SIZE, help='Dictionary size in bytes')
+
+    def handle(self, *args, **options):
+        texts = sample_texts(options['limit'])
+        if len(texts) < 10:
+            raise CommandError("Need at least 10 AI answers in the database to train a dictionary")
+
+        dictionary = train_dictionary(texts, options['size'])
+        existing = [
+            int(name.split('.')[0]) for name in os.listdir(DICTIONARY_DIR) if name.split('.')[0].isdigit()
+        ]
+        dictionary_id = max(existing, default=0) + 1
+        if dictionary_id > 255:
+            raise CommandError("Dictionary ids are one byte; no ids left")
+
+        path = os.path.join(DICTIONARY_DIR, f"{dictionary_id}.txt")
+        with open(path, 'wb') as f:
+            f.write(dictionary)
+
+        self.stdout.write(f"Wrote {len(dictionary)} byte dictionary from {len(texts)} texts to {path}")
+        self.stdout.write(
+            f"Commit it, deploy, then set COMPRESSED_TEXT_DICTIONARY={dictionary_id}; "
+            "never edit or delete a dictionary that rows use"
+        )
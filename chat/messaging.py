@@ -0,0 +1,57 @@
+"""
+Write path for doctor–patient chat messages (Message1).
+
+send() stores a message with two statements in one transaction: the
+INSERT and a single UPDATE of the chat row (updated_at, last_message and
+the recipient's unread counter, see Chat.add_messages). The sender type
+comes from the chat the caller has already loaded with its doctor and
+patient (realtime.participant_type), so no profile lookups are made.
+
+send_many() is the batch version for imports and system messages: one
+bulk INSERT, then still one UPDATE of the chat. created_at is the insert
+time, as for single messages.
+
+Both raise ValueError, before writing anything, for a sender_type other
+than "doctor" or "patient": the unread counters only know those two sides.
+
+Neither pushes anything: callers broadcast the serialized messages with
+realtime.broadcast_on_commit() when clients should see them at once.
+"""
+from django.db import transaction
+
+from .models import Chat, Message1
+
+
+SENDER_TYPES = {value for value, _ in Message1.SENDER_TYPES}
+
+
+def check_sender_type(sender_type):
+    if sender_type not in SENDER_TYPES:
+        raise ValueError(f"sender_type must be one of {sorted(SENDER_TYPES)}, not {sender_type!r}")
+
+
+def send(chat, sender, sender_type, **fields):
+    """New Message1 from sender ("doctor" / "patient" side of chat) with the given fields"""
+    check_sender_type(sender_type)
+    message = Message1(chat=chat, sender=sender, sender_type=sender_type, **fields)
+    # Message1.save does the INSERT and the chat UPDATE atomically
+    message.save()
+    return message
+
+
+def send_many(chat, messages):
+    """
+    Store unsaved Message1 objects of one chat, oldest first.
+
+    Each needs sender and sender_type; chat is set here. Returns them with
+    their ids.
+    """
+    if not messages:
+        return []
+    for message in messages:
+        check_sender_type(message.sender_type)
+        message.chat = chat
+    with transaction.atomic():
+        messages = Message1.objects.bulk_create(messages)
+        Chat.add_messages(chat.id, messages)
+    return messages
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_aijob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='token_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
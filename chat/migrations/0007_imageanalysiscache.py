@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('image_sha256', models.CharField(db_index=True, max_length=64)),
+                ('model', models.CharField(max_length=50)),
+                ('language', models.CharField(max_length=5)),
+                ('result', models.TextField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_imageanalysiscache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(blank=True, max_length=64)),
+                ('model', models.CharField(max_length=32)),
+                ('language', models.CharField(blank=True, max_length=8)),
+                ('streamed', models.BooleanField(default=False)),
+                ('queue_wait_ms', models.PositiveIntegerField(default=0)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('ttft_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('outcome', models.CharField(choices=[('ok', 'OK'), ('error', 'Error'), ('rate_limited', 'Rate limited'), ('timeout', 'Timeout'), ('busy', 'No free slot'), ('unavailable', 'Circuit open'), ('cancelled', 'Cancelled by client')], default='ok', max_length=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to='chat.message')),
+                ('session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to='chat.chatsession')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['endpoint', 'created_at'], name='chat_aicall_endpoin_9b2f1b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_aicall'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'id'], name='chat_messag_session_f95c7b_idx'),
+        ),
+    ]
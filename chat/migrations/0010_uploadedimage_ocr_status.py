@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:44
+
+from django.db import migrations, models
+
+
+def mark_existing_uploads(apps, schema_editor):
+    # Uploads saved before OCR existed only carry a placeholder text
+    UploadedImage = apps.get_model("chat", "UploadedImage")
+    UploadedImage.objects.update(ocr_status="failed", ocr_error="Uploaded before OCR was enabled")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_session_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='ocr_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='ocr_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='ocr_language',
+            field=models.CharField(blank=True, choices=[('ru', 'Russian'), ('uz', 'Uzbek'), ('en', 'English')], max_length=2),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='ocr_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_uploads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations, models
+
+import healthcare_api.compression
+
+BATCH_SIZE = 500
+
+
+def compress_content(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    batch = []
+    for message in Message.objects.only("id", "content").iterator(chunk_size=BATCH_SIZE):
+        message.content_compressed = message.content
+        batch.append(message)
+        if len(batch) >= BATCH_SIZE:
+            Message.objects.bulk_update(batch, ["content_compressed"])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ["content_compressed"])
+
+
+def decompress_content(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    batch = []
+    for message in Message.objects.only("id", "content_compressed").iterator(chunk_size=BATCH_SIZE):
+        message.content = message.content_compressed
+        batch.append(message)
+        if len(batch) >= BATCH_SIZE:
+            Message.objects.bulk_update(batch, ["content"])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ["content"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_uploadedimage_ocr_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_compressed',
+            field=healthcare_api.compression.CompressedTextField(null=True),
+        ),
+        # Nullable first, so that unapplying can re-add the old column to existing rows
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_content, decompress_content),
+        migrations.RemoveField(
+            model_name='message',
+            name='content',
+        ),
+        migrations.RenameField(
+            model_name='message',
+            old_name='content_compressed',
+            new_name='content',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=healthcare_api.compression.CompressedTextField(),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE chat_search USING fts5("
+            "terms, content='', tokenize='unicode61 remove_diacritics 0')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE chat_searchdocument ADD COLUMN vector tsvector")
+        schema_editor.execute(
+            "CREATE INDEX chat_searchdocument_vector_gin ON chat_searchdocument USING gin (vector)"
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS chat_search")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS chat_searchdocument_vector_gin")
+        schema_editor.execute("ALTER TABLE chat_searchdocument DROP COLUMN IF EXISTS vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_compress_message_content'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='chat.message')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='chat.chatsession')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        # Existing messages are indexed by the rebuild_search_index command
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_recallchunk'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message1',
+            index=models.Index(fields=['chat', 'id'], name='chat_messag_chat_id_a470c8_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    # Same as the repair_chat_counters command, on the historical models
+    Chat = apps.get_model('chat', 'Chat')
+    Message1 = apps.get_model('chat', 'Message1')
+
+    def unread_count(sender_type):
+        unread = (
+            Message1.objects.filter(chat=OuterRef('pk'), sender_type=sender_type, is_read=False)
+            .order_by()
+            .values('chat')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+
+    last_message = Message1.objects.filter(chat=OuterRef('pk')).order_by('-created_at', '-id')
+    Chat.objects.update(
+        last_message=Subquery(last_message.values('id')[:1]),
+        unread_for_doctor=unread_count('patient'),
+        unread_for_patient=unread_count('doctor'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_message1_chat_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message1'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='unread_for_doctor',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='unread_for_patient',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:10
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_watermarks(apps, schema_editor):
+    """Each side's last_read_at from the newest message of the other side it has read"""
+    Chat = apps.get_model('chat', 'Chat')
+    Message1 = apps.get_model('chat', 'Message1')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+
+    read = {
+        (chat_id, sender_type): created_at
+        for chat_id, sender_type, created_at in Message1.objects.filter(is_read=True)
+        .order_by()
+        .values('chat', 'sender_type')
+        .annotate(last=Max('created_at'))
+        .values_list('chat', 'sender_type', 'last')
+    }
+    participants = {
+        (participant.chat_id, participant.user_id): participant
+        for participant in ChatParticipant.objects.all()
+    }
+    created, updated = [], []
+    chats = Chat.objects.values_list('id', 'doctor__user_id', 'patient__user_id', 'created_at')
+    for chat_id, doctor_user_id, patient_user_id, chat_created_at in chats:
+        for user_id, sender_type in ((doctor_user_id, 'patient'), (patient_user_id, 'doctor')):
+            last_read_at = read.get((chat_id, sender_type), chat_created_at)
+            participant = participants.get((chat_id, user_id))
+            if participant is None:
+                created.append(ChatParticipant(chat_id=chat_id, user_id=user_id, last_read_at=last_read_at))
+            else:
+                participant.last_read_at = last_read_at
+                updated.append(participant)
+    ChatParticipant.objects.bulk_create(created, ignore_conflicts=True, batch_size=500)
+    ChatParticipant.objects.bulk_update(updated, ['last_read_at'], batch_size=500)
+
+    # Counters from the watermarks, as the repair_chat_counters command does
+    def unread_count(reader_type):
+        sender_type = 'patient' if reader_type == 'doctor' else 'doctor'
+        read_at = ChatParticipant.objects.filter(
+            chat=OuterRef(OuterRef('pk')),
+            **{f'user__{reader_type}_profile': OuterRef(OuterRef(reader_type))},
+        ).values('last_read_at')[:1]
+        unread = (
+            Message1.objects.filter(chat=OuterRef('pk'), sender_type=sender_type, created_at__gt=Subquery(read_at))
+            .order_by()
+            .values('chat')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+
+    Chat.objects.update(unread_for_doctor=unread_count('doctor'), unread_for_patient=unread_count('patient'))
+
+
+def restore_is_read(apps, schema_editor):
+    Message1 = apps.get_model('chat', 'Message1')
+    ChatParticipant = apps.get_model('chat', 'ChatParticipant')
+
+    for reader_type, sender_type in (('doctor', 'patient'), ('patient', 'doctor')):
+        read_at = ChatParticipant.objects.filter(
+            chat=OuterRef('chat'), **{f'user__{reader_type}_profile': OuterRef(f'chat__{reader_type}')}
+        ).values('last_read_at')[:1]
+        Message1.objects.filter(sender_type=sender_type, created_at__lte=Subquery(read_at)).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_chat_inbox_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatparticipant',
+            name='last_read_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='message1',
+            index=models.Index(fields=['chat', 'created_at'], name='chat_messag_chat_id_2dea1f_idx'),
+        ),
+        migrations.RunPython(fill_watermarks, restore_is_read),
+        migrations.RemoveField(
+            model_name='message1',
+            name='is_read',
+        ),
+    ]
@@ -1,6 +1,12 @@
-from django.db import models
+import uuid
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from doctors.models import Doctor
+from healthcare_api.compression import CompressedTextField
 from patients.models import Patient
 
 User = get_user_model()
@@ -10,6 +16,20 @@ class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200, null=True, blank=True)  # Chat session title
     created_at = models.DateTimeField(auto_now_add=True)
+    # Rolling summary of older turns; messages up to summary_upto are folded into it
+    summary = models.TextField(blank=True)
+    summary_upto = models.ForeignKey(
+        "Message", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "title" in update_fields:
+            from .search import index_session_title
+
+            index_session_title(self)
 
 
 class Message(models.Model):
@@ -19,15 +39,211 @@ class Message(models.Model):
     role = models.CharField(
         max_length=10, choices=(("user", "User"), ("assistant", "Assistant"))
     )
-    content = models.TextField()
+    # Stored compressed (3000-6000 token answers); decompressed when read
+    content = CompressedTextField()
     model_used = models.CharField(max_length=20, null=True, blank=True)  # Store which model was used
+    token_count = models.PositiveIntegerField(null=True, blank=True)  # Cached prompt token count
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # History pages and last-message lookups walk a session by id
+        indexes = [models.Index(fields=["session", "id"])]
+
+    def save(self, *args, **kwargs):
+        if self.token_count is None:
+            from .context import count_tokens
+
+            self.token_count = count_tokens(self.content)
+        created = self._state.adding
+        super().save(*args, **kwargs)
+        if created:
+            # Search and recall indexing run in Celery once the row is committed
+            from .tasks import delay_or_run, index_chat_message
+
+            transaction.on_commit(partial(delay_or_run, index_chat_message, self.id))
+        if created and self.role == "assistant":
+            from .telemetry import link_message
+
+            link_message(self)
+
+
+class SearchDocument(models.Model):
+    """
+    Entry of the chat history search index (chat/search.py): a message, or a
+    session title when message is empty. Its id is the row of the FTS5
+    table on SQLite; on PostgreSQL the migration adds a tsvector column.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.CASCADE, related_name="search_documents"
+    )
+    message = models.OneToOneField(
+        Message, on_delete=models.CASCADE, null=True, blank=True, related_name="search_document"
+    )
+    created_at = models.DateTimeField()
+
+
+class RecallChunk(models.Model):
+    """
+    A few lines of a past AI chat message or case history for the recall
+    index (chat/recall.py). The text is not copied: start/end point into
+    the message content or the case history text.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, null=True, blank=True, related_name="recall_chunks"
+    )
+    kasallik_tarixi = models.ForeignKey(
+        "patients.KasallikTarixi",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    start = models.PositiveIntegerField()
+    end = models.PositiveIntegerField()
+    terms = models.TextField()  # stems, space separated
+    created_at = models.DateTimeField()
+
+    class Meta:
+        # Each process loads a doctor's chunks added since it last looked
+        indexes = [models.Index(fields=["user", "id"])]
+
+
+class AIJob(models.Model):
+    """Фоновая задача ИИ: запрос к OpenAI выполняется Celery-воркером"""
+
+    KINDS = (
+        ("medical_form", "Medical form analysis"),
+        ("instrumental_image", "Instrumental image analysis"),
+        ("chat_image", "Chat image analysis"),
+    )
+
+    STATUSES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ai_jobs")
+    kind = models.CharField(max_length=30, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    # OpenAI request (messages, model, max_tokens); cleared once the job finishes
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    # Where the result is written back to
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.CASCADE, null=True, blank=True, related_name="ai_jobs"
+    )
+    message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_jobs"
+    )
+    kasallik_tarixi = models.ForeignKey(
+        "patients.KasallikTarixi",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="ai_jobs",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.kind} [{self.status}] {self.id}"
+
+
+class ImageAnalysisCache(models.Model):
+    """Сохранённый результат анализа изображения (ключ — SHA-256 снимка + промпт)"""
+
+    key = models.CharField(max_length=64, unique=True)
+    image_sha256 = models.CharField(max_length=64, db_index=True)
+    model = models.CharField(max_length=50)
+    language = models.CharField(max_length=5)
+    result = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.image_sha256[:12]} [{self.language}/{self.model}]"
+
+
+class AICall(models.Model):
+    """Одно обращение к OpenAI: задержки, токены, повторы и результат"""
+
+    OUTCOMES = (
+        ("ok", "OK"),
+        ("error", "Error"),
+        ("rate_limited", "Rate limited"),
+        ("timeout", "Timeout"),
+        ("busy", "No free slot"),
+        ("unavailable", "Circuit open"),
+        ("cancelled", "Cancelled by client"),
+    )
+
+    endpoint = models.CharField(max_length=64, blank=True)
+    model = models.CharField(max_length=32)
+    language = models.CharField(max_length=8, blank=True)
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_calls"
+    )
+    message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name="ai_calls"
+    )
+    streamed = models.BooleanField(default=False)
+    queue_wait_ms = models.PositiveIntegerField(default=0)  # waiting for a gateway slot
+    latency_ms = models.PositiveIntegerField(default=0)  # upstream, retries included
+    ttft_ms = models.PositiveIntegerField(null=True, blank=True)  # streams only
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    retries = models.PositiveSmallIntegerField(default=0)
+    outcome = models.CharField(max_length=12, choices=OUTCOMES, default="ok")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["endpoint", "created_at"])]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.model} {self.latency_ms}ms [{self.outcome}]"
 
 
 class UploadedImage(models.Model):
+    OCR_STATUSES = (
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    OCR_LANGUAGES = (
+        ("ru", "Russian"),
+        ("uz", "Uzbek"),
+        ("en", "English"),
+    )
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to="uploads/")
+    # Written back by chat.ocr once Tesseract has run
     analyzed_text = models.TextField(null=True, blank=True)
+    ocr_status = models.CharField(max_length=10, choices=OCR_STATUSES, default="pending")
+    ocr_language = models.CharField(max_length=2, choices=OCR_LANGUAGES, blank=True)
+    ocr_error = models.TextField(blank=True)
+    ocr_finished_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -39,6 +255,13 @@ class Chat(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Inbox state, kept up to date by Message1.save and realtime.mark_read
+    # (rebuild with manage.py repair_chat_counters)
+    last_message = models.ForeignKey(
+        "Message1", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    unread_for_doctor = models.PositiveIntegerField(default=0)
+    unread_for_patient = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ("doctor", "patient")
@@ -47,17 +270,43 @@ class Chat(models.Model):
     def __str__(self):
         return f"Chat: Dr.{self.doctor.user.full_name} - {self.patient.user.full_name}"
 
-    @property
-    def last_message(self):
-        return self.messages.first()
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Участники хранят отметку о прочтении (last_read_at)
+            if created:
+                ChatParticipant.objects.bulk_create(
+                    [
+                        ChatParticipant(chat=self, user_id=self.doctor.user_id),
+                        ChatParticipant(chat=self, user_id=self.patient.user_id),
+                    ],
+                    ignore_conflicts=True,
+                )
+
+    @classmethod
+    def add_messages(cls, chat_id, messages):
+        """
+        Record new messages of a chat (oldest first) with one UPDATE: updated_at,
+        last_message and the recipients' unread counters.
+        """
+        last = messages[-1]
+        changes = {"updated_at": last.created_at, "last_message": last}
+        for reader_type in ("doctor", "patient"):
+            count = sum(message.sender_type != reader_type for message in messages)
+            if count:
+                unread = f"unread_for_{reader_type}"
+                changes[unread] = F(unread) + count
+        cls.objects.filter(id=chat_id).update(**changes)
 
     @property
     def unread_count_for_patient(self):
-        return self.messages.filter(sender_type="doctor", is_read=False).count()
+        return self.unread_for_patient
 
     @property
     def unread_count_for_doctor(self):
-        return self.messages.filter(sender_type="patient", is_read=False).count()
+        return self.unread_for_doctor
 
 
 class Message1(models.Model):
@@ -85,28 +334,39 @@ class Message1(models.Model):
     )
     content = models.TextField()
     file_url = models.URLField(blank=True, null=True)  # Для файлов/изображений
-    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Keyset sync (?after=<id>) reads only the new tail of a chat
+            models.Index(fields=["chat", "id"]),
+            # Unread = the other side's messages after a participant's last_read_at
+            models.Index(fields=["chat", "created_at"]),
+        ]
 
     def __str__(self):
         return f"{self.sender.full_name}: {self.content[:50]}..."
 
     def save(self, *args, **kwargs):
-        # Определяем тип отправителя
-        if hasattr(self.sender, "doctor_profile"):
-            self.sender_type = "doctor"
-        elif hasattr(self.sender, "patient_profile"):
-            self.sender_type = "patient"
+        # Определяем тип отправителя, если его не передали (chat.messaging передаёт)
+        if not self.sender_type:
+            if hasattr(self.sender, "doctor_profile"):
+                self.sender_type = "doctor"
+            elif hasattr(self.sender, "patient_profile"):
+                self.sender_type = "patient"
 
-        super().save(*args, **kwargs)
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
-        # Обновляем время последнего обновления чата
-        self.chat.updated_at = self.created_at
-        self.chat.save(update_fields=["updated_at"])
+            # Обновляем время последнего обновления чата, а для нового
+            # сообщения - последнее сообщение и счётчик непрочитанных
+            if created:
+                Chat.add_messages(self.chat_id, [self])
+            else:
+                Chat.objects.filter(id=self.chat_id).update(updated_at=self.created_at)
 
 
 class ChatParticipant(models.Model):
@@ -117,7 +377,8 @@ class ChatParticipant(models.Model):
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     joined_at = models.DateTimeField(auto_now_add=True)
-    last_read_at = models.DateTimeField(auto_now_add=True)
+    # Read watermark: the other side's messages up to this time are read
+    last_read_at = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
 
     class Meta:
@@ -125,3 +386,17 @@ class ChatParticipant(models.Model):
 
     def __str__(self):
         return f"{self.user.full_name} in {self.chat}"
+
+
+def read_at(side):
+    """last_read_at of a chat's doctor or patient, as a subquery for annotating Chats"""
+    return Subquery(
+        ChatParticipant.objects.filter(
+            chat=OuterRef("pk"), **{f"user__{side}_profile": OuterRef(side)}
+        ).values("last_read_at")[:1]
+    )
+
+
+def with_read_at(chats):
+    """Chats annotated with doctor_read_at and patient_read_at"""
+    return chats.annotate(doctor_read_at=read_at("doctor"), patient_read_at=read_at("patient"))
@@ -0,0 +1,317 @@
+"""
+OCR of uploaded images (UploadedImage.analyzed_text).
+
+Uploads are answered right away with ocr_status "pending"; Tesseract runs
+out of the request:
+
+- AI_OCR_BACKEND = "celery": ocr_uploaded_image task on its own "ocr"
+  queue, so the worker's concurrency bounds how many scans run at once;
+- AI_OCR_BACKEND = "process": a bounded process pool inside the web
+  process, for setups without a Celery worker. The celery backend also
+  falls back to it when the broker cannot be reached.
+
+recognize() reads an image while the request waits, for lab sheets that
+feed the medical form analysis (chat/labs.py).
+
+Before Tesseract the scan is cleaned up with Pillow: EXIF orientation,
+grayscale, downscale to AI_OCR_MAX_EDGE, deskew (projection profile) and
+Otsu binarization. The upload language picks the Tesseract language packs;
+packs that are not installed are skipped.
+"""
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+
+# Upload language -> Tesseract packs; English is kept for Latin medical terms
+LANGUAGE_PACKS = {
+    "ru": ["rus", "eng"],
+    "uz": ["uzb", "uzb_cyrl", "eng"],
+    "en": ["eng"],
+}
+DEFAULT_PACKS = ["rus", "uzb", "eng"]
+
+# Skew search: coarse pass over +-MAX_SKEW degrees, then a fine pass around the best angle
+MAX_SKEW = 10
+SKEW_SAMPLE_EDGE = 800
+MIN_SKEW = 0.3
+
+ERROR_MAX_LENGTH = 500
+
+
+class OCRUnavailable(Exception):
+    """pytesseract or the tesseract binary is not installed"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def otsu_threshold(image):
+    """Gray level that best separates ink from paper in an "L" image"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+
+    best_level, best_variance = 127, -1.0
+    background = weighted_background = 0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def binarize(image, threshold=None):
+    threshold = otsu_threshold(image) if threshold is None else threshold
+    return image.point(lambda value: 255 if value > threshold else 0)
+
+
+def _profile_score(sample, angle):
+    """Variance of row ink density; text lines give sharp peaks when level"""
+    rotated = sample.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+    # A 1-pixel-wide BOX resize averages every row in C
+    rows = rotated.resize((1, rotated.height), Image.BOX).tobytes()
+    mean = sum(rows) / len(rows)
+    return sum((value - mean) ** 2 for value in rows)
+
+
+def estimate_skew(image):
+    """Angle (degrees, counter-clockwise) that levels the text lines of an "L" image"""
+    sample = image.copy()
+    sample.thumbnail((SKEW_SAMPLE_EDGE, SKEW_SAMPLE_EDGE))
+    sample = binarize(sample)
+
+    best = max(range(-MAX_SKEW, MAX_SKEW + 1), key=lambda angle: _profile_score(sample, angle))
+    fine = [best + step / 10 for step in range(-10, 11)]
+    return max(fine, key=lambda angle: _profile_score(sample, angle))
+
+
+def preprocess(image, max_edge):
+    """Grayscale, downscaled, deskewed and binarized copy of a PIL image"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L")
+
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    image = ImageOps.autocontrast(image, cutoff=1)
+
+    angle = estimate_skew(image)
+    if abs(angle) >= MIN_SKEW:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    return binarize(image)
+
+
+def _pytesseract():
+    try:
+        import pytesseract
+    except ImportError as e:
+        raise OCRUnavailable("pytesseract is not installed") from e
+    return pytesseract
+
+
+@lru_cache(maxsize=1)
+def installed_packs():
+    pytesseract = _pytesseract()
+    try:
+        return frozenset(pytesseract.get_languages(config=""))
+    except pytesseract.TesseractNotFoundError as e:
+        raise OCRUnavailable("tesseract is not installed or not on PATH") from e
+
+
+def tesseract_languages(language):
+    """"rus+eng"-style language string for an upload language (ru / uz / en / "")"""
+    packs = LANGUAGE_PACKS.get(language, DEFAULT_PACKS)
+    available = [pack for pack in packs if pack in installed_packs()]
+    missing = set(packs) - set(available)
+    if missing:
+        print(f"OCR language packs not installed: {', '.join(sorted(missing))}")
+    return "+".join(available) or "eng"
+
+
+def ocr_bytes(image_bytes, language="", max_edge=3000, timeout=120):
+    """
+    Text found in an image file.
+
+    Runs in a Celery worker or an OCR pool process, so it only uses its
+    arguments (no settings or database).
+    """
+    pytesseract = _pytesseract()
+    image = preprocess(Image.open(io.BytesIO(image_bytes)), max_edge)
+    try:
+        text = pytesseract.image_to_string(
+            image, lang=tesseract_languages(language), config="--oem 1 --psm 3", timeout=timeout
+        )
+    except pytesseract.TesseractNotFoundError as e:
+        raise OCRUnavailable("tesseract is not installed or not on PATH") from e
+    return text.strip()
+
+
+_sync_executor = ThreadPoolExecutor(
+    max_workers=_setting("AI_OCR_WORKERS", 2),
+    thread_name_prefix="ocr",
+)
+
+
+def recognize(images, language=""):
+    """
+    OCR images (bytes) while the request waits; texts in the same order.
+
+    Used for lab sheets sent with the medical form. Tesseract itself runs as
+    a subprocess, so a small thread pool is enough to bound how many scans
+    are read at once.
+    """
+    options = _ocr_options()
+    futures = [_sync_executor.submit(ocr_bytes, data, language, **options) for data in images]
+    return [future.result(timeout=options["timeout"] + 30) for future in futures]
+
+
+def _claim(image_id):
+    """The UploadedImage if this caller moved it from pending to processing, else None"""
+    from .models import UploadedImage
+
+    claimed = UploadedImage.objects.filter(id=image_id, ocr_status="pending").update(
+        ocr_status="processing"
+    )
+    if not claimed:
+        # Already picked up (acks_late redelivery) or deleted
+        return None
+    return UploadedImage.objects.get(id=image_id)
+
+
+def _read(image):
+    with image.image.open("rb") as f:
+        return f.read()
+
+
+def _finish(image_id, text=None, error=None):
+    from .models import UploadedImage
+
+    if error is not None:
+        print(f"OCR failed for uploaded image {image_id}: {error}")
+    UploadedImage.objects.filter(id=image_id).update(
+        analyzed_text=text,
+        ocr_status="failed" if error is not None else "done",
+        ocr_error=str(error)[:ERROR_MAX_LENGTH] if error is not None else "",
+        ocr_finished_at=timezone.now(),
+    )
+
+
+def _ocr_options():
+    return {
+        "max_edge": _setting("AI_OCR_MAX_EDGE", 3000),
+        "timeout": _setting("AI_OCR_TIMEOUT", 120),
+    }
+
+
+def recognize_uploaded_image(image_id):
+    """OCR an UploadedImage in this process and write the text back"""
+    image = _claim(image_id)
+    if image is None:
+        return None
+    try:
+        text = ocr_bytes(_read(image), image.ocr_language, **_ocr_options())
+    except Exception as e:
+        _finish(image_id, error=e)
+        return None
+    _finish(image_id, text=text)
+    return text
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a threaded web worker can copy held locks
+                _pool = ProcessPoolExecutor(
+                    max_workers=_setting("AI_OCR_WORKERS", 2),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _pool_done(image_id, submitter, future):
+    try:
+        error = future.exception()
+        _finish(image_id, text=None if error else future.result(), error=error)
+    finally:
+        # The pool's result thread opened its own DB connection; a future that
+        # was already done runs this in the request thread, which keeps its own
+        if threading.current_thread() is not submitter:
+            connection.close()
+
+
+def _submit_to_pool(image_id):
+    image = _claim(image_id)
+    if image is None:
+        return
+    try:
+        data = _read(image)
+    except OSError as e:
+        _finish(image_id, error=e)
+        return
+    try:
+        future = _get_pool().submit(ocr_bytes, data, image.ocr_language, **_ocr_options())
+    except BrokenProcessPool as e:
+        # A worker died (OOM on a huge scan); start a fresh pool for later uploads
+        _reset_pool()
+        _finish(image_id, error=e)
+        return
+    future.add_done_callback(partial(_pool_done, image_id, threading.current_thread()))
+
+
+def submit(image_id):
+    """
+    Start OCR of a saved UploadedImage; call once its row is committed.
+
+    Never raises: the upload is already saved, so if the Celery broker is
+    unreachable the scan is read in the local pool, and if that fails too
+    the row is marked failed.
+    """
+    if _setting("AI_OCR_BACKEND", "celery") != "process":
+        from .tasks import ocr_uploaded_image
+
+        try:
+            ocr_uploaded_image.delay(image_id)
+            return
+        except Exception as e:
+            print(f"OCR task for uploaded image {image_id} not queued ({e}), using the local pool")
+    try:
+        _submit_to_pool(image_id)
+    except Exception as e:
+        _finish(image_id, error=e)
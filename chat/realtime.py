@@ -0,0 +1,164 @@
+"""
+Push of doctor–patient chat events over WebSockets (Django Channels).
+
+Each Chat has a channel group; ChatConsumer (chat/consumers.py, served at
+ws/chat/<chat id>/?token=<JWT access token>) joins it. The REST views call
+broadcast_on_commit(), so an event goes out only once its rows are saved:
+
+- "message": a new Message1, as MessageSerializer renders it;
+- "read": one side has read the other side's messages up to read_at;
+- "typing": relayed between consumers, never stored.
+
+CHANNEL_LAYERS picks Redis in production and the in-memory layer for tests
+and single-process runs. Without channels installed, or with the layer
+down, nothing is pushed and clients keep polling the REST endpoints.
+
+ChatEvents lets an async view (the long-poll endpoint) sleep until the
+next event of a chat instead of querying in a loop.
+"""
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+from django.utils import timezone
+
+try:
+    from channels.layers import get_channel_layer
+except ImportError:  # channels is optional, REST polling still works
+    get_channel_layer = None
+
+
+def group_name(chat_id):
+    return f"chat-{chat_id}"
+
+
+def event_message(event, data, exclude=None):
+    """Channel layer message handled by ChatConsumer.chat_event"""
+    return {"type": "chat.event", "event": event, "data": data, "exclude": exclude}
+
+
+def channel_layer():
+    """The configured channel layer, or None without channels or a usable backend"""
+    if get_channel_layer is None:
+        return None
+    try:
+        return get_channel_layer()
+    except Exception as e:
+        # e.g. channels_redis missing for the configured backend
+        print(f"Chat channel layer unavailable: {e}")
+        return None
+
+
+def broadcast(chat_id, event, data):
+    layer = channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group_name(chat_id), event_message(event, data))
+    except Exception as e:
+        # A missed push only means clients see the change on their next poll
+        print(f"Chat {chat_id} {event} event not pushed: {e}")
+
+
+def broadcast_on_commit(chat_id, event, data):
+    transaction.on_commit(lambda: broadcast(chat_id, event, data))
+
+
+def participant_type(user, chat):
+    """
+    "doctor" or "patient" if user takes part in chat, else None.
+
+    Load the chat with select_related("doctor", "patient") to make this free.
+    """
+    if chat.doctor.user_id == user.id:
+        return "doctor"
+    if chat.patient.user_id == user.id:
+        return "patient"
+    return None
+
+
+def mark_read(chat, reader_type, user_id):
+    """
+    Mark the other side's messages read and tell the chat.
+
+    Read state is the reader's ChatParticipant.last_read_at, so this moves
+    one row instead of flagging every message. The watermark moves to the
+    newest message of the other side that is visible now (the (chat,
+    created_at) index), and the reader's unread counter is reset with it.
+    Returns the new watermark, or None when it already covered everything.
+    """
+    from .models import Chat, ChatParticipant, Message1
+
+    unread = f"unread_for_{reader_type}"
+    with transaction.atomic():
+        # Lock the chat row first. A send that has already counted its message
+        # commits before we go on, so the message is visible below and read;
+        # one that has not yet counted it waits for us, and its message is
+        # newer than the watermark, so the counter and watermark agree
+        counter = Chat.objects.select_for_update().values_list(unread, flat=True).get(id=chat.id)
+        latest = (
+            Message1.objects.filter(chat_id=chat.id)
+            .exclude(sender_type=reader_type)
+            .order_by("-created_at")
+            .values_list("created_at", flat=True)
+            .first()
+        )
+        watermark = (
+            ChatParticipant.objects.filter(chat_id=chat.id, user_id=user_id)
+            .values_list("last_read_at", flat=True)
+            .first()
+        )
+        if counter:
+            # Also fixes a counter that drifted while the watermark was up to date
+            Chat.objects.filter(id=chat.id).update(**{unread: 0})
+        if latest is None or (watermark is not None and watermark >= latest):
+            # Nothing unread: polls that read an up-to-date chat write nothing
+            return None
+        if watermark is None:
+            ChatParticipant.objects.create(chat_id=chat.id, user_id=user_id, last_read_at=latest)
+        else:
+            ChatParticipant.objects.filter(chat_id=chat.id, user_id=user_id).update(last_read_at=latest)
+    broadcast_on_commit(chat.id, "read", {"reader_type": reader_type, "read_at": latest.isoformat()})
+    return latest
+
+
+class ChatEvents:
+    """
+    Async subscription to a chat's events for long-polling views.
+
+    wait() returns True when an event arrived and False on timeout; without
+    a channel layer it just sleeps, so callers must look at the database
+    again either way.
+    """
+
+    def __init__(self, chat_id):
+        self.group = group_name(chat_id)
+        self.layer = channel_layer()
+        self.channel = None
+
+    async def __aenter__(self):
+        if self.layer is not None:
+            try:
+                self.channel = await self.layer.new_channel()
+                await self.layer.group_add(self.group, self.channel)
+            except Exception as e:
+                print(f"Chat events unavailable, polling instead: {e}")
+                self.channel = None
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.channel is not None:
+            try:
+                await self.layer.group_discard(self.group, self.channel)
+            except Exception:
+                pass
+
+    async def wait(self, timeout):
+        if self.channel is None:
+            await asyncio.sleep(timeout)
+            return False
+        try:
+            await asyncio.wait_for(self.layer.receive(self.channel), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
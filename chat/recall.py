@@ -0,0 +1,511 @@
+"""
+Recall of a doctor's past consultations and case histories for new chats.
+
+Past AI chat messages and KasallikTarixi records are cut into chunks of a
+few lines (RecallChunk, which stores the stems of the chunk, not its text).
+send_message asks recall_message() for the chunks closest to the new
+question, from other sessions only, and sends the best ones that fit in
+AI_RECALL_MAX_TOKENS as one system message.
+
+Vectors are TF-IDF over stems (chat.search.stem) reduced with a randomized
+truncated SVD (LSA), so related wording lands close even without shared
+words. Chunks are written and the model is fitted in Celery tasks
+(chat.tasks.index_chat_message, refresh_recall_index), never in a request:
+
+- refresh_index() fits the model on the doctor's latest AI_RECALL_MAX_CHUNKS
+  chunks, or projects chunks added since onto the fitted components, and
+  refits once these folded-in chunks pass REFIT_FRACTION of the fitted ones;
+- it publishes the model in the Django cache; each web process keeps the
+  last version it loaded per doctor and only queries it, so a doctor with
+  no published model yet gets no recall until the task has run;
+- above ANN_MIN_CHUNKS chunks, vectors are grouped by spherical k-means and
+  a query only scores the NPROBE closest groups.
+
+Chunks deleted from the database (sessions removed, case histories edited)
+are dropped when their rows are fetched, and for good at the next refit.
+Nothing leaves the box: no embedding API or vector service is used.
+"""
+import math
+import re
+import threading
+import uuid
+from collections import Counter, OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+from .context import count_tokens
+from .search import terms as text_terms
+
+
+RECALL_PREFIX = (
+    "Фрагменты прошлых консультаций и историй болезни этого врача "
+    "(используй, только если они относятся к текущему вопросу):\n"
+)
+
+CHUNK_WORDS = 120
+MIN_CHUNK_WORDS = 4
+MIN_TERM_LENGTH = 2
+
+RANK = 96
+OVERSAMPLE = 10
+POWER_ITERATIONS = 1
+MAX_TERMS = 8192
+REFIT_FRACTION = 0.25
+REFIT_MIN_CHUNKS = 50
+
+ANN_MIN_CHUNKS = 1000
+KMEANS_ITERATIONS = 6
+NPROBE = 8
+
+SEED = 20240521
+
+# A queued refresh_recall_index that never ran stops blocking new ones after this
+REFRESH_LOCK_TIMEOUT = 600
+
+STATE_FIELDS = (
+    "vocabulary", "idf", "components", "fitted", "last_id",
+    "chunk_ids", "session_ids", "vectors", "centroids", "assignments",
+)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def chunk_spans(text, max_words=CHUNK_WORDS):
+    """(start, end) offsets of consecutive line groups of up to max_words words"""
+    spans = []
+    start = end = None
+    words = 0
+    for line in re.finditer(r"[^\n]+", text or ""):
+        line_words = list(re.finditer(r"\S+", line.group()))
+        if not line_words:
+            continue
+        if start is not None and words + len(line_words) > max_words:
+            spans.append((start, end))
+            start, words = None, 0
+        if len(line_words) > max_words:
+            # One very long line: cut it by words
+            for i in range(0, len(line_words), max_words):
+                group = line_words[i : i + max_words]
+                spans.append((line.start() + group[0].start(), line.start() + group[-1].end()))
+            continue
+        if start is None:
+            start = line.start() + line_words[0].start()
+        end = line.start() + line_words[-1].end()
+        words += len(line_words)
+    if start is not None:
+        spans.append((start, end))
+    return [(s, e) for s, e in spans if len(text[s:e].split()) >= MIN_CHUNK_WORDS]
+
+
+def chunk_terms(text):
+    return " ".join(term for term in text_terms(text) if len(term) >= MIN_TERM_LENGTH)
+
+
+def history_text(record):
+    """Text fields of a KasallikTarixi as "label: value" lines (chunk offsets point into it)"""
+    lines = []
+    for field in record._meta.concrete_fields:
+        if isinstance(field, models.TextField):
+            value = getattr(record, field.name)
+            if value and value.strip():
+                lines.append(f"{field.verbose_name}: {value.strip()}")
+    return "\n".join(lines)
+
+
+def _create_chunks(text, **fields):
+    from .models import RecallChunk
+
+    chunks = [
+        RecallChunk(start=start, end=end, terms=chunk_terms(text[start:end]), **fields)
+        for start, end in chunk_spans(text)
+    ]
+    RecallChunk.objects.bulk_create(chunks)
+    return chunks
+
+
+def index_message(message):
+    _create_chunks(
+        message.content,
+        user_id=message.session.user_id,
+        session_id=message.session_id,
+        message=message,
+        created_at=message.created_at,
+    )
+
+
+def index_history(record):
+    """(Re)index a case history; its chunks belong to the doctor who created the patient"""
+    from .models import RecallChunk
+
+    RecallChunk.objects.filter(kasallik_tarixi=record).delete()
+    user_id = record.patient.created_by_id
+    if user_id is None:
+        return
+    _create_chunks(
+        history_text(record),
+        user_id=user_id,
+        kasallik_tarixi=record,
+        created_at=record.yuborilgan_vaqt,
+    )
+
+
+BLOCK_ROWS = 512
+
+
+def _dense_blocks(rows, n_terms):
+    """(first row, dense block) slices of the TF-IDF rows given as (indices, values)"""
+    for first in range(0, len(rows), BLOCK_ROWS):
+        chunk = rows[first : first + BLOCK_ROWS]
+        block = np.zeros((len(chunk), n_terms), dtype=np.float32)
+        for i, (indices, values) in enumerate(chunk):
+            block[i, indices] = values
+        yield first, block
+
+
+def _x_dot(rows, matrix):
+    """X @ matrix"""
+    out = np.zeros((len(rows), matrix.shape[1]), dtype=np.float32)
+    for first, block in _dense_blocks(rows, matrix.shape[0]):
+        out[first : first + len(block)] = block @ matrix
+    return out
+
+
+def _xt_dot(rows, matrix, n_terms):
+    """X.T @ matrix"""
+    out = np.zeros((n_terms, matrix.shape[1]), dtype=np.float32)
+    for first, block in _dense_blocks(rows, n_terms):
+        out += block.T @ matrix[first : first + len(block)]
+    return out
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+class DoctorIndex:
+    """In-memory LSA vectors of one doctor's chunks"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.version = None
+        self.vocabulary = None
+        self.idf = None
+        self.components = None
+        self.fitted = 0
+        self.last_id = 0
+        self.chunk_ids = np.zeros(0, dtype=np.int64)
+        self.session_ids = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.centroids = None
+        self.assignments = None
+
+    def _tfidf(self, documents):
+        """Sublinear TF-IDF rows, L2-normalized, as (indices, values) per document"""
+        n_terms = len(self.vocabulary)
+        keys = []
+        for row, terms in enumerate(documents):
+            ids = [i for i in map(self.vocabulary.get, terms.split()) if i is not None]
+            keys.extend(row * n_terms + i for i in ids)
+        keys, counts = np.unique(np.array(keys, dtype=np.int64), return_counts=True)
+        rows, indices = np.divmod(keys, n_terms)
+        values = (1 + np.log(counts)).astype(np.float32) * self.idf[indices]
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(documents)))
+        values /= norms[rows]
+        bounds = np.searchsorted(rows, np.arange(len(documents) + 1))
+        return [
+            (indices[bounds[i] : bounds[i + 1]], values[bounds[i] : bounds[i + 1]])
+            for i in range(len(documents))
+        ]
+
+    def _project(self, rows):
+        vectors = np.zeros((len(rows), self.components.shape[1]), dtype=np.float32)
+        for i, (indices, values) in enumerate(rows):
+            if len(indices):
+                vectors[i] = values @ self.components[indices]
+        return _normalize(vectors)
+
+    def _rows(self, queryset):
+        return list(queryset.values_list("id", "session_id", "terms"))
+
+    def fit(self):
+        from .models import RecallChunk
+
+        limit = _setting("AI_RECALL_MAX_CHUNKS", 5000)
+        records = self._rows(RecallChunk.objects.filter(user_id=self.user_id).order_by("-id")[:limit])[::-1]
+        self.last_id = records[-1][0] if records else 0
+        self.fitted = len(records)
+        if len(records) < 2:
+            self.components = None
+            return
+
+        documents = [set(terms.split()) for _, _, terms in records]
+        df = Counter(term for terms in documents for term in terms)
+        n = len(documents)
+        min_df, max_df = (2, 0.5 * n) if n >= REFIT_MIN_CHUNKS else (1, n)
+        kept = [term for term, count in df.most_common() if min_df <= count <= max_df][:MAX_TERMS]
+        if not kept:
+            self.components = None
+            return
+        self.vocabulary = {term: i for i, term in enumerate(kept)}
+        self.idf = np.array(
+            [math.log((1 + n) / (1 + df[term])) + 1 for term in kept], dtype=np.float32
+        )
+
+        # Randomized truncated SVD of the sparse TF-IDF matrix (Halko et al.)
+        rows = self._tfidf([terms for _, _, terms in records])
+        n_terms = len(kept)
+        rank = min(RANK, n - 1, n_terms)
+        rng = np.random.default_rng(SEED)
+        sample = rng.standard_normal((n_terms, rank + OVERSAMPLE)).astype(np.float32)
+        basis = _x_dot(rows, sample)
+        for _ in range(POWER_ITERATIONS):
+            basis, _ = np.linalg.qr(basis)
+            basis = _x_dot(rows, _xt_dot(rows, basis, n_terms))
+        basis, _ = np.linalg.qr(basis)
+        projected = _xt_dot(rows, basis, n_terms)  # (Q.T @ X).T
+        _, _, vt = np.linalg.svd(projected.T, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:rank].T)
+
+        self.chunk_ids = np.array([record[0] for record in records], dtype=np.int64)
+        self.session_ids = np.array([record[1] or 0 for record in records], dtype=np.int64)
+        self.vectors = self._project(rows)
+        self._build_lists()
+
+    def _build_lists(self):
+        n = len(self.vectors)
+        if n < ANN_MIN_CHUNKS:
+            self.centroids = self.assignments = None
+            return
+        n_lists = int(math.sqrt(n))
+        rng = np.random.default_rng(SEED)
+        centroids = self.vectors[rng.choice(n, n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, self.vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+
+    def refresh(self):
+        """
+        Fold in chunks added since the last look, refitting when many are new.
+
+        Returns whether anything changed.
+        """
+        from .models import RecallChunk
+
+        if self.fitted == 0:
+            self.fit()
+            return True
+        records = self._rows(
+            RecallChunk.objects.filter(user_id=self.user_id, id__gt=self.last_id).order_by("id")
+        )
+        if not records:
+            return False
+        folded = len(self.chunk_ids) + len(records) - self.fitted
+        if self.components is None or folded > max(REFIT_MIN_CHUNKS, REFIT_FRACTION * self.fitted):
+            self.fit()
+            return True
+
+        self.last_id = records[-1][0]
+        vectors = self._project(self._tfidf([terms for _, _, terms in records]))
+        self.chunk_ids = np.concatenate([self.chunk_ids, [record[0] for record in records]])
+        self.session_ids = np.concatenate([self.session_ids, [record[1] or 0 for record in records]])
+        self.vectors = np.concatenate([self.vectors, vectors])
+        if self.centroids is not None:
+            self.assignments = np.concatenate(
+                [self.assignments, np.argmax(vectors @ self.centroids.T, axis=1)]
+            )
+        elif len(self.vectors) >= ANN_MIN_CHUNKS:
+            self._build_lists()
+        return True
+
+    def publish(self):
+        """Store the model in the cache for the other processes"""
+        self.version = uuid.uuid4().hex
+        state = {name: getattr(self, name) for name in STATE_FIELDS}
+        state["version"] = self.version
+        # The state first: a process that sees the new version must find it
+        cache.set(_state_key(self.user_id), state, None)
+        cache.set(_version_key(self.user_id), self.version, None)
+
+    def sync(self):
+        """
+        Load the last published model if it is not the one in memory.
+
+        Never fits; returns False when no model is published (yet).
+        """
+        version = cache.get(_version_key(self.user_id))
+        if version is not None and version == self.version:
+            return True
+        state = cache.get(_state_key(self.user_id)) if version is not None else None
+        if state is None:
+            self._reset()
+            return False
+        for name in STATE_FIELDS:
+            setattr(self, name, state[name])
+        self.version = state["version"]
+        return True
+
+    def query(self, text, limit, exclude_session_id=None):
+        """[(chunk id, cosine)] best first"""
+        if self.components is None or not len(self.vectors):
+            return []
+        rows = self._tfidf([chunk_terms(text)])
+        if not len(rows[0][0]):
+            return []
+        vector = self._project(rows)[0]
+
+        if self.centroids is not None:
+            probe = np.argsort(-(self.centroids @ vector))[:NPROBE]
+            candidates = np.flatnonzero(np.isin(self.assignments, probe))
+        else:
+            candidates = np.arange(len(self.vectors))
+        if exclude_session_id is not None:
+            candidates = candidates[self.session_ids[candidates] != exclude_session_id]
+        if not len(candidates):
+            return []
+
+        scores = self.vectors[candidates] @ vector
+        top = np.argsort(-scores)[:limit]
+        return [(int(self.chunk_ids[candidates[i]]), float(scores[i])) for i in top]
+
+
+def _state_key(user_id):
+    return f"chat-recall-index-{user_id}"
+
+
+def _version_key(user_id):
+    return f"chat-recall-version-{user_id}"
+
+
+def refresh_lock_key(user_id):
+    return f"chat-recall-refresh-{user_id}"
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(user_id):
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = DoctorIndex(user_id)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > _setting("AI_RECALL_CACHED_DOCTORS", 32):
+            _indexes.popitem(last=False)
+    return index
+
+
+def refresh_index(user_id, refit=False):
+    """Bring a doctor's published model up to date with the chunks (run by Celery)"""
+    index = get_index(user_id)
+    with index.lock:
+        index.sync()
+        if refit:
+            index.fit()
+        elif not index.refresh():
+            return
+        index.publish()
+
+
+def schedule_refresh(user_id):
+    """Queue refresh_index for a doctor unless one is already waiting"""
+    if not cache.add(refresh_lock_key(user_id), True, REFRESH_LOCK_TIMEOUT):
+        return False
+
+    from .tasks import refresh_recall_index
+
+    try:
+        refresh_recall_index.delay(user_id)
+    except Exception as e:
+        cache.delete(refresh_lock_key(user_id))
+        print(f"Recall refresh for user {user_id} not queued: {e}")
+        return False
+    return True
+
+
+def _chunk_label(chunk):
+    if chunk.kasallik_tarixi_id:
+        record = chunk.kasallik_tarixi
+        return f"Kasallik tarixi: {record.fish}, {record.kelgan_vaqti:%d.%m.%Y}"
+    title = chunk.session.title or "без названия"
+    return f"Консультация «{title}», {chunk.created_at:%d.%m.%Y}"
+
+
+def _chunk_text(chunk):
+    if chunk.kasallik_tarixi_id:
+        text = history_text(chunk.kasallik_tarixi)
+    else:
+        text = chunk.message.content
+    return text[chunk.start : chunk.end]
+
+
+def recall(user_id, query, exclude_session_id=None, max_tokens=None, top_k=None):
+    """
+    Past chunks of a doctor closest to query, best first, within max_tokens.
+
+    Each hit is a dict with the chunk id, score, label and text.
+    """
+    from .models import RecallChunk
+
+    max_tokens = _setting("AI_RECALL_MAX_TOKENS", 800) if max_tokens is None else max_tokens
+    top_k = _setting("AI_RECALL_TOP_K", 5) if top_k is None else top_k
+    min_score = _setting("AI_RECALL_MIN_SCORE", 0.25)
+
+    index = get_index(user_id)
+    with index.lock:
+        published = index.sync()
+        # Extra candidates for chunks deleted since they were loaded
+        matches = index.query(query, top_k * 2, exclude_session_id) if published else []
+    if not published:
+        # First query of this doctor, or the model was evicted from the cache
+        schedule_refresh(user_id)
+        return []
+    matches = [(chunk_id, score) for chunk_id, score in matches if score >= min_score]
+    if not matches:
+        return []
+
+    chunks = RecallChunk.objects.select_related("session", "message", "kasallik_tarixi").in_bulk(
+        [chunk_id for chunk_id, _ in matches]
+    )
+    hits, used, seen = [], 0, set()
+    for chunk_id, score in matches:
+        chunk = chunks.get(chunk_id)
+        if chunk is None:
+            continue
+        text = _chunk_text(chunk).strip()
+        label = _chunk_label(chunk)
+        tokens = count_tokens(f"[{label}] {text}")
+        # Repeated questions and copied answers would fill the budget with one snippet
+        if used + tokens > max_tokens or text in seen:
+            continue
+        seen.add(text)
+        hits.append({"chunk_id": chunk_id, "score": round(score, 4), "label": label, "text": text})
+        used += tokens
+        if len(hits) >= top_k:
+            break
+    return hits
+
+
+def recall_message(user_id, query, exclude_session_id=None):
+    """System message with recalled snippets for send_message, or None"""
+    hits = recall(user_id, query, exclude_session_id=exclude_session_id)
+    if not hits:
+        return None
+    snippets = "\n\n".join(f"[{hit['label']}] {hit['text']}" for hit in hits)
+    return {"role": "system", "content": RECALL_PREFIX + snippets}
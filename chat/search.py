@@ -0,0 +1,255 @@
+"""
+Full-text search over a user's AI chat history (message texts and session titles).
+
+Message.content is stored compressed, so the database cannot search it
+directly. index_message() feeds the plain text to a separate index once a
+new message is committed (the chat.tasks.index_chat_message Celery task):
+
+- SQLite: the chat_search FTS5 table (contentless, rowid = SearchDocument.id),
+  ranked with bm25();
+- PostgreSQL: a tsvector column on chat_searchdocument with a GIN index,
+  ranked with ts_rank_cd().
+
+Both store the same terms: words are lowercased and cut to a stem by light
+suffix stripping for Russian, Uzbek and English (stem()). Queries go through
+the same function, so "анализы" finds "анализ" and "bemorlarning" finds
+"bemor". PostgreSQL uses the 'simple' config so it does not stem again.
+
+Snippets are cut from the decompressed text of the returned page only.
+
+Deleted messages lose their SearchDocument row and stop matching at once;
+on SQLite their FTS entries stay until `manage.py rebuild_search_index`.
+"""
+import html
+import re
+
+from django.db import connection, transaction
+
+
+WORD_RE = re.compile(r"[^\W_]+(?:['‘’ʻʼ`][^\W_]+)*")
+APOSTROPHES_RE = re.compile(r"['‘’ʻʼ`]")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+MIN_STEM = 3
+
+# Inflectional endings only; the longest one that leaves MIN_STEM letters is cut
+RU_ENDINGS = (
+    "иями", "ями", "ами", "ием", "иях", "ях", "ах", "ям", "ам", "ия", "ие", "ии", "ию",
+    "ов", "ев", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ого", "его",
+    "ому", "ему", "ыми", "ими", "ым", "им", "ом", "ем", "ую", "юю", "ых", "их", "ью",
+    "ешь", "ет", "ют", "ут", "ит", "ат", "ят", "ть", "ла", "ли", "ло",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "й", "ь",
+)
+UZ_CYRILLIC_ENDINGS = (
+    "ларнинг", "лардан", "ларни", "ларга", "ларда", "лари", "лар", "нинг", "дан",
+)
+UZ_ENDINGS = (
+    "larimizning", "laringizning", "larining", "larning", "larimiz", "laringiz",
+    "laridan", "larida", "lariga", "larini", "lardan", "larni", "larga", "larda",
+    "lari", "lar", "imizning", "ingizning", "ining", "ning", "imiz", "ingiz",
+    "dagi", "dan", "ga", "ka", "qa", "da", "ni", "si", "im", "i",
+)
+EN_ENDINGS = (
+    "ations", "ation", "ments", "ment", "ness", "ings", "ing", "ies", "es", "ed", "ly", "s", "e",
+)
+
+_CYRILLIC_ENDINGS = sorted(set(RU_ENDINGS + UZ_CYRILLIC_ENDINGS), key=len, reverse=True)
+_LATIN_ENDINGS = sorted(set(UZ_ENDINGS + EN_ENDINGS), key=len, reverse=True)
+
+MAX_QUERY_TERMS = 10
+SNIPPET_WORDS = 30
+SNIPPET_LEAD = 8
+
+
+def stem(word):
+    """Index term for a word (lowercased, apostrophes dropped, ending cut)"""
+    word = APOSTROPHES_RE.sub("", word.lower()).replace("ё", "е")
+    if word.isdigit():
+        return word
+    endings = _CYRILLIC_ENDINGS if CYRILLIC_RE.search(word) else _LATIN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+def terms(text):
+    return [stem(match.group()) for match in WORD_RE.finditer(text or "")]
+
+
+def query_terms(query):
+    """Distinct stems of a search query, in order"""
+    seen = []
+    for term in terms(query):
+        if term not in seen:
+            seen.append(term)
+    return seen[:MAX_QUERY_TERMS]
+
+
+def available():
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def _table():
+    from .models import SearchDocument
+
+    return SearchDocument._meta.db_table
+
+
+def _write_terms(entries):
+    """Index (SearchDocument id, text) pairs"""
+    rows = [(doc_id, " ".join(terms(text))) for doc_id, text in entries]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.executemany("INSERT INTO chat_search(rowid, terms) VALUES (%s, %s)", rows)
+        else:
+            cursor.executemany(
+                f"UPDATE {_table()} SET vector = to_tsvector('simple', %s) WHERE id = %s",
+                [(text, doc_id) for doc_id, text in rows],
+            )
+
+
+def index_rows(rows):
+    """
+    Index (user id, session id, message id or None, created_at, text) rows.
+
+    Message id None is the session title. Used for new messages and by the
+    rebuild command; the documents and their terms go in two statements.
+    """
+    from .models import SearchDocument
+
+    if not available() or not rows:
+        return
+    documents = [
+        SearchDocument(user_id=user_id, session_id=session_id, message_id=message_id, created_at=created_at)
+        for user_id, session_id, message_id, created_at, _ in rows
+    ]
+    with transaction.atomic():
+        documents = SearchDocument.objects.bulk_create(documents)
+        _write_terms([(document.id, row[4]) for document, row in zip(documents, rows)])
+
+
+def index_message(message):
+    index_rows(
+        [(message.session.user_id, message.session_id, message.id, message.created_at, message.content)]
+    )
+
+
+def index_session_title(session):
+    from .models import SearchDocument
+
+    if not available():
+        return
+    SearchDocument.objects.filter(session=session, message__isnull=True).delete()
+    if session.title:
+        index_rows([(session.user_id, session.id, None, session.created_at, session.title)])
+
+
+def clear():
+    from .models import SearchDocument
+
+    with transaction.atomic():
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO chat_search(chat_search) VALUES ('delete-all')")
+        SearchDocument.objects.all().delete()
+
+
+def _match_ids(user_id, stems, limit, offset):
+    """[(document id, score)] best first"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            # Implicit AND; the last term also matches as a prefix while typing
+            match = " ".join(f'"{term}"' for term in stems) + "*"
+            cursor.execute(
+                f"SELECT d.id, -bm25(chat_search) AS score FROM chat_search "
+                f"JOIN {_table()} d ON d.id = chat_search.rowid "
+                f"WHERE chat_search MATCH %s AND d.user_id = %s "
+                f"ORDER BY score DESC, d.id DESC LIMIT %s OFFSET %s",
+                [match, user_id, limit, offset],
+            )
+        else:
+            tsquery = " & ".join(stems) + ":*"
+            cursor.execute(
+                f"SELECT d.id, ts_rank_cd(d.vector, q) AS score "
+                f"FROM {_table()} d, to_tsquery('simple', %s) q "
+                f"WHERE d.user_id = %s AND d.vector @@ q "
+                f"ORDER BY score DESC, d.id DESC LIMIT %s OFFSET %s",
+                [tsquery, user_id, limit, offset],
+            )
+        return cursor.fetchall()
+
+
+def snippet(text, stems, words=SNIPPET_WORDS):
+    """HTML-escaped excerpt around the first match with matched words in <mark>"""
+    tokens = list(WORD_RE.finditer(text or ""))
+    if not tokens:
+        return ""
+    last = stems[-1] if stems else None
+
+    def is_hit(token):
+        term = stem(token.group())
+        return term in stems or (last is not None and term.startswith(last))
+
+    hits = [i for i, token in enumerate(tokens) if is_hit(token)]
+    first = max((hits[0] if hits else 0) - SNIPPET_LEAD, 0)
+    window = tokens[first : first + words]
+
+    start, end = window[0].start(), window[-1].end()
+    parts, position = [], start
+    for token in window:
+        parts.append(html.escape(text[position : token.start()]))
+        escaped = html.escape(token.group())
+        parts.append(f"<mark>{escaped}</mark>" if is_hit(token) else escaped)
+        position = token.end()
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def search(user, query, limit=20, offset=0):
+    """
+    Ranked hits for a user's query: one per message or session title.
+
+    Returns (hits, has_more); each hit has the session, the message (None for
+    a title match), the role, the score and a highlighted snippet.
+    """
+    from .models import Message, SearchDocument
+
+    stems = query_terms(query)
+    if not stems or not available():
+        return [], False
+
+    matched = _match_ids(user.id, stems, limit + 1, offset)
+    has_more = len(matched) > limit
+    scores = dict(matched[:limit])
+
+    documents = {
+        document.id: document
+        for document in SearchDocument.objects.filter(id__in=scores).select_related("session")
+    }
+    messages = Message.objects.in_bulk(
+        [document.message_id for document in documents.values() if document.message_id]
+    )
+
+    hits = []
+    for doc_id, score in matched[:limit]:
+        document = documents.get(doc_id)
+        if document is None:
+            continue
+        message = messages.get(document.message_id)
+        if document.message_id and message is None:
+            continue
+        session = document.session
+        hits.append(
+            {
+                "session_id": session.id,
+                "session_title": session.title,
+                "message_id": message.id if message else None,
+                "role": message.role if message else None,
+                "created_at": document.created_at,
+                "score": round(float(score), 4),
+                "snippet": snippet(message.content if message else session.title, stems),
+            }
+        )
+    return hits, has_more
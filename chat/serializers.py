@@ -1,8 +1,13 @@
 from rest_framework import serializers
-from .models import Chat, ChatSession, Message, UploadedImage
+from . import messaging
+from .models import AIJob, Chat, ChatSession, Message, Message1, UploadedImage
 from doctors.models import Doctor
+from healthcare_api.compression import decompress
 from patients.models import Patient
 
+# Characters of the last message shown in the session list
+SESSION_PREVIEW_LENGTH = 120
+
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,22 +24,92 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "user", "created_at", "messages"]
 
 
+class ChatSessionListSerializer(serializers.ModelSerializer):
+    """Session list entry without messages; the extra fields come from ChatSessionViewSet annotations"""
+
+    message_count = serializers.IntegerField(read_only=True)
+    last_message_preview = serializers.SerializerMethodField()
+    last_message_role = serializers.CharField(read_only=True, allow_null=True)
+    last_message_at = serializers.DateTimeField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = ChatSession
+        fields = [
+            "id",
+            "title",
+            "created_at",
+            "message_count",
+            "last_message_preview",
+            "last_message_role",
+            "last_message_at",
+        ]
+        read_only_fields = fields
+
+    def get_last_message_preview(self, obj):
+        content = decompress(getattr(obj, "last_message_content", None))
+        return content[:SESSION_PREVIEW_LENGTH] if content is not None else None
+
+
+class ChatSessionMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ["id", "session", "role", "content", "model_used", "created_at"]
+        read_only_fields = fields
+
+
 class UploadedImageSerializer(serializers.ModelSerializer):
     analysis = serializers.CharField(source="analyzed_text", read_only=True)
+    # OCR runs in the background; poll until status is "done" or "failed"
+    status = serializers.CharField(source="ocr_status", read_only=True)
+    language = serializers.ChoiceField(
+        source="ocr_language", choices=UploadedImage.OCR_LANGUAGES, required=False
+    )
+    error = serializers.CharField(source="ocr_error", read_only=True)
+    finished_at = serializers.DateTimeField(source="ocr_finished_at", read_only=True)
 
     class Meta:
         model = UploadedImage
-        fields = ["id", "user", "image", "analysis", "created_at"]
+        fields = [
+            "id",
+            "user",
+            "image",
+            "language",
+            "status",
+            "analysis",
+            "error",
+            "created_at",
+            "finished_at",
+        ]
         read_only_fields = ["user", "analysis", "created_at"]
 
 
+class AIJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AIJob
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "result",
+            "error",
+            "session",
+            "message",
+            "kasallik_tarixi",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender_name = serializers.CharField(source="sender.full_name", read_only=True)
     sender_avatar = serializers.SerializerMethodField()
+    is_read = serializers.SerializerMethodField()
     time_ago = serializers.SerializerMethodField()
 
     class Meta:
-        model = Message
+        model = Message1
         fields = [
             "id",
             "content",
@@ -55,6 +130,12 @@ class MessageSerializer(serializers.ModelSerializer):
             return obj.sender.profile_picture.url
         return None
 
+    def get_is_read(self, obj):
+        # context["read_at"]: {"doctor": ..., "patient": ...} read watermarks of the chat
+        recipient = "patient" if obj.sender_type == "doctor" else "doctor"
+        read_at = self.context.get("read_at", {}).get(recipient)
+        return read_at is not None and obj.created_at <= read_at
+
     def get_time_ago(self, obj):
         from django.utils import timezone
         from datetime import datetime, timedelta
@@ -82,7 +163,7 @@ class ChatSerializer(serializers.ModelSerializer):
     doctor_specialty = serializers.CharField(
         source="doctor.get_specialty_display", read_only=True
     )
-    last_message = MessageSerializer(read_only=True)
+    last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
 
     class Meta:
@@ -99,26 +180,37 @@ class ChatSerializer(serializers.ModelSerializer):
             "is_active",
         ]
 
+    def get_last_message(self, obj):
+        message = obj.last_message
+        if message is None:
+            return None
+        data = MessageSerializer(message, context=self.context).data
+        # The last message is read once its recipient has nothing unread
+        recipient = "patient" if message.sender_type == "doctor" else "doctor"
+        data["is_read"] = getattr(obj, f"unread_for_{recipient}") == 0
+        return data
+
     def get_unread_count(self, obj):
+        # Denormalized on Chat; the user's profile lookups are cached after the first chat
         request = self.context.get("request")
         if request and request.user:
             if hasattr(request.user, "doctor_profile"):
-                return obj.unread_count_for_doctor
+                return obj.unread_for_doctor
             elif hasattr(request.user, "patient_profile"):
-                return obj.unread_count_for_patient
+                return obj.unread_for_patient
         return 0
 
 
 class CreateMessageSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Message
+        model = Message1
         fields = ["content", "message_type", "file_url"]
 
     def create(self, validated_data):
-        chat_id = self.context["chat_id"]
-        sender = self.context["request"].user
-
-        chat = Chat.objects.get(id=chat_id)
-
-        message = Message.objects.create(chat=chat, sender=sender, **validated_data)
-        return message
+        # The view has loaded the chat and checked the sender's side
+        return messaging.send(
+            self.context["chat"],
+            self.context["request"].user,
+            self.context["sender_type"],
+            **validated_data,
+        )
@@ -0,0 +1,115 @@
+"""
+Rolling conversation summaries for ChatSession.
+
+Once the unsummarized part of a session grows past AI_SUMMARY_TRIGGER_TOKENS,
+older turns are folded into ChatSession.summary by a Celery task, so chat
+requests only carry the summary plus the recent tail.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ChatSession
+from .prompts import get_prompt
+
+
+SUMMARY_LOCK_TIMEOUT = 300
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def summary_lock_key(session_id):
+    return f"chat-summary-{session_id}"
+
+
+def schedule_summary(session):
+    """Queue a summary refresh if the unsummarized history is over the threshold"""
+    pending = session.messages.order_by("-created_at", "-id")
+    if session.summary_upto_id:
+        pending = pending.filter(id__gt=session.summary_upto_id)
+    # The recent tail is always sent verbatim, so only what could be folded counts
+    foldable = pending[_setting("AI_SUMMARY_KEEP_RECENT", 6):]
+    tokens = foldable.aggregate(total=Sum("token_count"))["total"] or 0
+    if tokens < _setting("AI_SUMMARY_TRIGGER_TOKENS", 8000):
+        return False
+
+    # One refresh per session at a time
+    if not cache.add(summary_lock_key(session.id), True, SUMMARY_LOCK_TIMEOUT):
+        return False
+
+    transaction.on_commit(lambda: _queue_summary(session.id))
+    return True
+
+
+def _queue_summary(session_id):
+    """
+    Hand the refresh to Celery. A summary is only an optimization, so with
+    the broker down it is skipped (and retried after the next reply)
+    rather than failing the chat request.
+    """
+    from .tasks import summarize_session
+
+    try:
+        summarize_session.delay(session_id)
+    except Exception as e:
+        cache.delete(summary_lock_key(session_id))
+        print(f"Summary of session {session_id} not queued: {e}")
+
+
+def refresh_session_summary(session_id):
+    """Fold the older unsummarized turns of a session into its summary"""
+    from .context import count_tokens
+    from .views import call_openai_api
+
+    session = ChatSession.objects.get(id=session_id)
+    keep_recent = _setting("AI_SUMMARY_KEEP_RECENT", 6)
+    input_budget = _setting("AI_SUMMARY_INPUT_TOKENS", 12000)
+
+    pending = session.messages.order_by("created_at", "id").only(
+        "id", "role", "content", "token_count"
+    )
+    if session.summary_upto_id:
+        pending = pending.filter(id__gt=session.summary_upto_id)
+    pending = list(pending)
+    if len(pending) <= keep_recent:
+        return None
+
+    # Oldest turns first, leaving the recent tail verbatim; a huge backlog is
+    # folded over several runs rather than in one oversized request
+    folded = []
+    used = 0
+    for msg in pending[: len(pending) - keep_recent]:
+        tokens = msg.token_count if msg.token_count is not None else count_tokens(msg.content)
+        if folded and used + tokens > input_budget:
+            break
+        folded.append(msg)
+        used += tokens
+
+    transcript = "\n\n".join(
+        f"{'Врач' if msg.role == 'user' else 'AviShifo'}: {msg.content}" for msg in folded
+    )
+    parts = []
+    if session.summary:
+        parts.append(f"Текущее резюме:\n{session.summary}")
+    parts.append(f"Новые сообщения:\n{transcript}")
+
+    summary = call_openai_api(
+        [
+            {"role": "system", "content": get_prompt("summary.system").text},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ],
+        model=_setting("AI_SUMMARY_MODEL", "gpt-4o-mini"),
+        max_tokens=_setting("AI_SUMMARY_MAX_TOKENS", 800),
+        user_id=session.user_id,
+    )
+
+    ChatSession.objects.filter(id=session.id).update(
+        summary=summary,
+        summary_upto=folded[-1],
+        summary_updated_at=timezone.now(),
+    )
+    return summary
@@ -0,0 +1,183 @@
+from celery import shared_task
+from django.core.cache import cache
+from django.utils import timezone
+
+from datetime import timedelta
+
+from django.conf import settings
+
+from . import image_cache, ocr, recall, search
+from .models import AICall, AIJob, Message
+from .summaries import refresh_session_summary, summary_lock_key
+from .telemetry import call_context
+
+
+CHAT_IMAGE_FALLBACK_REPLY = "Извините, произошла ошибка при анализе изображения. Пожалуйста, попробуйте еще раз."
+
+
+@shared_task
+def run_ai_job(job_id):
+    """Run the OpenAI request stored on an AIJob and write the result back"""
+    from .views import call_openai_api
+
+    claimed = AIJob.objects.filter(id=job_id, status="pending").update(
+        status="running", started_at=timezone.now()
+    )
+    if not claimed:
+        # Already picked up by another worker (acks_late redelivery)
+        return
+
+    job = AIJob.objects.select_related("kasallik_tarixi").get(id=job_id)
+
+    payload = job.payload
+    try:
+        with call_context(endpoint=f"job:{job.kind}", session_id=job.session_id):
+            result = call_openai_api(
+                payload["messages"],
+                model=payload.get("model", "gpt-4o"),
+                max_tokens=payload.get("max_tokens", 3000),
+                user_id=job.user_id,
+            )
+    except Exception as e:
+        print(f"Error in AI job {job.id}: {e}")
+        job.status = "failed"
+        job.error = str(e)
+        if job.session_id:
+            job.message = Message.objects.create(
+                session_id=job.session_id,
+                role="assistant",
+                content=CHAT_IMAGE_FALLBACK_REPLY,
+                model_used="error",
+            )
+    else:
+        job.status = "done"
+        job.result = result
+        if payload.get("cache_key"):
+            image_cache.store(image_cache.CacheKey(*payload["cache_key"]), result)
+        model_used = payload.get("model", "gpt-4o")
+        if job.session_id:
+            job.message = Message.objects.create(
+                session_id=job.session_id,
+                role="assistant",
+                content=result,
+                model_used=model_used,
+            )
+        if job.kasallik_tarixi_id:
+            job.kasallik_tarixi.ai_tahlil = result
+            job.kasallik_tarixi.save(update_fields=["ai_tahlil"])
+
+    # Drop the (possibly multi-megabyte) request body once it is no longer needed
+    job.payload = {}
+    job.finished_at = timezone.now()
+    job.save()
+
+
+def queue_ai_job(job_id):
+    """
+    Hand a committed AIJob to the workers (transaction.on_commit callback).
+
+    If the broker is unreachable the job is marked failed, with the usual
+    fallback reply in its session, instead of staying pending forever.
+    """
+    try:
+        run_ai_job.delay(job_id)
+        return
+    except Exception as e:
+        print(f"AI job {job_id} not queued: {e}")
+        error = f"Job could not be queued: {e}"
+
+    job = AIJob.objects.filter(id=job_id, status="pending").first()
+    if job is None:
+        return
+    job.status = "failed"
+    job.error = error
+    if job.session_id:
+        job.message = Message.objects.create(
+            session_id=job.session_id,
+            role="assistant",
+            content=CHAT_IMAGE_FALLBACK_REPLY,
+            model_used="error",
+        )
+    job.payload = {}
+    job.finished_at = timezone.now()
+    job.save()
+
+
+@shared_task
+def ocr_uploaded_image(image_id):
+    """Run OCR for an UploadedImage and write analyzed_text back"""
+    ocr.recognize_uploaded_image(image_id)
+
+
+def delay_or_run(task, *args):
+    """
+    Queue a task that must not be lost; run it here if the broker is unreachable.
+
+    For transaction.on_commit callbacks: the row is already saved, so
+    errors are printed instead of failing the request.
+    """
+    try:
+        task.delay(*args)
+        return
+    except Exception as e:
+        print(f"Task {task.name}{args} not queued ({e}), running it inline")
+    try:
+        task(*args)
+    except Exception as e:
+        print(f"Error in task {task.name}{args}: {e}")
+
+
+@shared_task
+def index_chat_message(message_id):
+    """Add a new Message to the search and recall indexes"""
+    message = Message.objects.select_related("session").filter(id=message_id).first()
+    if message is None:
+        return
+    search.index_message(message)
+    recall.index_message(message)
+    recall.schedule_refresh(message.session.user_id)
+
+
+@shared_task
+def index_case_history(record_id):
+    """(Re)index a saved KasallikTarixi for recall"""
+    from patients.models import KasallikTarixi
+
+    record = KasallikTarixi.objects.select_related("patient").filter(id=record_id).first()
+    if record is None:
+        return
+    recall.index_history(record)
+    if record.patient.created_by_id:
+        recall.schedule_refresh(record.patient.created_by_id)
+
+
+@shared_task
+def refresh_recall_index(user_id):
+    """Fold new chunks into a doctor's recall model (refitting when due) and publish it"""
+    # Chunks written from now on queue the next refresh
+    cache.delete(recall.refresh_lock_key(user_id))
+    recall.refresh_index(user_id)
+
+
+@shared_task
+def summarize_session(session_id):
+    """Fold older turns of a ChatSession into its rolling summary"""
+    try:
+        with call_context(endpoint="summary", session_id=session_id):
+            refresh_session_summary(session_id)
+    finally:
+        cache.delete(summary_lock_key(session_id))
+
+
+@shared_task
+def prune_image_analysis_cache():
+    """Evict expired / least recently used image analyses (run from celery beat)"""
+    return image_cache.prune()
+
+
+@shared_task
+def prune_ai_calls():
+    """Delete AI call telemetry older than AI_TELEMETRY_RETENTION_DAYS (run from celery beat)"""
+    cutoff = timezone.now() - timedelta(days=getattr(settings, "AI_TELEMETRY_RETENTION_DAYS", 30))
+    deleted, _ = AICall.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
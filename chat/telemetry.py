@@ -0,0 +1,238 @@
+"""
+Per-call AI telemetry.
+
+The gateway measures every OpenAI call: time spent waiting for a
+concurrency slot, upstream latency (including retries), time to first
+token for streams, prompt / completion tokens, retries and outcome. Each
+call becomes one AICall row.
+
+The endpoint, language and chat session of a call come from the request
+context. AITelemetryMiddleware records the URL name of every request.
+Views add details with annotate(), and Celery tasks open their own
+call_context(). Worker threads of a request run in worker_context(), so
+each has its own record. When an assistant Message is saved, the calls
+made for it are linked to it.
+"""
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+
+import openai
+from django.utils.deprecation import MiddlewareMixin
+
+
+_context = contextvars.ContextVar("ai_call_context", default=None)
+
+
+def current():
+    return _context.get()
+
+
+def annotate(**fields):
+    """
+    Attach fields (language, session_id, ...) to AI calls of the current request.
+
+    Without a request or call_context() this does nothing: a context set
+    here would never be reset and would leak into whatever runs next on
+    the thread (Celery workers reuse theirs).
+    """
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+@contextmanager
+def call_context(**fields):
+    """AI calls made inside the block are tagged with fields (for tasks and scripts)"""
+    token = _context.set(dict(fields))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def worker_context():
+    """
+    Copy of the current context for a worker thread of this request.
+
+    The worker gets its own record (same endpoint, language, ...), so the
+    calls it makes are not mixed into other workers' pending_calls.
+    """
+    worker = contextvars.copy_context()
+    context = worker.get(_context)
+    if context is not None:
+        worker.run(_context.set, {k: v for k, v in context.items() if k != "pending_calls"})
+    return worker
+
+
+def _reset(token):
+    try:
+        _context.reset(token)
+    except ValueError:
+        # Closed from another context (ASGI runs close() in a thread)
+        _context.set(None)
+
+
+class AITelemetryMiddleware(MiddlewareMixin):
+    """Tag AI calls with the URL name of the request that made them"""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request._ai_context_token = _context.set(
+            {"endpoint": match.url_name if match else request.path[:64]}
+        )
+
+    def process_response(self, request, response):
+        token = getattr(request, "_ai_context_token", None)
+        if token is None:
+            return response
+        if response.streaming:
+            # Streaming bodies run after this point and still need the
+            # context; drop it once the server closes the response
+            response._resource_closers.append(lambda: _reset(token))
+        else:
+            _reset(token)
+        return response
+
+
+def classify(error):
+    from .ai_gateway import AIBusyError, AIUnavailableError
+
+    if isinstance(error, GeneratorExit):
+        return "cancelled"
+    if isinstance(error, AIBusyError):
+        return "busy"
+    if isinstance(error, AIUnavailableError):
+        return "unavailable"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    return "error"
+
+
+def _ms(seconds):
+    return max(0, round(seconds * 1000)) if seconds is not None else None
+
+
+class CallMetrics:
+    """Timings and usage of one gateway call, filled in while it runs"""
+
+    def __init__(self, model, user_id=None, streamed=False):
+        self.model = model
+        self.user_id = user_id
+        self.streamed = streamed
+        self.started = time.monotonic()
+        self.acquired_at = None
+        self.first_token_at = None
+        self.retries = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.outcome = "ok"
+
+    def acquired(self):
+        self.acquired_at = time.monotonic()
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def set_usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens
+            self.completion_tokens = usage.completion_tokens
+
+    def fail(self, error):
+        self.outcome = classify(error)
+
+    @property
+    def billed_tokens(self):
+        """Tokens the provider charges for this call (failed requests are free)"""
+        if self.outcome not in ("ok", "cancelled"):
+            return 0
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+    def save(self, messages, reply=""):
+        """Store the call as an AICall row; never breaks the AI call itself"""
+        from .context import count_tokens, message_tokens
+        from .models import AICall
+
+        finished = time.monotonic()
+        acquired_at = self.acquired_at or finished
+        if self.prompt_tokens is None and self.acquired_at is not None:
+            # No usage from the provider (error, cut-off stream) - estimate
+            self.prompt_tokens = sum(message_tokens(m, self.model) for m in messages)
+            self.completion_tokens = count_tokens(reply, self.model)
+
+        context = _context.get() or {}
+        try:
+            call = AICall.objects.create(
+                endpoint=(context.get("endpoint") or "")[:64],
+                model=self.model[:32],
+                language=str(context.get("language") or "")[:8],
+                user_id=self.user_id or context.get("user_id"),
+                session_id=context.get("session_id"),
+                streamed=self.streamed,
+                queue_wait_ms=_ms(acquired_at - self.started),
+                latency_ms=_ms(finished - acquired_at),
+                ttft_ms=_ms(self.first_token_at - acquired_at) if self.first_token_at else None,
+                prompt_tokens=self.prompt_tokens or 0,
+                completion_tokens=self.completion_tokens or 0,
+                retries=self.retries,
+                outcome=self.outcome,
+            )
+        except Exception as e:
+            print(f"AI telemetry not saved: {e}")
+            return None
+
+        if context:
+            context.setdefault("pending_calls", []).append(call.id)
+        return call
+
+
+def link_message(message):
+    """Point the AI calls made for this reply at the saved assistant Message"""
+    from .models import AICall
+
+    context = _context.get()
+    if not context or not context.get("pending_calls"):
+        return
+    AICall.objects.filter(id__in=context.pop("pending_calls")).update(
+        message=message, session_id=message.session_id
+    )
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(rows):
+    """p50/p95/p99 and totals for AICall rows (dicts) grouped by endpoint, model and language"""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["endpoint"], row["model"], row["language"]), []).append(row)
+
+    result = []
+    for (endpoint, model, language), calls in groups.items():
+        stats = {
+            "endpoint": endpoint,
+            "model": model,
+            "language": language,
+            "calls": len(calls),
+            "errors": sum(1 for c in calls if c["outcome"] != "ok"),
+            "retries": sum(c["retries"] for c in calls),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in calls),
+        }
+        stats["error_rate"] = round(stats["errors"] / len(calls), 4)
+        for field in ("queue_wait_ms", "latency_ms", "ttft_ms"):
+            values = sorted(c[field] for c in calls if c[field] is not None)
+            stats[field] = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+        result.append(stats)
+
+    result.sort(key=lambda s: s["calls"], reverse=True)
+    return result
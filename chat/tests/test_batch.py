@@ -0,0 +1,132 @@
+import time
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import ai_gateway, image_cache
+from chat.telemetry import CallMetrics
+from chat.views import instrumental_image_messages
+
+from .test_gateway import completion
+from .test_streaming import parse_events
+from .utils import ChatTransactionTestCase, image_bytes, image_upload
+
+
+URL = "/api/chat/analyze-instrumental-images/"
+
+
+# One worker: the in-memory test database locks whole tables against
+# concurrent writers (image cache rows), unlike a real database
+@override_settings(AI_BATCH_MAX_WORKERS=1)
+class InstrumentalSeriesTests(ChatTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, images, **data):
+        response = self.client.post(URL, {"images": images, "language": "ru", **data}, format="multipart")
+        return parse_events(b"".join(response.streaming_content).decode())
+
+    def test_each_image_gets_an_event_then_summary_and_done(self):
+        images = [image_upload(f"slice{i}.png", color=(i * 40, 10, 10)) for i in range(3)]
+        replies = iter(["Срез 1", "Срез 2", "Срез 3", "Заключение по серии"])
+        with mock.patch("chat.views.call_openai_api", side_effect=lambda *a, **k: next(replies)) as call:
+            events = self.post(images, aggregate="1")
+
+        self.assertEqual(events[0], ("start", {"count": 3}))
+        image_events = [data for name, data in events if name == "image"]
+        self.assertEqual(sorted(e["index"] for e in image_events), [0, 1, 2])
+        self.assertTrue(all(e["status"] == "success" for e in image_events))
+        self.assertEqual(events[-2][0], "summary")
+        self.assertEqual(events[-1], ("done", {"succeeded": 3, "failed": 0}))
+        # Every call is made on behalf of the user (slots, budgets)
+        self.assertEqual({c.kwargs["user_id"] for c in call.call_args_list}, {self.user.id})
+
+    def test_cached_images_are_not_sent_again(self):
+        cached = image_bytes(color=(1, 2, 3))
+        image_cache.store(image_cache.make_key(cached, instrumental_image_messages("ru"), "gpt-4o", "ru"), "Из кэша")
+
+        with mock.patch("chat.views.call_openai_api", return_value="Новый ответ") as call:
+            events = self.post([image_upload(color=(1, 2, 3)), image_upload(color=(9, 9, 9))])
+
+        results = {data["index"]: data for name, data in events if name == "image"}
+        self.assertEqual((results[0]["analysis"], results[0]["cached"]), ("Из кэша", True))
+        self.assertEqual((results[1]["analysis"], results[1]["cached"]), ("Новый ответ", False))
+        call.assert_called_once()
+
+    def test_failed_image_does_not_stop_the_series(self):
+        def reply(messages, *args, **kwargs):
+            raise RuntimeError("vision timeout")
+
+        with mock.patch("chat.views.call_openai_api", side_effect=reply):
+            events = self.post([image_upload()])
+
+        self.assertEqual(events[1][1]["status"], "error")
+        self.assertEqual(events[1][1]["error"], "vision timeout")
+        self.assertEqual(events[-1], ("done", {"succeeded": 0, "failed": 1}))
+
+    @override_settings(AI_BATCH_MAX_IMAGES=2)
+    def test_too_many_images_are_rejected(self):
+        response = self.client.post(URL, {"images": [image_upload() for _ in range(3)]}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    AI_BUDGETS_ENABLED=False,
+    AI_MAX_CONCURRENCY=8,
+    AI_MAX_CONCURRENCY_PER_USER=2,
+    AI_BATCH_MAX_WORKERS=10,
+    AI_QUEUE_TIMEOUT=5,
+)
+class SeriesConcurrencyTests(ChatTransactionTestCase):
+    DELAY = 0.3
+
+    def setUp(self):
+        super().setUp()
+        ai_gateway._gateway = None
+        self.addCleanup(setattr, ai_gateway, "_gateway", None)
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # A slow provider; no rows are written from the worker threads (table locks, see above)
+        self.enterContext(mock.patch.object(ai_gateway.AIGateway, "_create", self.slow_create))
+        self.enterContext(mock.patch.object(CallMetrics, "save"))
+        self.enterContext(mock.patch.object(image_cache, "store"))
+
+    def slow_create(self, metrics=None, **params):
+        time.sleep(self.DELAY)
+        return completion("Без патологии")
+
+    def post_one(self):
+        response = self.client.post(URL, {"images": [image_upload()], "language": "ru"}, format="multipart")
+        return parse_events(b"".join(response.streaming_content).decode())
+
+    def test_images_run_past_the_per_user_limit(self):
+        images = [image_upload(f"slice{i}.png", color=(i * 30, 10, 10)) for i in range(6)]
+
+        started = time.monotonic()
+        response = self.client.post(URL, {"images": images, "language": "ru"}, format="multipart")
+        events = parse_events(b"".join(response.streaming_content).decode())
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(events[-1], ("done", {"succeeded": 6, "failed": 0}))
+        # Two at a time (the per-user limit) would take three rounds
+        self.assertLess(elapsed, 2 * self.DELAY)
+
+    def test_series_holds_one_of_the_users_slots(self):
+        gateway = ai_gateway.get_gateway()
+        with gateway.user_slot(self.user.id):
+            events = self.post_one()
+        self.assertEqual(events[-1], ("done", {"succeeded": 1, "failed": 0}))
+
+        with override_settings(AI_QUEUE_TIMEOUT=0.05):
+            ai_gateway._gateway = None
+            gateway = ai_gateway.get_gateway()
+            with gateway.user_slot(self.user.id), gateway.user_slot(self.user.id):
+                events = self.post_one()
+        self.assertEqual(events[-2][0], "error")
+        self.assertEqual(events[-1], ("done", {"succeeded": 0, "failed": 1}))
@@ -0,0 +1,191 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import ai_gateway, budgets
+from chat.ai_gateway import AIBudgetExceeded
+from chat.budgets import MemoryCounters
+from chat.models import ChatSession, Message
+from chat.telemetry import call_context
+
+from .test_streaming import parse_events
+from .utils import ChatTestCase, ChatTransactionTestCase, image_upload
+
+
+LIMITS = {
+    "user": {"tokens_per_minute": 6000, "burst": 6000, "daily_tokens": 10000},
+    "hospital": {"tokens_per_minute": 0, "burst": 0, "daily_tokens": 0},
+}
+
+
+class MemoryCountersTests(SimpleTestCase):
+    def test_bucket_refuses_until_refilled(self):
+        counters = MemoryCounters()
+        self.assertTrue(counters.reserve("b", "d", 100, 10, 0, 80, 0)[0])
+
+        allowed, level, used, wait = counters.reserve("b", "d", 100, 10, 0, 80, 0)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 6)  # 60 more tokens at 10 per second
+        self.assertTrue(counters.reserve("b", "d", 100, 10, 6, 80, 0)[0])
+
+    def test_daily_quota_refusal_has_no_wait(self):
+        counters = MemoryCounters()
+        counters.reserve("b", "d", 0, 1, 0, 90, 100)
+        self.assertEqual(counters.reserve("b", "d", 0, 1, 0, 20, 100), (False, 0, 90, -1))
+
+    def test_adjust_gives_back_unused_tokens(self):
+        counters = MemoryCounters()
+        counters.reserve("b", "d", 100, 10, 0, 80, 100)
+        counters.adjust("b", "d", 100, 50)
+        self.assertEqual(counters.days["d"], 30)
+        self.assertEqual(counters.buckets["b"][0], 70)
+
+
+class RedisCountersTests(SimpleTestCase):
+    def test_settle_is_one_script_call(self):
+        # No connection is made until a command runs
+        counters = budgets.RedisCounters("redis://localhost:6379/0")
+        counters.client = mock.Mock()
+        counters.settle_script = mock.Mock()
+
+        counters.adjust("b", "d", 100, 12.0)
+
+        counters.settle_script.assert_called_once_with(keys=["b", "d"], args=[100, 12])
+        # Plain HINCRBYFLOAT / DECRBY would recreate expired keys without a TTL
+        self.assertEqual(counters.client.method_calls, [])
+
+
+class HospitalLookupTests(ChatTestCase):
+    def test_lookup_is_cached_including_misses(self):
+        user = User.objects.create(username="doc", email="doc@example.com")
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(budgets.hospital_for_user(user.id))
+            self.assertIsNone(budgets.hospital_for_user(user.id))
+
+
+class MemoryBudgetMixin:
+    """Budgets on the memory backend, counters fresh for every test"""
+
+    def setUp(self):
+        super().setUp()
+        self.settings_override = override_settings(
+            AI_BUDGETS_ENABLED=True, AI_BUDGET_BACKEND="memory", AI_BUDGETS=LIMITS
+        )
+        self.settings_override.enable()
+        budgets._counters = None
+        cache.clear()
+        # reserve() annotates the telemetry context; keep that inside the test
+        self.enterContext(call_context())
+
+    def tearDown(self):
+        budgets._counters = None
+        self.settings_override.disable()
+        super().tearDown()
+
+
+@mock.patch("chat.budgets.hospital_for_user", return_value=None)
+class ReserveTests(MemoryBudgetMixin, SimpleTestCase):
+    def test_rate_limit_refuses_with_retry_after(self, hospital):
+        budgets.reserve(1, 5000)
+        with self.assertRaises(AIBudgetExceeded) as refused:
+            budgets.reserve(1, 5000)
+        self.assertEqual((refused.exception.scope, refused.exception.limit), ("user", "rate"))
+        self.assertEqual(refused.exception.retry_after, 40)
+        # Other users have their own budget
+        budgets.reserve(2, 5000)
+
+    def test_daily_quota_refuses_until_midnight(self, hospital):
+        with self.assertRaises(AIBudgetExceeded) as refused:
+            budgets.reserve(1, 10001)
+        self.assertEqual(refused.exception.limit, "daily")
+        self.assertLessEqual(refused.exception.retry_after, 24 * 3600 + 1)
+
+    def test_settle_returns_what_was_not_used(self, hospital):
+        budgets.reserve(1, 5000).settle(1000)
+        budgets.reserve(1, 5000)
+
+    def test_hospital_scope_is_shared_by_its_doctors(self, hospital):
+        hospital.return_value = 7
+        limits = dict(LIMITS, hospital={"tokens_per_minute": 0, "burst": 0, "daily_tokens": 8000})
+        with override_settings(AI_BUDGETS=limits):
+            budgets.reserve(1, 5000)
+            with self.assertRaises(AIBudgetExceeded) as refused:
+                budgets.reserve(2, 5000)
+        self.assertEqual(refused.exception.scope, "hospital")
+        # The user's reservation was given back
+        user_days = [used for key, used in budgets.get_counters().days.items() if ":user:2:" in key]
+        self.assertEqual(user_days, [0])
+
+    def test_calls_without_a_user_are_not_budgeted(self, hospital):
+        self.assertEqual(budgets.reserve(None, 10 ** 9).entries, [])
+
+
+@mock.patch("chat.budgets.hospital_for_user", return_value=None)
+@override_settings(AI_FAKE_MODE=True, AI_FAKE_OPENAI={"latency": 0, "token_delay": 0, "reply": "Ответ"})
+class BudgetedViewTests(MemoryBudgetMixin, ChatTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        ai_gateway._gateway = None
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Консультация")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        ai_gateway._gateway = None
+        super().tearDown()
+
+    def use_up_budget(self):
+        budgets.reserve(self.user.id, 10000)
+
+    def test_successful_call_reports_remaining_budget(self, hospital):
+        response = self.client.post(f"/api/chat/gpt/chats/{self.session.id}/send_message/", {"content": "Вопрос"})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(int(response["X-AI-Budget-Remaining-Daily"]), 10000)
+
+    def test_refused_message_gets_429_without_a_fallback_reply(self, hospital):
+        self.use_up_budget()
+        response = self.client.post(f"/api/chat/gpt/chats/{self.session.id}/send_message/", {"content": "Вопрос"})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["scope"], "user")
+        self.assertTrue(response.has_header("Retry-After"))
+        self.assertFalse(Message.objects.filter(role="assistant").exists())
+
+    def test_refused_stream_gets_429_before_streaming(self, hospital):
+        self.use_up_budget()
+        response = self.client.post(f"/api/chat/gpt/chats/{self.session.id}/send_message_stream/", {"content": "Вопрос"})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.streaming)
+        self.assertFalse(Message.objects.filter(role="assistant").exists())
+
+    def test_refused_image_gets_429_without_a_fallback_reply(self, hospital):
+        self.use_up_budget()
+        for action in ("send_image", "send_image_radiolog", "send_combined_image_and_text"):
+            response = self.client.post(
+                f"/api/chat/gpt/chats/{self.session.id}/{action}/", {"image": image_upload()}, format="multipart"
+            )
+            self.assertEqual(response.status_code, 429, action)
+        self.assertFalse(Message.objects.filter(role="assistant").exists())
+
+    @override_settings(AI_MAX_CONCURRENCY_PER_USER=1)
+    def test_batch_is_refused_once_the_budget_is_used_up(self, hospital):
+        self.use_up_budget()
+        with mock.patch.object(ai_gateway.AIGateway, "_create") as create:
+            response = self.client.post(
+                "/api/chat/analyze-instrumental-images/",
+                {"images": [image_upload(color=(i, 0, 0)) for i in range(2)]},
+                format="multipart",
+            )
+            events = parse_events(b"".join(response.streaming_content).decode())
+
+        create.assert_not_called()
+        images = [data for name, data in events if name == "image"]
+        self.assertEqual(len(images), 2)
+        self.assertTrue(all("budget exceeded" in data["error"] for data in images))
+        self.assertEqual(events[-1], ("done", {"succeeded": 0, "failed": 2}))
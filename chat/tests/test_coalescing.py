@@ -0,0 +1,145 @@
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import coalescing
+from chat.coalescing import check_shared_cache
+
+from .utils import ChatTestCase, ClearCachesMixin, image_upload
+
+
+URL = "/api/chat/analyze-instrumental-image/"
+
+
+class CoalescingTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, color=(200, 30, 30), **headers):
+        return self.client.post(
+            URL, {"image": image_upload(color=color), "language": "ru"}, format="multipart", headers=headers
+        )
+
+    def test_repeat_after_the_first_finished_runs_again(self):
+        with mock.patch("chat.views.call_openai_api", side_effect=["Норма", "Норма, без динамики"]) as call:
+            self.post()
+            with mock.patch("chat.image_cache.get", return_value=None):
+                second = self.post()
+
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(second.data["analysis"], "Норма, без динамики")
+        self.assertFalse(second.has_header("X-Coalesced"))
+
+    @override_settings(AI_COALESCE_WAIT=5)
+    def test_duplicate_of_a_request_in_flight_elsewhere_replays_it(self):
+        # Another worker holds the in-flight lock and publishes its result a bit later
+        self.enterContext(mock.patch.object(coalescing, "request_fingerprint", return_value="fp"))
+        cache.set("ai-coalesce-inflight-fp", True)
+        snapshot = {"status": 200, "data": {"analysis": "Норма", "status": "success"}}
+        timer = threading.Timer(0.1, cache.set, ("ai-coalesce-result-fp", snapshot))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        with mock.patch("chat.views.call_openai_api") as call:
+            response = self.post()
+
+        call.assert_not_called()
+        self.assertEqual(response.data, snapshot["data"])
+        self.assertEqual(response["X-Coalesced"], "true")
+
+    def test_stale_result_is_not_replayed(self):
+        self.enterContext(mock.patch.object(coalescing, "request_fingerprint", return_value="fp"))
+        cache.set("ai-coalesce-result-fp", {"status": 200, "data": {"analysis": "Старый ответ"}})
+
+        with mock.patch("chat.views.call_openai_api", return_value="Норма"):
+            response = self.post()
+
+        self.assertEqual(response.data["analysis"], "Норма")
+
+    def test_different_payloads_are_not_coalesced(self):
+        with mock.patch("chat.views.call_openai_api", return_value="Норма") as call:
+            self.post()
+            self.post(color=(0, 0, 0))
+        self.assertEqual(call.call_count, 2)
+
+    def test_server_errors_are_not_replayed(self):
+        with mock.patch("chat.views.call_openai_api", side_effect=RuntimeError("down")):
+            self.assertEqual(self.post().status_code, 500)
+        with mock.patch("chat.views.call_openai_api", return_value="Норма"):
+            response = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("X-Coalesced"))
+
+    def test_idempotency_key_replays_a_finished_request(self):
+        with mock.patch("chat.views.call_openai_api", return_value="Норма") as call:
+            first = self.post(**{"Idempotency-Key": "retry-1"})
+            with mock.patch("chat.image_cache.get", return_value=None):
+                second = self.post(**{"Idempotency-Key": "retry-1"})
+
+        call.assert_called_once()
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+
+    def test_idempotency_key_reused_for_another_request(self):
+        with mock.patch("chat.views.call_openai_api", return_value="Норма"):
+            self.post(**{"Idempotency-Key": "retry-1"})
+            response = self.post(color=(0, 0, 0), **{"Idempotency-Key": "retry-1"})
+        self.assertEqual(response.status_code, 422)
+
+    @override_settings(AI_COALESCE_ENABLED=False)
+    def test_can_be_switched_off(self):
+        with mock.patch("chat.views.call_openai_api", return_value="Норма"):
+            self.post()
+            with mock.patch("chat.image_cache.get", return_value=None):
+                response = self.post()
+        self.assertFalse(response.has_header("X-Coalesced"))
+
+
+class SingleFlightTests(ClearCachesMixin, SimpleTestCase):
+    def test_concurrent_duplicates_share_one_run(self):
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def run():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return Response({"reply": "Норма"})
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalescing._run_once("fp", run)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        call = coalescing._calls["fp"]
+        waiting = threading.Event()
+        wait = call.done.wait
+        call.done.wait = lambda timeout: (waiting.set(), wait(timeout))[1]
+
+        follower = threading.Thread(target=lambda: results.append(coalescing._run_once("fp", run)))
+        follower.start()
+        self.assertTrue(waiting.wait(5))
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(response is None for response, _ in results), [False, True])
+        self.assertEqual({snapshot["data"]["reply"] for _, snapshot in results}, {"Норма"})
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_warns_about_a_process_local_cache(self):
+        self.assertEqual([w.id for w in check_shared_cache()], ["chat.W001"])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache"}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_shared_cache(), [])
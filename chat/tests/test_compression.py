@@ -0,0 +1,102 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+
+from accounts.models import User
+from chat.models import ChatSession, Message
+from healthcare_api import compression
+
+from .utils import ChatTestCase
+
+
+ANSWER = "\n".join(
+    f"## Дифференциальный диагноз {i}\n- **Пневмония**: CURB-65, рентген грудной клетки\n- Рекомендации: контроль через 48 часов"
+    for i in range(40)
+)
+
+
+class CompressTests(SimpleTestCase):
+    def test_round_trip_with_and_without_dictionary(self):
+        for dictionary_id in (0, 1):
+            stored = compression.compress(ANSWER, dictionary_id=dictionary_id)
+            self.assertEqual(stored[:2], bytes([compression.DEFLATE, dictionary_id]))
+            self.assertLess(len(stored), len(ANSWER.encode("utf-8")) // 4)
+            self.assertEqual(compression.decompress(stored), ANSWER)
+
+    def test_short_text_is_stored_plain(self):
+        stored = compression.compress("Да")
+        self.assertEqual(stored, bytes([compression.PLAIN]) + "Да".encode("utf-8"))
+        self.assertEqual(compression.decompress(stored), "Да")
+
+    def test_legacy_and_empty_values(self):
+        self.assertIsNone(compression.compress(None))
+        self.assertIsNone(compression.decompress(None))
+        self.assertEqual(compression.decompress("old plain row"), "old plain row")
+        self.assertEqual(compression.decompress(b""), "")
+        self.assertEqual(compression.decompress(memoryview(compression.compress(ANSWER))), ANSWER)
+
+    def test_unknown_format_and_dictionary(self):
+        with self.assertRaises(ValueError):
+            compression.decompress(b"\x07abc")
+        with self.assertRaises(ValueError):
+            compression.compress(ANSWER, dictionary_id=250)
+
+    def test_trained_dictionary_prefers_shared_lines(self):
+        samples = [f"## Жалобы\nКашель {i} дней\n## Рекомендации\nОбильное питьё" for i in range(5)]
+        dictionary = compression.train_dictionary(samples, size=64).decode("utf-8")
+
+        self.assertIn("## Рекомендации", dictionary)
+        self.assertNotIn("Кашель", dictionary)
+        self.assertLessEqual(len(dictionary.encode("utf-8")), 64)
+
+
+class CompressedTextFieldTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=user, title="Пневмония")
+
+    def stored(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content FROM chat_message WHERE id = %s", [message.id])
+            return bytes(cursor.fetchone()[0])
+
+    def test_content_is_stored_compressed_and_read_back(self):
+        message = Message.objects.create(session=self.session, role="assistant", content=ANSWER)
+
+        self.assertEqual(self.stored(message)[0], compression.DEFLATE)
+        self.assertEqual(Message.objects.get(id=message.id).content, ANSWER)
+
+    def test_decompresses_lazily_and_once(self):
+        message_id = Message.objects.create(session=self.session, role="assistant", content=ANSWER).id
+        message = Message.objects.get(id=message_id)
+        self.assertIsInstance(message.__dict__["content"], bytes)
+
+        with mock.patch("healthcare_api.compression.decompress", wraps=compression.decompress) as decompress:
+            self.assertEqual(message.content, ANSWER)
+            self.assertEqual(message.content, ANSWER)
+        self.assertEqual(decompress.call_count, 1)
+
+    def test_untouched_content_is_written_back_unchanged(self):
+        message_id = Message.objects.create(session=self.session, role="assistant", content=ANSWER).id
+        before = self.stored(Message.objects.get(id=message_id))
+
+        message = Message.objects.get(id=message_id)
+        message.model_used = "gpt-4o"
+        # A different level would change the bytes if the text were recompressed
+        with override_settings(COMPRESSED_TEXT_LEVEL=1):
+            message.save()
+
+        self.assertEqual(self.stored(message), before)
+
+    def test_assigned_content_replaces_cached_text(self):
+        message = Message.objects.create(session=self.session, role="assistant", content=ANSWER)
+        message = Message.objects.get(id=message.id)
+        self.assertEqual(message.content, ANSWER)
+
+        message.content = "Исправленный ответ"
+        message.save()
+
+        self.assertEqual(message.content, "Исправленный ответ")
+        self.assertEqual(Message.objects.get(id=message.id).content, "Исправленный ответ")
@@ -0,0 +1,97 @@
+import unittest
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from chat import messaging
+from chat.models import Chat
+
+from .utils import ChatTransactionTestCase, DoctorPatientChatMixin
+
+try:
+    from channels.routing import URLRouter
+    from channels.testing import WebsocketCommunicator
+
+    from chat.consumers import CLOSE_FORBIDDEN
+    from chat.routing import websocket_urlpatterns
+    from healthcare_api.ws_auth import JWTAuthMiddleware
+except ImportError:  # channels is only needed for the WebSocket endpoint
+    WebsocketCommunicator = None
+
+
+def token(user):
+    return str(AccessToken.for_user(user))
+
+
+@unittest.skipIf(WebsocketCommunicator is None, "channels is not installed")
+class JWTAuthMiddlewareTests(ChatTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+
+    async def scope_user(self, query_string):
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen["user"] = scope["user"]
+
+        await JWTAuthMiddleware(app)({"type": "websocket", "query_string": query_string}, None, None)
+        return seen["user"]
+
+    async def test_token_in_the_query_string_authenticates(self):
+        user = await self.scope_user(f"token={token(self.user)}".encode())
+        self.assertEqual(user.id, self.user.id)
+
+    async def test_missing_or_bad_token_is_anonymous(self):
+        for query_string in (b"", b"token=garbage"):
+            with self.subTest(query_string=query_string):
+                self.assertIsInstance(await self.scope_user(query_string), AnonymousUser)
+
+
+@unittest.skipIf(WebsocketCommunicator is None, "channels is not installed")
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChatConsumerTests(DoctorPatientChatMixin, ChatTransactionTestCase):
+    def connect(self, user):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        query = f"?token={token(user)}" if user else ""
+        return WebsocketCommunicator(application, f"/ws/chat/{self.chat.id}/{query}")
+
+    async def test_participants_see_each_others_typing(self):
+        doctor, patient = self.connect(self.doctor_user), self.connect(self.patient_user)
+        self.assertTrue((await doctor.connect())[0])
+        self.assertTrue((await patient.connect())[0])
+
+        await patient.send_json_to({"type": "typing", "is_typing": True})
+
+        event = await doctor.receive_json_from()
+        self.assertEqual(event["type"], "typing")
+        self.assertEqual(event["data"]["sender_type"], "patient")
+        # Not echoed to the sender
+        self.assertTrue(await patient.receive_nothing())
+        await doctor.disconnect()
+        await patient.disconnect()
+
+    async def test_ping_and_read(self):
+        await sync_to_async(messaging.send)(self.chat, self.patient_user, "patient", content="Вопрос")
+        doctor = self.connect(self.doctor_user)
+        await doctor.connect()
+
+        await doctor.send_json_to({"type": "ping"})
+        self.assertEqual(await doctor.receive_json_from(), {"type": "pong"})
+        await doctor.send_json_to({"type": "read"})
+        await doctor.receive_nothing()
+
+        chat = await sync_to_async(Chat.objects.get)(id=self.chat.id)
+        self.assertEqual(chat.unread_for_doctor, 0)
+        await doctor.disconnect()
+
+    async def test_outsiders_and_anonymous_users_are_refused(self):
+        outsider = await sync_to_async(User.objects.create)(username="x", email="x@example.com")
+        for user in (outsider, None):
+            with self.subTest(user=user):
+                connected, code = await self.connect(user).connect()
+                self.assertFalse(connected)
+                self.assertEqual(code, CLOSE_FORBIDDEN)
@@ -0,0 +1,98 @@
+from django.test import SimpleTestCase, override_settings
+
+from accounts.models import User
+from chat.context import (
+    MESSAGE_OVERHEAD_TOKENS,
+    SUMMARY_PREFIX,
+    build_session_context,
+    context_budget,
+    count_tokens,
+    fit_messages,
+)
+from chat.models import ChatSession, Message
+
+from .utils import ChatTestCase
+
+
+# 100 tokens of history once 3000 are reserved for the reply and the safety margin
+SMALL_BUDGET = {"AI_CONTEXT_BUDGETS": {"gpt-4o": 356}}
+
+
+class TokenCountTests(SimpleTestCase):
+    def test_empty_text_has_no_tokens(self):
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens(None), 0)
+
+    def test_longer_text_has_more_tokens(self):
+        self.assertLess(count_tokens("Давление 120/80"), count_tokens("Давление 120/80. " * 20))
+
+    @override_settings(**SMALL_BUDGET)
+    def test_budget_leaves_room_for_the_reply(self):
+        self.assertEqual(context_budget("gpt-4o", 3000), 100)
+        self.assertEqual(context_budget("gpt-4o-mini", 3000), 128000 - 3000 - 256)
+
+
+@override_settings(**SMALL_BUDGET)
+class FitMessagesTests(SimpleTestCase):
+    def test_keeps_system_prompt_and_newest_messages(self):
+        messages = [{"role": "system", "content": "Ты медицинский ассистент."}]
+        messages += [{"role": "user", "content": f"Вопрос {i}: " + "симптомы " * 15} for i in range(10)]
+
+        fitted = fit_messages(messages)
+
+        self.assertEqual(fitted[0], messages[0])
+        self.assertLess(len(fitted), len(messages))
+        self.assertEqual(fitted[-1], messages[-1])
+        self.assertEqual(fitted[1:], messages[len(messages) - len(fitted) + 1:])
+
+    def test_current_question_is_never_dropped(self):
+        question = {"role": "user", "content": "очень длинный вопрос " * 200}
+        fitted = fit_messages([{"role": "system", "content": "Ассистент"}, question])
+        self.assertEqual(fitted[-1], question)
+
+
+@override_settings(**SMALL_BUDGET)
+class SessionContextTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=user, title="Консультация")
+
+    def add(self, content, role="user", token_count=20):
+        return Message.objects.create(session=self.session, role=role, content=content, token_count=token_count)
+
+    def test_reads_newest_history_until_budget_is_full(self):
+        for i in range(10):
+            self.add(f"сообщение {i}")
+
+        context = build_session_context(self.session, "Системный промпт", system_tokens=10)
+
+        # 100 - (10 + overhead) leaves room for 3 messages of 20 + overhead tokens
+        per_message = 20 + MESSAGE_OVERHEAD_TOKENS
+        kept = (100 - 10 - MESSAGE_OVERHEAD_TOKENS) // per_message
+        self.assertEqual(context[0], {"role": "system", "content": "Системный промпт"})
+        self.assertEqual(
+            [m["content"] for m in context[1:]],
+            [f"сообщение {i}" for i in range(10 - kept, 10)],
+        )
+
+    def test_backfills_missing_token_counts(self):
+        message = self.add("старое сообщение")
+        Message.objects.filter(id=message.id).update(token_count=None)
+
+        build_session_context(self.session, "Системный промпт")
+
+        message.refresh_from_db()
+        self.assertEqual(message.token_count, count_tokens("старое сообщение"))
+
+    def test_summary_replaces_folded_messages(self):
+        old = [self.add(f"старое {i}") for i in range(3)]
+        self.add("новое")
+        self.session.summary = "Пациент с гипертонией."
+        self.session.summary_upto = old[-1]
+        self.session.save(update_fields=["summary", "summary_upto"])
+
+        context = build_session_context(self.session, "Системный промпт", system_tokens=10)
+
+        self.assertEqual(context[1], {"role": "system", "content": SUMMARY_PREFIX + "Пациент с гипертонией."})
+        self.assertEqual([m["content"] for m in context[2:]], ["новое"])
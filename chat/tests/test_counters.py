@@ -0,0 +1,104 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import messaging, realtime
+from chat.models import Chat, Message1
+from patients.models import Patient
+
+from .utils import ChatTestCase, DoctorPatientChatMixin
+
+
+class ChatCounterTests(DoctorPatientChatMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor_user)
+
+    def reload(self):
+        return Chat.objects.get(id=self.chat.id)
+
+    def other_chat(self, n):
+        user = User.objects.create(username=f"patient{n}", email=f"patient{n}@example.com")
+        patient = Patient.objects.create(user=user, patient_id=f"P-{n + 100}")
+        chat = Chat.objects.create(doctor=self.doctor, patient=patient)
+        messaging.send(chat, user, "patient", content=f"Здравствуйте, {n}")
+        return chat
+
+    def test_send_counts_for_the_recipient_and_moves_last_message(self):
+        messaging.send(self.chat, self.patient_user, "patient", content="Первый")
+        last = messaging.send(self.chat, self.patient_user, "patient", content="Второй")
+
+        chat = self.reload()
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient), (2, 0))
+        self.assertEqual(chat.last_message_id, last.id)
+        self.assertEqual(chat.updated_at, last.created_at)
+
+        reply = messaging.send(self.chat, self.doctor_user, "doctor", content="Ответ")
+        chat = self.reload()
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient), (2, 1))
+        self.assertEqual(chat.last_message_id, reply.id)
+
+    def test_mark_read_clears_only_the_reader(self):
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        messaging.send(self.chat, self.doctor_user, "doctor", content="Ответ")
+
+        self.assertEqual(self.client.post(f"/api/chat/{self.chat.id}/read/").status_code, 200)
+
+        chat = self.reload()
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient), (0, 1))
+
+    def test_inbox_shows_the_counters(self):
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос о дозировке")
+
+        [entry] = self.client.get("/api/chat/").data["results"]
+
+        self.assertEqual(entry["unread_count"], 1)
+        self.assertEqual(entry["last_message"]["content"], "Вопрос о дозировке")
+        self.assertFalse(entry["last_message"]["is_read"])
+
+    def test_inbox_query_count_does_not_grow_with_chats(self):
+        def inbox_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get("/api/chat/").status_code, 200)
+            return len(queries)
+
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        baseline = inbox_queries()
+        for n in range(5):
+            self.other_chat(n)
+
+        self.assertEqual(inbox_queries(), baseline)
+
+    def test_repair_recomputes_from_messages_and_watermarks(self):
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        last = messaging.send(self.chat, self.patient_user, "patient", content="Ещё вопрос")
+        realtime.mark_read(self.chat, "patient", self.patient_user.id)
+        Chat.objects.filter(id=self.chat.id).update(unread_for_doctor=40, unread_for_patient=7, last_message=None)
+        other = self.other_chat(1)
+        Chat.objects.filter(id=other.id).update(unread_for_doctor=0)
+
+        out = StringIO()
+        call_command("repair_chat_counters", self.chat.id, stdout=out)
+
+        chat = self.reload()
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient), (2, 0))
+        self.assertEqual(chat.last_message_id, last.id)
+        self.assertEqual(Chat.objects.get(id=other.id).unread_for_doctor, 0)
+        self.assertIn("Repaired 1 chats", out.getvalue())
+
+        call_command("repair_chat_counters", stdout=StringIO())
+        self.assertEqual(Chat.objects.get(id=other.id).unread_for_doctor, 1)
+
+    def test_editing_a_message_does_not_count_it_again(self):
+        message = messaging.send(self.chat, self.patient_user, "patient", content="Опечатка")
+
+        message.content = "Исправлено"
+        message.save()
+
+        self.assertEqual(self.reload().unread_for_doctor, 1)
+        self.assertEqual(Message1.objects.get(id=message.id).content, "Исправлено")
@@ -0,0 +1,48 @@
+import json
+
+import openai
+from django.test import override_settings
+
+from chat.ai_gateway import AIGateway
+from chat.fake_openai import FakeChatCompletions
+from chat.models import AICall
+
+from .utils import ChatTestCase
+
+
+FAST = {"latency": 0, "token_delay": 0}
+
+
+@override_settings(AI_FAKE_MODE=True, AI_FAKE_OPENAI=FAST, AI_MAX_RETRIES=0, AI_BACKOFF_BASE=0)
+class FakeOpenAITests(ChatTestCase):
+    messages = [{"role": "user", "content": "Боль в груди при нагрузке"}]
+
+    def test_canned_reply_through_the_gateway(self):
+        with override_settings(AI_FAKE_OPENAI=dict(FAST, reply="Нужна ЭКГ")):
+            reply = AIGateway().complete(self.messages, max_tokens=100)
+
+        self.assertEqual(reply, "Нужна ЭКГ")
+        call = AICall.objects.get()
+        self.assertGreater(call.prompt_tokens, 0)
+        self.assertGreater(call.completion_tokens, 0)
+
+    def test_stream_yields_words_and_usage(self):
+        deltas = list(AIGateway().stream(self.messages, max_tokens=30))
+
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(AICall.objects.get().outcome, "ok")
+        self.assertTrue(AICall.objects.get().streamed)
+
+    def test_reply_is_capped_by_max_tokens(self):
+        fake = FakeChatCompletions(min_completion_tokens=50, **FAST)
+        status, headers, chunks = fake.handle({"messages": self.messages, "max_tokens": 10})
+
+        self.assertEqual(status, 200)
+        reply = json.loads(b"".join(chunks))["choices"][0]["message"]["content"]
+        self.assertEqual(len(reply.split()), 10)
+
+    def test_injected_errors_reach_the_caller(self):
+        with override_settings(AI_FAKE_OPENAI=dict(FAST, error_rate=1.0, error_status=429)):
+            with self.assertRaises(openai.RateLimitError):
+                AIGateway().complete(self.messages)
+        self.assertEqual(AICall.objects.get().outcome, "rate_limited")
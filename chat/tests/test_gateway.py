@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from chat.ai_gateway import AIBusyError, AIGateway, AIUnavailableError, CircuitBreaker, httpx
+from chat.models import AICall
+
+from .utils import ChatTestCase
+
+
+def api_error(error_class, status_code):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return error_class("upstream said no", response=httpx.Response(status_code, request=request), body=None)
+
+
+def completion(text):
+    return SimpleNamespace(
+        usage=SimpleNamespace(prompt_tokens=12, completion_tokens=3),
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+    )
+
+
+@override_settings(
+    AI_MAX_RETRIES=2,
+    AI_BACKOFF_BASE=0,
+    AI_QUEUE_TIMEOUT=0.1,
+    AI_CIRCUIT_FAILURE_THRESHOLD=2,
+    AI_MAX_CONCURRENCY_PER_USER=1,
+)
+class GatewayTests(ChatTestCase):
+    messages = [{"role": "user", "content": "Привет"}]
+
+    def setUp(self):
+        super().setUp()
+        self.gateway = AIGateway()
+        self.create = mock.Mock()
+        self.gateway._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+    def test_retries_server_errors_then_succeeds(self):
+        self.create.side_effect = [api_error(openai.InternalServerError, 500), completion("Здравствуйте")]
+
+        self.assertEqual(self.gateway.complete(self.messages), "Здравствуйте")
+
+        self.assertEqual(self.create.call_count, 2)
+        call = AICall.objects.get()
+        self.assertEqual((call.outcome, call.retries, call.prompt_tokens), ("ok", 1, 12))
+        self.assertEqual(self.gateway.breaker.state, "closed")
+
+    def test_client_errors_are_not_retried(self):
+        self.create.side_effect = api_error(openai.BadRequestError, 400)
+
+        with self.assertRaises(openai.BadRequestError):
+            self.gateway.complete(self.messages)
+        self.assertEqual(self.create.call_count, 1)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.create.side_effect = api_error(openai.InternalServerError, 503)
+
+        # The second failure opens the circuit, so the last retry is not sent
+        with self.assertRaises(AIUnavailableError):
+            self.gateway.complete(self.messages)
+        self.assertEqual(self.create.call_count, 2)
+        self.assertEqual(self.gateway.breaker.state, "open")
+
+        self.create.reset_mock()
+        with self.assertRaises(AIUnavailableError):
+            self.gateway.complete(self.messages)
+        self.create.assert_not_called()
+        self.assertEqual(AICall.objects.order_by("-id")[0].outcome, "unavailable")
+
+    def test_user_slots_are_limited_and_forgotten_when_idle(self):
+        with self.gateway.slot(user_id=7):
+            self.assertIn(7, self.gateway.user_slots)
+            with self.assertRaises(AIBusyError):
+                with self.gateway.slot(user_id=7):
+                    pass
+            # Other users are not affected
+            with self.gateway.slot(user_id=8):
+                pass
+        self.assertEqual(self.gateway.user_slots, {})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        # Pretend the reset timeout has passed
+        breaker.opened_at -= 31
+        return breaker
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = self.open_breaker()
+        self.assertEqual(breaker.state, "half-open")
+
+        breaker.before_call()
+        with self.assertRaises(AIUnavailableError):
+            breaker.before_call()
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_failed_trial_reopens(self):
+        breaker = self.open_breaker()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+    def test_client_error_on_trial_does_not_close(self):
+        breaker = self.open_breaker()
+        breaker.before_call()
+        breaker.record_client_error()
+
+        self.assertEqual(breaker.state, "half-open")
+        # The next call is the new trial
+        breaker.before_call()
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import image_cache
+from chat.models import ChatSession, ImageAnalysisCache
+
+from .utils import ChatTestCase, image_bytes, image_upload
+
+
+def vision_messages(prompt="Опишите снимок", image_url="data:image/jpeg;base64,AAAA"):
+    return [
+        {"role": "system", "content": "Ты рентгенолог."},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ],
+        },
+    ]
+
+
+class CacheKeyTests(ChatTestCase):
+    def test_key_depends_on_image_prompt_language_and_model(self):
+        image = image_bytes()
+        key = image_cache.make_key(image, vision_messages())
+
+        self.assertEqual(key, image_cache.make_key(image, vision_messages()))
+        self.assertNotEqual(key.digest, image_cache.make_key(image_bytes(color=(0, 0, 0)), vision_messages()).digest)
+        self.assertNotEqual(key.digest, image_cache.make_key(image, vision_messages("Другой вопрос")).digest)
+        self.assertNotEqual(key.digest, image_cache.make_key(image, vision_messages(), language="uz").digest)
+        self.assertNotEqual(key.digest, image_cache.make_key(image, vision_messages(), model="gpt-4o-mini").digest)
+
+    def test_key_ignores_the_encoded_image(self):
+        image = image_bytes()
+        without_image = vision_messages()
+        without_image[1]["content"].pop()
+
+        self.assertEqual(
+            image_cache.make_key(image, without_image),
+            image_cache.make_key(image, vision_messages(image_url="data:image/png;base64,BBBB")),
+        )
+
+    def test_stored_analysis_survives_the_memory_layer(self):
+        key = image_cache.make_key(image_bytes(), vision_messages())
+        self.assertIsNone(image_cache.get(key))
+
+        image_cache.store(key, "Патологии не выявлено")
+        image_cache._memory.clear()
+
+        self.assertEqual(image_cache.get(key), "Патологии не выявлено")
+        self.assertEqual(ImageAnalysisCache.objects.get(key=key.digest).hits, 1)
+
+    def test_expired_analyses_are_not_served(self):
+        key = image_cache.make_key(image_bytes(), vision_messages())
+        image_cache.store(key, "Старый ответ")
+        image_cache._memory.clear()
+        ImageAnalysisCache.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        with override_settings(AI_IMAGE_CACHE_TTL=24 * 3600):
+            self.assertIsNone(image_cache.get(key))
+            self.assertEqual(image_cache.prune(), 1)
+
+
+@override_settings(AI_COALESCE_ENABLED=False)
+class CachedImageViewTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Снимок")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_repeat_upload_skips_normalization_and_the_ai_call(self):
+        url = f"/api/chat/gpt/chats/{self.session.id}/send_image/"
+        with mock.patch("chat.views.call_openai_api", return_value="Перелома нет.") as call:
+            first = self.client.post(url, {"image": image_upload()}, format="multipart")
+            with mock.patch("chat.imaging.prepare_image_data_url") as prepare:
+                second = self.client.post(url, {"image": image_upload()}, format="multipart")
+
+        self.assertEqual(first.data["reply"], "Перелома нет.")
+        self.assertEqual(second.data["reply"], "Перелома нет.")
+        call.assert_called_once()
+        prepare.assert_not_called()
+        # The model still got the image
+        parts = call.call_args.args[0][1]["content"]
+        self.assertTrue(parts[-1]["image_url"]["url"].startswith("data:image/"))
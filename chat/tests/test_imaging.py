@@ -0,0 +1,103 @@
+import io
+import warnings
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat.imaging import RejectedImage, attach_image, is_grayscale, normalize_image
+from chat.models import ChatSession, Message
+
+from .utils import ChatTestCase, image_bytes, image_upload
+
+
+def decode(data):
+    return Image.open(io.BytesIO(data))
+
+
+@override_settings(AI_IMAGE_MAX_EDGE=512)
+class NormalizeImageTests(SimpleTestCase):
+    def test_large_images_are_downscaled_to_jpeg(self):
+        data, mime = normalize_image(image_bytes(size=(2000, 1000)))
+
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(decode(data).size, (512, 256))
+
+    def test_small_png_is_kept_when_jpeg_is_not_smaller(self):
+        original = image_bytes(size=(8, 8))
+        self.assertEqual(normalize_image(original), (original, "image/png"))
+
+    def test_gray_rgb_becomes_single_channel(self):
+        data, _ = normalize_image(image_bytes(size=(1024, 1024), color=(90, 92, 91)))
+        self.assertEqual(decode(data).mode, "L")
+        self.assertFalse(is_grayscale(Image.new("RGB", (4, 4), (200, 30, 30))))
+
+    def test_transparency_is_flattened_onto_white(self):
+        data, _ = normalize_image(image_bytes(size=(1024, 1024), color=(0, 0, 0, 0), mode="RGBA"))
+        self.assertEqual(decode(data).getextrema(), (255, 255))
+
+    def test_unreadable_files_pass_through(self):
+        self.assertEqual(normalize_image(b"%PDF-1.4"), (b"%PDF-1.4", "image/jpeg"))
+
+    def test_decompression_bombs_are_rejected(self):
+        # 1000x1000 is twice the limit: Pillow raises DecompressionBombError itself
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 250_000):
+            with self.assertRaises(RejectedImage):
+                normalize_image(image_bytes(size=(1000, 1000)))
+            # Just over the limit only warns, unless warnings are errors
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", Image.DecompressionBombWarning)
+                with self.assertRaises(RejectedImage):
+                    normalize_image(image_bytes(size=(600, 600)))
+
+    def test_16_bit_grayscale_keeps_its_tones(self):
+        # Horizontal ramp over the full 16-bit range, as in a radiograph export
+        image = Image.new("I;16", (1024, 64))
+        image.putdata([x * 64 for _ in range(64) for x in range(1024)])
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+
+        data, _ = normalize_image(buffer.getvalue())
+
+        result = decode(data)
+        self.assertEqual(result.mode, "L")
+        histogram = result.histogram()
+        pixels = sum(histogram)
+        # convert("L") alone left almost every pixel at 255
+        self.assertLess(histogram[255] / pixels, 0.05)
+        self.assertLess(histogram[0] / pixels, 0.05)
+        self.assertGreater(sum(1 for count in histogram if count), 200)
+
+    def test_attach_image_appends_a_data_url(self):
+        messages = [{"role": "user", "content": [{"type": "text", "text": "Опишите снимок"}]}]
+
+        attach_image(messages, image_bytes(size=(1024, 1024)))
+
+        self.assertTrue(messages[0]["content"][1]["image_url"]["url"].startswith("data:image/jpeg;base64,"))
+
+
+@override_settings(AI_COALESCE_ENABLED=False)
+class RejectedImageViewTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Снимок")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.enterContext(mock.patch.object(Image, "MAX_IMAGE_PIXELS", 250_000))
+
+    def test_bomb_is_a_400_without_a_call_or_fallback_reply(self):
+        urls = [
+            f"/api/chat/gpt/chats/{self.session.id}/send_image/",
+            "/api/chat/analyze-instrumental-image/",
+        ]
+        with mock.patch("chat.views.call_openai_api") as call:
+            for url in urls:
+                with self.subTest(url=url):
+                    response = self.client.post(url, {"image": image_upload(size=(1000, 1000))}, format="multipart")
+                    self.assertEqual(response.status_code, 400)
+
+        call.assert_not_called()
+        self.assertFalse(Message.objects.filter(session=self.session).exists())
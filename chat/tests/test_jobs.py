@@ -0,0 +1,73 @@
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat.models import AIJob, ChatSession, Message
+from chat.tasks import run_ai_job
+
+from .utils import ChatTestCase, image_upload
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class AIJobTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Снимок")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, reply=None, error=None):
+        url = f"/api/chat/gpt/chats/{self.session.id}/send_image/?async=1"
+        patch = mock.patch("chat.views.call_openai_api", return_value=reply, side_effect=error)
+        with patch, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"image": image_upload()}, format="multipart")
+        return response
+
+    def test_async_image_analysis_runs_as_job(self):
+        response = self.submit(reply="Перелома нет.")
+
+        self.assertEqual(response.status_code, 202)
+        job = AIJob.objects.get(id=response.data["job_id"])
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result, "Перелома нет.")
+        self.assertEqual(job.payload, {})
+        self.assertEqual(job.message.content, "Перелома нет.")
+
+        detail = self.client.get(f"/api/chat/jobs/{job.id}/")
+        self.assertEqual(detail.data["status"], "done")
+        self.assertEqual(detail.data["result"], "Перелома нет.")
+
+    def test_failed_call_marks_job_failed_with_fallback_message(self):
+        response = self.submit(error=RuntimeError("upstream down"))
+
+        job = AIJob.objects.get(id=response.data["job_id"])
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "upstream down")
+        self.assertEqual(job.message.model_used, "error")
+
+    def test_job_that_cannot_be_queued_is_marked_failed(self):
+        with mock.patch.object(run_ai_job, "delay", side_effect=OSError("broker down")):
+            response = self.submit(reply="Перелома нет.")
+
+        self.assertEqual(response.status_code, 202)
+        job = AIJob.objects.get(id=response.data["job_id"])
+        self.assertEqual(job.status, "failed")
+        self.assertIn("broker down", job.error)
+        self.assertEqual(job.payload, {})
+        self.assertEqual(job.message.model_used, "error")
+
+    def test_claimed_job_is_not_run_twice(self):
+        job = AIJob.objects.create(user=self.user, kind="chat_image", status="running")
+        with mock.patch("chat.views.call_openai_api") as call:
+            run_ai_job(str(job.id))
+        call.assert_not_called()
+        self.assertFalse(Message.objects.exists())
+
+    def test_other_users_cannot_read_a_job(self):
+        job = AIJob.objects.create(user=self.user, kind="chat_image")
+        other = APIClient()
+        other.force_authenticate(User.objects.create(username="other", email="o@example.com"))
+        self.assertEqual(other.get(f"/api/chat/jobs/{job.id}/").status_code, 404)
@@ -0,0 +1,62 @@
+from datetime import date
+
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import lab_ranges
+
+from .utils import ChatTestCase
+
+
+class ReferenceFlagTests(SimpleTestCase):
+    def evaluate(self, form, sex="f", age=40):
+        return {row["field"]: row for row in lab_ranges.evaluate(form, sex=sex, age=age)}
+
+    def test_values_outside_the_range_are_flagged(self):
+        rows = self.evaluate({"oak_hgb": "98 g/L", "oak_wbc": "6.5", "bio_alt": "25"})
+
+        self.assertEqual((rows["oak_hgb"]["flag"], rows["oak_hgb"]["z"]), ("L", -4.83))
+        self.assertEqual(rows["oak_wbc"]["flag"], "")
+        self.assertEqual((rows["bio_alt"]["low"], rows["bio_alt"]["high"]), (0.0, 33.0))
+
+    def test_range_depends_on_sex_and_age(self):
+        self.assertEqual(self.evaluate({"oak_hgb": "98"}, sex="m")["oak_hgb"]["low"], 130.0)
+        self.assertEqual(self.evaluate({"oak_hgb": "98"}, sex=None, age=4)["oak_hgb"]["low"], 110.0)
+
+    def test_units_are_converted_to_the_table(self):
+        rows = self.evaluate({"oak_hgb": "9.8 g/dL", "bio_crea": "1.2 mg/dL"})
+        self.assertEqual(rows["oak_hgb"]["value"], 98.0)
+        self.assertEqual((rows["bio_crea"]["value"], rows["bio_crea"]["flag"]), (106.08, "H"))
+
+    def test_sheet_range_wins_over_the_table(self):
+        row = self.evaluate({"oak_plt": "98 10^9/L (норма 150-400)"})["oak_plt"]
+        self.assertEqual((row["source"], row["flag"]), ("sheet", "L"))
+
+    def test_unknown_units_without_a_sheet_range_are_skipped(self):
+        self.assertEqual(self.evaluate({"bio_urea": "5 foo", "oak_hgb": "отр."}), {})
+
+    def test_sex_and_age_parsing(self):
+        self.assertEqual([lab_ranges.parse_sex(v) for v in ("Мужской", "ayol", "female", "")], ["m", "f", "f", None])
+        self.assertEqual(lab_ranges.parse_age("1980-06-15", date(2024, 6, 14)), 43)
+        self.assertEqual(lab_ranges.parse_age("15.06.1980", date(2024, 6, 15)), 44)
+        self.assertIsNone(lab_ranges.parse_age("вчера"))
+
+    def test_describe(self):
+        row = self.evaluate({"oak_hgb": "98 g/L"})["oak_hgb"]
+        self.assertEqual(lab_ranges.describe(row), "98 g/L L (норма 120-150, z=-4.8)")
+
+
+class LabFlagsViewTests(ChatTestCase):
+    def test_flags_form_values_without_the_ai(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="doc", email="doc@example.com"))
+
+        response = client.post(
+            "/api/chat/lab-flags/",
+            {"gender": "male", "birthDate": "1980-01-01", "oak_hgb": "98", "oak_wbc": "6.5"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["abnormal"], ["oak_hgb"])
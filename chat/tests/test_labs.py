@@ -0,0 +1,57 @@
+from django.test import SimpleTestCase
+
+from chat.labs import form_fields, parse_lab_text
+
+
+SHEET = """
+ОБЩИЙ АНАЛИЗ КРОВИ
+1. Гемоглобин (HGB) 135 г/л 120-160
+2. WBC 6,5 10^9/L 4.0-10.0
+3. PLT 98 L 10^9/L 150-400
+Биохимический анализ крови
+АЛТ 25 Ед/л до 41
+Билирубин прямой 3.1 мкмоль/л от 0 до 5.1
+Билирубин 14.2 мкмоль/л
+Глюкоза 5.4 ммоль/л
+Общий анализ мочи
+Цвет соломенно-желтый
+Глюкоза отр.
+Лейкоциты 1-2 в п/з
+Ферритин 40 нг/мл
+"""
+
+
+class LabSheetParserTests(SimpleTestCase):
+    def setUp(self):
+        results, self.unmatched = parse_lab_text(SHEET)
+        self.results = {result.field: result for result in results}
+
+    def test_values_units_and_references(self):
+        hgb = self.results["oak_hgb"]
+        self.assertEqual((hgb.value, hgb.unit, hgb.reference), ("135", "г/л", "120-160"))
+        self.assertEqual(self.results["oak_wbc"].value, "6.5")
+        self.assertEqual(self.results["bio_alt"].reference, "≤41")
+        self.assertEqual(self.results["bio_bild"].reference, "0-5.1")
+
+    def test_analyzer_flags_are_dropped_from_the_unit(self):
+        self.assertEqual((self.results["oak_plt"].value, self.results["oak_plt"].unit), ("98", "10^9/L"))
+
+    def test_panel_decides_ambiguous_names(self):
+        self.assertEqual(self.results["bio_glue"].value, "5.4")
+        self.assertEqual(self.results["oam_glucose"].value, "отр.")
+        self.assertEqual(self.results["bio_bilt"].value, "14.2")
+
+    def test_urine_values_are_kept_as_written(self):
+        self.assertEqual(self.results["oam_color"].value, "соломенно-желтый")
+        self.assertEqual(self.results["oam_leukocytes_microscopy"].value, "1-2 в п/з")
+
+    def test_unknown_numeric_lines_are_kept(self):
+        self.assertEqual(self.unmatched, ["Ферритин 40 нг/мл"])
+
+    def test_form_fields_carry_the_sheet_range(self):
+        fields = form_fields(self.results.values())
+        self.assertEqual(fields["oak_hgb"], "135 г/л (норма 120-160)")
+        self.assertEqual(fields["bio_glue"], "5.4 ммоль/л")
+
+    def test_empty_text(self):
+        self.assertEqual(parse_lab_text(None), ([], []))
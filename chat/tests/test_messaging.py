@@ -0,0 +1,70 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chat import messaging
+from chat.models import Chat, Message1
+
+from .utils import ChatTestCase, DoctorPatientChatMixin
+
+
+class MessagingTests(DoctorPatientChatMixin, ChatTestCase):
+    def test_send_is_two_statements(self):
+        chat = Chat.objects.select_related("doctor", "patient").get(id=self.chat.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            message = messaging.send(chat, self.patient_user, "patient", content="Здравствуйте")
+
+        statements = [q["sql"] for q in queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT"))]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith("INSERT"))
+        self.assertTrue(statements[1].startswith("UPDATE"))
+        self.assertEqual(Chat.objects.get(id=chat.id).last_message_id, message.id)
+
+    def test_send_view_does_not_look_up_profiles(self):
+        client = APIClient()
+        client.force_authenticate(self.doctor_user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(f"/api/chat/{self.chat.id}/send/", {"content": "Ответ"}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["sender_type"], "doctor")
+        # The chat comes with its doctor and patient joined; no separate profile queries
+        profile_queries = [
+            q["sql"] for q in queries if 'FROM "doctors_doctor"' in q["sql"] or 'FROM "patients_patient"' in q["sql"]
+        ]
+        self.assertEqual(profile_queries, [])
+
+    def test_send_many_is_one_insert_and_one_update(self):
+        messages = [
+            Message1(sender=self.doctor_user, sender_type="doctor", content="Напоминание"),
+            Message1(sender=self.patient_user, sender_type="patient", content="Спасибо"),
+            Message1(sender=self.patient_user, sender_type="patient", content="До встречи"),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            saved = messaging.send_many(self.chat, messages)
+
+        statements = [q["sql"] for q in queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT"))]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all(message.id for message in saved))
+        chat = Chat.objects.get(id=self.chat.id)
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient), (2, 1))
+        self.assertEqual(chat.last_message_id, saved[-1].id)
+        self.assertEqual(messaging.send_many(self.chat, []), [])
+
+    def test_unknown_sender_type_is_rejected_before_writing(self):
+        messages = [
+            Message1(sender=self.doctor_user, sender_type="doctor", content="Напоминание"),
+            Message1(sender=self.doctor_user, sender_type="system", content="Чат закрыт"),
+        ]
+
+        with self.assertRaises(ValueError):
+            messaging.send_many(self.chat, messages)
+        with self.assertRaises(ValueError):
+            messaging.send(self.chat, self.doctor_user, "", content="Без стороны")
+
+        self.assertFalse(Message1.objects.filter(chat=self.chat).exists())
+        chat = Chat.objects.get(id=self.chat.id)
+        self.assertEqual((chat.unread_for_doctor, chat.unread_for_patient, chat.last_message_id), (0, 0, None))
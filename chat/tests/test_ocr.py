@@ -0,0 +1,90 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from kombu.exceptions import OperationalError
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import ocr
+from chat.models import UploadedImage
+
+from .utils import ChatTestCase, image_upload
+
+
+class PreprocessTests(SimpleTestCase):
+    def test_otsu_separates_ink_from_paper(self):
+        image = Image.new("L", (100, 100), 220)
+        ImageDraw.Draw(image).rectangle((10, 10, 40, 90), fill=30)
+        threshold = ocr.otsu_threshold(image)
+        self.assertTrue(30 <= threshold < 220)
+        self.assertEqual(sorted(set(ocr.binarize(image).tobytes())), [0, 255])
+
+    def test_skewed_lines_are_levelled(self):
+        page = Image.new("L", (600, 600), 255)
+        draw = ImageDraw.Draw(page)
+        for y in range(60, 560, 40):
+            draw.rectangle((50, y, 550, y + 12), fill=0)
+        skewed = page.rotate(-4, fillcolor=255)
+        self.assertAlmostEqual(ocr.estimate_skew(skewed), 4, delta=0.5)
+
+    def test_preprocess_downscales_and_binarizes(self):
+        result = ocr.preprocess(Image.new("RGB", (4000, 1000), (240, 240, 240)), max_edge=1000)
+        self.assertLessEqual(max(result.size), 1100)
+        self.assertEqual(result.mode, "L")
+
+
+class OCRLifecycleTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media, CELERY_TASK_ALWAYS_EAGER=True))
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/chat/gpt/images/", {"image": image_upload(), "language": "ru"}, format="multipart"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["status"], "pending")
+        return UploadedImage.objects.get(id=response.data["id"])
+
+    def test_upload_is_recognized_in_the_background(self):
+        with mock.patch("chat.ocr.ocr_bytes", return_value="Гемоглобин 135 г/л") as read:
+            image = self.upload()
+
+        self.assertEqual(read.call_args.args[1], "ru")
+        self.assertEqual((image.ocr_status, image.analyzed_text), ("done", "Гемоглобин 135 г/л"))
+        self.assertIsNotNone(image.ocr_finished_at)
+        detail = self.client.get(f"/api/chat/gpt/images/{image.id}/").data
+        self.assertEqual((detail["status"], detail["analysis"]), ("done", "Гемоглобин 135 г/л"))
+
+    def test_missing_tesseract_marks_the_upload_failed(self):
+        with mock.patch("chat.ocr.ocr_bytes", side_effect=ocr.OCRUnavailable("tesseract is not installed")):
+            image = self.upload()
+        self.assertEqual((image.ocr_status, image.ocr_error), ("failed", "tesseract is not installed"))
+
+    def test_claimed_upload_is_not_read_twice(self):
+        image = UploadedImage.objects.create(user=self.user, image="uploads/x.png", ocr_status="processing")
+        with mock.patch("chat.ocr.ocr_bytes") as read:
+            self.assertIsNone(ocr.recognize_uploaded_image(image.id))
+        read.assert_not_called()
+
+    def test_broker_failure_falls_back_to_the_local_pool(self):
+        with mock.patch("chat.tasks.ocr_uploaded_image.delay", side_effect=OperationalError("broker down")):
+            with mock.patch("chat.ocr._submit_to_pool") as pool:
+                image = self.upload()
+        pool.assert_called_once_with(image.id)
+
+    def test_upload_is_marked_failed_when_nothing_can_run_it(self):
+        with mock.patch("chat.tasks.ocr_uploaded_image.delay", side_effect=OperationalError("broker down")):
+            with mock.patch("chat.ocr._get_pool", side_effect=OSError("cannot start workers")):
+                image = self.upload()
+        image.refresh_from_db()
+        self.assertEqual((image.ocr_status, image.ocr_error), ("failed", "cannot start workers"))
@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chat.context import count_tokens
+from chat.prompts import PromptRegistry, get_prompt
+
+
+class PromptRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = PromptRegistry()
+        self.registry.register("form.system", "Русский промпт")
+        self.registry.register("form.system", "O'zbekcha prompt", language="uz")
+        self.registry.register("form.system", "Промпт радиолога", model="avishifo-radiolog")
+
+    def test_lookup_falls_back_to_any_model_then_russian(self):
+        self.assertEqual(self.registry.get("form.system", "uz", "avishifo-ai").text, "O'zbekcha prompt")
+        self.assertEqual(self.registry.get("form.system", "en").text, "Русский промпт")
+        self.assertEqual(self.registry.get("form.system", "en", "avishifo-radiolog").text, "Промпт радиолога")
+        with self.assertRaises(KeyError):
+            self.registry.get("missing.system")
+
+    def test_newest_version_unless_pinned(self):
+        self.registry.register("form.system", "Новая версия", version=2)
+        self.assertEqual(self.registry.get("form.system").text, "Новая версия")
+        with override_settings(AI_PROMPT_VERSIONS={"form.system": 1}):
+            self.assertEqual(self.registry.get("form.system").text, "Русский промпт")
+
+    def test_tokens_are_counted_on_first_use_only(self):
+        template = self.registry.get("form.system")
+        with mock.patch("chat.context.count_tokens", return_value=42) as count:
+            self.assertEqual(template.tokens, 42)
+            self.assertEqual(template.tokens, 42)
+        count.assert_called_once()
+
+    def test_lookups_do_not_count_tokens(self):
+        with mock.patch("chat.context.count_tokens") as count:
+            self.registry.get("form.system")
+        count.assert_not_called()
+
+    def test_inventory_reports_size_and_cacheability(self):
+        template = self.registry.all()[0]
+        entry = self.registry.inventory()[0]
+        self.assertEqual(entry["tokens"], count_tokens(template.text))
+        self.assertFalse(entry["cacheable"])
+        self.assertEqual(len(entry["sha256"]), 12)
+
+    def test_project_prompts_are_registered(self):
+        self.assertIn("{analyses}", get_prompt("vision.series_summary", "en").text)
+        self.assertGreater(get_prompt("chat.system").tokens, 0)
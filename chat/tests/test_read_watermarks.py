@@ -0,0 +1,87 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from chat import messaging, realtime
+from chat.models import Chat, ChatParticipant, Message1
+
+from .utils import ChatTestCase, DoctorPatientChatMixin
+
+
+class ReadWatermarkTests(DoctorPatientChatMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def watermark(self, user):
+        return ChatParticipant.objects.get(chat=self.chat, user=user).last_read_at
+
+    def test_mark_read_moves_one_watermark_and_leaves_messages_alone(self):
+        messages = [messaging.send(self.chat, self.patient_user, "patient", content=f"Вопрос {i}") for i in range(3)]
+        before = {m.id: m.updated_at for m in Message1.objects.filter(chat=self.chat)}
+
+        with CaptureQueriesContext(connection) as queries:
+            read_at = realtime.mark_read(self.chat, "doctor", self.doctor_user.id)
+
+        writes = [q["sql"] for q in queries if q["sql"].startswith(("UPDATE", "INSERT"))]
+        self.assertEqual(len(writes), 2)
+        self.assertFalse(any("chat_message1" in sql for sql in writes))
+        self.assertEqual({m.id: m.updated_at for m in Message1.objects.filter(chat=self.chat)}, before)
+        self.assertEqual(self.watermark(self.doctor_user), read_at)
+        self.assertGreaterEqual(read_at, messages[-1].created_at)
+
+    def test_nothing_unread_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(realtime.mark_read(self.chat, "doctor", self.doctor_user.id))
+
+        self.assertFalse([q for q in queries if q["sql"].startswith(("UPDATE", "INSERT")) and "chat_participant" in q["sql"]])
+
+    def test_watermark_moves_even_when_the_counter_says_nothing_is_unread(self):
+        ChatParticipant.objects.filter(chat=self.chat, user=self.doctor_user).update(last_read_at=self.chat.created_at)
+        question = messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        Chat.objects.filter(id=self.chat.id).update(unread_for_doctor=0)
+
+        self.assertEqual(realtime.mark_read(self.chat, "doctor", self.doctor_user.id), question.created_at)
+        self.assertEqual(self.watermark(self.doctor_user), question.created_at)
+
+    def test_drifted_counter_is_reset_from_an_up_to_date_watermark(self):
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        realtime.mark_read(self.chat, "doctor", self.doctor_user.id)
+        Chat.objects.filter(id=self.chat.id).update(unread_for_doctor=3)
+
+        self.assertIsNone(realtime.mark_read(self.chat, "doctor", self.doctor_user.id))
+        self.assertEqual(Chat.objects.get(id=self.chat.id).unread_for_doctor, 0)
+
+    def test_watermark_stops_at_the_newest_visible_message(self):
+        # A message still being sent is newer than anything visible here, so
+        # it stays unread together with the count its send adds afterwards
+        question = messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+
+        read_at = realtime.mark_read(self.chat, "doctor", self.doctor_user.id)
+
+        self.assertEqual(read_at, question.created_at)
+
+    def test_missing_participant_is_created(self):
+        ChatParticipant.objects.filter(chat=self.chat, user=self.doctor_user).delete()
+        messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+
+        read_at = realtime.mark_read(self.chat, "doctor", self.doctor_user.id)
+
+        self.assertEqual(self.watermark(self.doctor_user), read_at)
+
+    def test_is_read_follows_the_recipients_watermark(self):
+        question = messaging.send(self.chat, self.patient_user, "patient", content="Вопрос")
+        self.client.force_authenticate(self.patient_user)
+
+        def is_read():
+            results = self.client.get(f"/api/chat/{self.chat.id}/messages/").data["results"]
+            return {m["id"]: m["is_read"] for m in results}
+
+        self.assertEqual(is_read(), {question.id: False})
+
+        self.client.force_authenticate(self.doctor_user)
+        self.client.post(f"/api/chat/{self.chat.id}/read/")
+        later = messaging.send(self.chat, self.patient_user, "patient", content="Ещё вопрос")
+
+        self.client.force_authenticate(self.patient_user)
+        self.assertEqual(is_read(), {question.id: True, later.id: False})
@@ -0,0 +1,142 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+
+from chat import realtime
+from chat.models import Chat
+
+from .utils import ChatTestCase, DoctorPatientChatMixin
+
+
+class RecordingLayer:
+    """Channel layer stand-in that keeps what was sent to groups"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+        self.groups = {}
+        self.queues = {}
+
+    async def group_send(self, group, message):
+        if self.fail:
+            raise ConnectionError("layer down")
+        self.sent.append((group, message))
+        for channel in self.groups.get(group, ()):
+            self.queues[channel].put_nowait(message)
+
+    async def new_channel(self):
+        channel = f"channel-{len(self.queues)}"
+        self.queues[channel] = asyncio.Queue()
+        return channel
+
+    async def group_add(self, group, channel):
+        self.groups.setdefault(group, set()).add(channel)
+
+    async def group_discard(self, group, channel):
+        self.groups.get(group, set()).discard(channel)
+
+    async def receive(self, channel):
+        return await self.queues[channel].get()
+
+
+def use_layer(layer):
+    return mock.patch.object(realtime, "get_channel_layer", lambda: layer)
+
+
+class BroadcastTests(SimpleTestCase):
+    def test_event_goes_to_the_chat_group(self):
+        layer = RecordingLayer()
+        with use_layer(layer):
+            realtime.broadcast(7, "typing", {"is_typing": True})
+
+        self.assertEqual(
+            layer.sent,
+            [("chat-7", {"type": "chat.event", "event": "typing", "data": {"is_typing": True}, "exclude": None})],
+        )
+
+    def test_layer_errors_and_missing_layer_are_ignored(self):
+        with use_layer(RecordingLayer(fail=True)):
+            realtime.broadcast(7, "message", {})
+        with use_layer(None):
+            realtime.broadcast(7, "message", {})
+        with mock.patch.object(realtime, "get_channel_layer", None):
+            realtime.broadcast(7, "message", {})
+        with mock.patch.object(realtime, "get_channel_layer", side_effect=ImportError("no channels_redis")):
+            realtime.broadcast(7, "message", {})
+
+    def test_participant_type(self):
+        chat = SimpleNamespace(doctor=SimpleNamespace(user_id=1), patient=SimpleNamespace(user_id=2))
+
+        self.assertEqual(realtime.participant_type(SimpleNamespace(id=1), chat), "doctor")
+        self.assertEqual(realtime.participant_type(SimpleNamespace(id=2), chat), "patient")
+        self.assertIsNone(realtime.participant_type(SimpleNamespace(id=3), chat))
+
+
+class ChatEventsTests(SimpleTestCase):
+    async def test_wait_wakes_up_on_an_event(self):
+        layer = RecordingLayer()
+        with use_layer(layer):
+            async with realtime.ChatEvents(5) as events:
+                asyncio.get_running_loop().call_later(0.01, layer.queues[events.channel].put_nowait, {})
+                self.assertTrue(await events.wait(5))
+                self.assertFalse(await events.wait(0.01))
+        self.assertEqual(layer.groups["chat-5"], set())
+
+    async def test_without_a_layer_wait_just_sleeps(self):
+        with use_layer(None):
+            async with realtime.ChatEvents(5) as events:
+                self.assertFalse(await events.wait(0.01))
+
+
+class PushTests(DoctorPatientChatMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.layer = RecordingLayer()
+        self.enterContext(use_layer(self.layer))
+        self.client = APIClient()
+
+    def events(self):
+        return [(message["event"], message["data"]) for _, message in self.layer.sent]
+
+    def test_sent_message_is_pushed_after_commit(self):
+        self.client.force_authenticate(self.patient_user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(f"/api/chat/{self.chat.id}/send/", {"content": "Здравствуйте"}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.layer.sent, [])
+        for callback in callbacks:
+            callback()
+        [(event, data)] = self.events()
+        self.assertEqual(event, "message")
+        self.assertEqual(data["id"], response.data["id"])
+        self.assertEqual(data["sender_type"], "patient")
+
+    def test_read_is_pushed_once(self):
+        self.client.force_authenticate(self.patient_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/chat/{self.chat.id}/send/", {"content": "Вопрос"}, format="json")
+        self.layer.sent.clear()
+
+        self.client.force_authenticate(self.doctor_user)
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post(f"/api/chat/{self.chat.id}/read/").status_code, 200)
+
+        [(event, data)] = self.events()
+        self.assertEqual(event, "read")
+        self.assertEqual(data["reader_type"], "doctor")
+        self.assertEqual(Chat.objects.get(id=self.chat.id).unread_for_doctor, 0)
+
+    def test_outsiders_cannot_send(self):
+        from accounts.models import User
+
+        self.client.force_authenticate(User.objects.create(username="x", email="x@example.com"))
+
+        response = self.client.post(f"/api/chat/{self.chat.id}/send/", {"content": "?"}, format="json")
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.layer.sent, [])
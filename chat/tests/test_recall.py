@@ -0,0 +1,119 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from accounts.models import User
+from chat import recall, tasks
+from chat.models import ChatSession, Message, RecallChunk, SearchDocument
+
+from .utils import ChatTestCase
+
+
+PAST_ANSWERS = [
+    "Пневмония внебольничная: шкала CURB-65, амоксициллин, рентген через две недели",
+    "Гипертоническая болезнь: лозартан, контроль давления дома, ограничение соли",
+    "Сахарный диабет второго типа: метформин, гликированный гемоглобин раз в квартал",
+    "Бронхиальная астма: ингаляционные глюкокортикостероиды, пикфлоуметрия, спейсер",
+]
+
+
+class ChunkTests(SimpleTestCase):
+    def test_lines_are_grouped_up_to_the_word_limit(self):
+        text = "one two three four\nfive six seven eight\nnine ten eleven twelve"
+
+        spans = recall.chunk_spans(text, max_words=8)
+
+        self.assertEqual([text[s:e] for s, e in spans], ["one two three four\nfive six seven eight", "nine ten eleven twelve"])
+
+    def test_long_lines_are_cut_and_short_tails_dropped(self):
+        text = " ".join(f"w{i}" for i in range(10))
+
+        spans = recall.chunk_spans(text, max_words=4)
+
+        self.assertEqual([text[s:e] for s, e in spans], ["w0 w1 w2 w3", "w4 w5 w6 w7"])
+
+
+class RecallTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        recall._indexes.clear()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.past = ChatSession.objects.create(user=self.user, title="Прошлые приёмы")
+        self.current = ChatSession.objects.create(user=self.user, title="Сегодня")
+
+    def message(self, session, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(session=session, role="assistant", content=content)
+
+    def test_message_is_indexed_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            message = Message.objects.create(session=self.past, role="assistant", content=PAST_ANSWERS[0])
+
+        self.assertFalse(RecallChunk.objects.filter(message=message).exists())
+        self.assertFalse(SearchDocument.objects.filter(message=message).exists())
+        for callback in callbacks:
+            callback()
+        self.assertTrue(RecallChunk.objects.filter(message=message).exists())
+        self.assertTrue(SearchDocument.objects.filter(message=message).exists())
+
+    def test_indexing_runs_inline_when_the_broker_is_down(self):
+        with mock.patch.object(tasks.index_chat_message, "delay", side_effect=OSError("broker down")):
+            message = self.message(self.past, PAST_ANSWERS[0])
+
+        self.assertTrue(RecallChunk.objects.filter(message=message).exists())
+
+    def test_recalls_other_sessions_from_the_published_model(self):
+        for answer in PAST_ANSWERS:
+            self.message(self.past, answer)
+        self.message(self.current, "Пневмония внебольничная у соседа по палате: CURB-65")
+
+        hits = recall.recall(self.user.id, "пневмония CURB-65 амоксициллин", exclude_session_id=self.current.id)
+
+        self.assertTrue(hits)
+        self.assertIn("амоксициллин", hits[0]["text"])
+        self.assertIn("Прошлые приёмы", hits[0]["label"])
+        message = recall.recall_message(self.user.id, "пневмония CURB-65", exclude_session_id=self.current.id)
+        self.assertTrue(message["content"].startswith(recall.RECALL_PREFIX))
+
+    def test_queries_never_fit(self):
+        for answer in PAST_ANSWERS:
+            self.message(self.past, answer)
+        # Another process: nothing in memory, the model comes from the cache
+        recall._indexes.clear()
+
+        with mock.patch.object(recall.DoctorIndex, "fit", side_effect=AssertionError("fit at request time")):
+            hits = recall.recall(self.user.id, "пневмония CURB-65 амоксициллин")
+
+        self.assertIn("амоксициллин", hits[0]["text"])
+
+    def test_without_a_published_model_a_refresh_is_queued(self):
+        for answer in PAST_ANSWERS:
+            self.message(self.past, answer)
+        cache.clear()
+
+        with mock.patch.object(recall.DoctorIndex, "fit", side_effect=AssertionError("fit at request time")), \
+                mock.patch.object(tasks.refresh_recall_index, "delay") as delay:
+            self.assertEqual(recall.recall(self.user.id, "астма спейсер"), [])
+            self.assertEqual(recall.recall(self.user.id, "астма спейсер"), [])
+
+        delay.assert_called_once_with(self.user.id)
+
+    def test_new_chunks_are_folded_into_the_published_model(self):
+        for answer in PAST_ANSWERS[:3]:
+            self.message(self.past, answer)
+        version = cache.get(recall._version_key(self.user.id))
+
+        self.message(self.past, PAST_ANSWERS[3])
+
+        self.assertNotEqual(cache.get(recall._version_key(self.user.id)), version)
+        self.assertEqual(recall.get_index(self.user.id).last_id, RecallChunk.objects.latest("id").id)
+
+    def test_deleted_chunks_are_skipped(self):
+        messages = [self.message(self.past, answer) for answer in PAST_ANSWERS]
+        query = "пневмония CURB-65 амоксициллин"
+        self.assertTrue(recall.recall(self.user.id, query))
+
+        messages[0].delete()
+
+        self.assertFalse(any("амоксициллин" in hit["text"] for hit in recall.recall(self.user.id, query)))
@@ -0,0 +1,119 @@
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import search
+from chat.models import ChatSession, Message, SearchDocument
+
+from .utils import ChatTestCase
+
+
+class StemTests(SimpleTestCase):
+    def test_inflections_share_a_stem(self):
+        self.assertEqual(search.stem("анализы"), search.stem("анализ"))
+        self.assertEqual(search.stem("bemorlarning"), search.stem("bemor"))
+        self.assertEqual(search.stem("treatments"), search.stem("treatment"))
+        self.assertEqual(search.stem("Ёлка"), search.stem("елка"))
+        self.assertEqual(search.stem("o‘pka"), "opka")
+        self.assertEqual(search.stem("65"), "65")
+
+    def test_query_terms_are_distinct_and_capped(self):
+        self.assertEqual(search.query_terms("CURB-65 curb"), ["curb", "65"])
+        self.assertEqual(len(search.query_terms(" ".join(f"слово{i}" for i in range(20)))), search.MAX_QUERY_TERMS)
+        self.assertEqual(search.query_terms("  !? "), [])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        text = "Вводная часть. " * 10 + "Шкала <CURB-65> при пневмонии"
+        result = search.snippet(text, search.query_terms("пневмония curb"))
+
+        self.assertTrue(result.startswith("…"))
+        self.assertIn("&lt;<mark>CURB</mark>-65&gt;", result)
+        self.assertIn("<mark>пневмонии</mark>", result)
+
+
+class SearchTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def message(self, session, content, role="assistant"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(session=session, role=role, content=content)
+
+    def session(self, title, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ChatSession.objects.create(user=user or self.user, title=title)
+
+    def get(self, **params):
+        return self.client.get("/api/chat/gpt/search/", params)
+
+    def test_ranked_hits_with_snippets(self):
+        session = self.session("Пневмония у пожилого")
+        weak = self.message(session, "Оцените по шкале CURB-65. " + "Прочие рекомендации. " * 30)
+        strong = self.message(session, "CURB-65: CURB-65 от 3 баллов, CURB-65 требует госпитализации")
+        # bm25 only gives rare terms weight, so most documents must not match
+        for i in range(5):
+            self.message(session, f"Без упоминания шкалы, вопрос {i}")
+
+        response = self.get(q="curb-65")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual([hit["message_id"] for hit in results], [strong.id, weak.id])
+        self.assertEqual(results[0]["session_title"], "Пневмония у пожилого")
+        self.assertEqual(results[0]["role"], "assistant")
+        self.assertIn("<mark>CURB</mark>", results[0]["snippet"])
+        self.assertGreater(results[0]["score"], results[1]["score"])
+
+    def test_stemmed_and_prefix_matches(self):
+        session = self.session("Обход")
+        message = self.message(session, "Bemorlarning analizlari tayyor")
+
+        self.assertEqual([h["message_id"] for h in self.get(q="bemor").data["results"]], [message.id])
+        self.assertEqual([h["message_id"] for h in self.get(q="anali").data["results"]], [message.id])
+
+    def test_title_matches_and_other_users_are_hidden(self):
+        mine = self.session("Гипертония контроль")
+        other = User.objects.create(username="other", email="other@example.com")
+        theirs = self.session("Гипертония у соседа", user=other)
+        self.message(theirs, "Гипертония, подбор терапии")
+
+        results = self.get(q="гипертония").data["results"]
+
+        self.assertEqual([(h["session_id"], h["message_id"]) for h in results], [(mine.id, None)])
+        self.assertIn("<mark>Гипертония</mark>", results[0]["snippet"])
+
+    def test_renamed_session_is_reindexed(self):
+        session = self.session("Старое название")
+        session.title = "Новое название"
+        with self.captureOnCommitCallbacks(execute=True):
+            session.save()
+
+        self.assertEqual(self.get(q="старое").data["results"], [])
+        self.assertEqual(len(self.get(q="новое").data["results"]), 1)
+        self.assertEqual(SearchDocument.objects.filter(session=session).count(), 1)
+
+    def test_pagination(self):
+        session = self.session("Серия")
+        for i in range(3):
+            self.message(session, f"Астма, визит {i}")
+
+        first = self.get(q="астма", limit=2).data
+        second = self.get(q="астма", limit=2, offset=2).data
+
+        self.assertTrue(first["has_more"])
+        self.assertEqual(first["next_offset"], 2)
+        self.assertFalse(second["has_more"])
+        self.assertEqual(len(first["results"]) + len(second["results"]), 3)
+
+    def test_deleted_message_stops_matching(self):
+        message = self.message(self.session("Удаление"), "Бронхит острый")
+        message.delete()
+
+        self.assertEqual(self.get(q="бронхит").data["results"], [])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.get(q="  ").status_code, 400)
+        self.assertEqual(self.get(q="астма", limit="x").status_code, 400)
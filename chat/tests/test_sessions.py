@@ -0,0 +1,84 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat.models import ChatSession, Message
+
+from .utils import ChatTestCase
+
+
+class SessionListTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def session(self, title, *contents):
+        session = ChatSession.objects.create(user=self.user, title=title)
+        for i, content in enumerate(contents):
+            Message.objects.create(session=session, role="user" if i % 2 == 0 else "assistant", content=content)
+        return session
+
+    def test_list_has_previews_and_is_ordered_by_activity(self):
+        empty = self.session("Пустая")
+        older = self.session("Старая", "Вопрос")
+        newer = self.session("Новая", "Вопрос", "Ответ " + "длинный " * 50)
+        Message.objects.create(session=older, role="user", content="Вернулся к старой")
+        ChatSession.objects.create(user=User.objects.create(username="other", email="o@example.com"))
+
+        data = self.client.get("/api/chat/gpt/chats/").data["results"]
+
+        self.assertEqual([s["id"] for s in data], [older.id, newer.id, empty.id])
+        self.assertEqual(data[0]["message_count"], 2)
+        self.assertEqual(data[0]["last_message_preview"], "Вернулся к старой")
+        self.assertEqual(data[1]["last_message_role"], "assistant")
+        self.assertEqual(len(data[1]["last_message_preview"]), 120)
+        self.assertIsNone(data[2]["last_message_preview"])
+        self.assertNotIn("messages", data[0])
+
+    def test_query_count_does_not_grow_with_sessions(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/api/chat/gpt/chats/")
+            return len(queries)
+
+        self.session("Первая", "Вопрос", "Ответ")
+        baseline = list_queries()
+        for i in range(5):
+            self.session(f"Сессия {i}", "Вопрос", "Ответ")
+        self.assertEqual(list_queries(), baseline)
+
+
+class SessionHistoryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="История")
+        self.messages = [
+            Message.objects.create(session=self.session, role="user", content=f"сообщение {i}") for i in range(7)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/chat/gpt/chats/{self.session.id}/messages/"
+
+    def test_pages_walk_back_through_history(self):
+        first = self.client.get(self.url, {"limit": 3}).data
+        self.assertEqual([m["content"] for m in first["results"]], ["сообщение 4", "сообщение 5", "сообщение 6"])
+        self.assertTrue(first["has_more"])
+
+        second = self.client.get(self.url, {"limit": 3, "before": first["next_before"]}).data
+        self.assertEqual([m["content"] for m in second["results"]], ["сообщение 1", "сообщение 2", "сообщение 3"])
+
+        last = self.client.get(self.url, {"limit": 3, "before": second["next_before"]}).data
+        self.assertEqual([m["content"] for m in last["results"]], ["сообщение 0"])
+        self.assertEqual((last["has_more"], last["next_before"]), (False, None))
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {"before": "abc"}).status_code, 400)
+
+    def test_other_users_sessions_are_hidden(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create(username="other", email="o@example.com"))
+        self.assertEqual(other.get(self.url).status_code, 404)
@@ -0,0 +1,77 @@
+import json
+from unittest import mock
+
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat.models import ChatSession, Message
+
+from .utils import ChatTestCase
+
+
+def parse_events(body):
+    """[(event, data)] of a text/event-stream body"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class StreamingReplyTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Консультация")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stream(self, deltas, url_suffix="send_message_stream/"):
+        url = f"/api/chat/gpt/chats/{self.session.id}/{url_suffix}"
+        with mock.patch("chat.views.stream_openai_api", side_effect=lambda *a, **k: deltas()):
+            response = self.client.post(url, {"content": "Головная боль третий день"}, format="json")
+            body = b"".join(response.streaming_content).decode()
+        return response, parse_events(body)
+
+    def test_deltas_are_framed_as_events_and_reply_is_saved(self):
+        response, events = self.stream(lambda: iter(["Вероятно, ", "мигрень."]))
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        self.assertEqual([event for event, _ in events], ["start", "delta", "delta", "done"])
+        self.assertEqual(events[0][1], {"session": self.session.id, "model_used": "gpt-4o"})
+        self.assertEqual(events[2][1], {"content": "мигрень."})
+
+        reply = Message.objects.filter(session=self.session, role="assistant").get()
+        self.assertEqual(reply.content, "Вероятно, мигрень.")
+
+    def test_stream_query_parameter_on_send_message(self):
+        _, events = self.stream(lambda: iter(["Да."]), url_suffix="send_message/?stream=1")
+        self.assertEqual(events[-1][0], "done")
+
+    def test_upstream_failure_mid_stream_keeps_partial_reply(self):
+        def deltas():
+            yield "Начало ответа"
+            raise RuntimeError("connection reset")
+
+        _, events = self.stream(deltas)
+
+        self.assertEqual([event for event, _ in events], ["start", "delta", "error"])
+        self.assertEqual(events[-1][1]["model_used"], "error")
+        reply = Message.objects.filter(session=self.session, role="assistant").get()
+        self.assertEqual(reply.content, "Начало ответа")
+
+    def test_failure_before_any_delta_saves_fallback(self):
+        def deltas():
+            raise RuntimeError("circuit open")
+            yield
+
+        self.stream(deltas)
+
+        reply = Message.objects.filter(session=self.session, role="assistant").get()
+        self.assertEqual(reply.model_used, "error")
+
+    def test_missing_content_is_rejected(self):
+        url = f"/api/chat/gpt/chats/{self.session.id}/send_message_stream/"
+        response = self.client.post(url, {}, format="json")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,128 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat.models import ChatSession, Message
+from chat.summaries import refresh_session_summary, schedule_summary, summary_lock_key
+
+from .utils import ChatTestCase, ChatTransactionTestCase
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    AI_SUMMARY_TRIGGER_TOKENS=100,
+    AI_SUMMARY_KEEP_RECENT=2,
+    AI_SUMMARY_INPUT_TOKENS=1000,
+)
+class SessionSummaryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=user, title="Консультация")
+
+    def add(self, count, token_count=30):
+        return [
+            Message.objects.create(
+                session=self.session,
+                role="user" if i % 2 == 0 else "assistant",
+                content=f"реплика {i}",
+                token_count=token_count,
+            )
+            for i in range(count)
+        ]
+
+    def test_short_history_is_not_summarized(self):
+        self.add(5)  # 3 foldable messages, 90 tokens
+        with mock.patch("chat.tasks.summarize_session.delay") as delay:
+            self.assertFalse(schedule_summary(self.session))
+        delay.assert_not_called()
+
+    def test_long_history_queues_one_summary(self):
+        self.add(6)
+        with mock.patch("chat.tasks.summarize_session.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(schedule_summary(self.session))
+                # Already queued: the lock keeps a second request out
+                self.assertFalse(schedule_summary(self.session))
+        delay.assert_called_once_with(self.session.id)
+
+    def test_broker_failure_releases_the_lock(self):
+        self.add(6)
+        with mock.patch("chat.tasks.summarize_session.delay", side_effect=OSError("broker down")):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(schedule_summary(self.session))
+
+        self.assertIsNone(cache.get(summary_lock_key(self.session.id)))
+
+    def test_refresh_folds_older_turns_and_keeps_recent_tail(self):
+        messages = self.add(6)
+        with mock.patch("chat.views.call_openai_api", return_value="Резюме: жалобы на головную боль.") as call:
+            summary = refresh_session_summary(self.session.id)
+
+        self.assertEqual(summary, "Резюме: жалобы на головную боль.")
+        prompt = call.call_args.args[0][1]["content"]
+        self.assertIn("Врач: реплика 0", prompt)
+        self.assertIn("AviShifo: реплика 3", prompt)
+        self.assertNotIn("реплика 4", prompt)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, summary)
+        self.assertEqual(self.session.summary_upto_id, messages[3].id)
+
+    def test_refresh_extends_the_existing_summary(self):
+        messages = self.add(4)
+        self.session.summary = "Пациент 45 лет."
+        self.session.summary_upto = messages[1]
+        self.session.save(update_fields=["summary", "summary_upto"])
+        self.add(2)
+
+        with mock.patch("chat.views.call_openai_api", return_value="Новое резюме") as call:
+            refresh_session_summary(self.session.id)
+
+        prompt = call.call_args.args[0][1]["content"]
+        self.assertIn("Текущее резюме:\nПациент 45 лет.", prompt)
+        self.assertNotIn("реплика 1", prompt)
+        self.assertIn("реплика 2", prompt)
+
+    def test_task_releases_the_lock(self):
+        from chat.tasks import summarize_session
+
+        self.add(6)
+        cache.add(summary_lock_key(self.session.id), True)
+        with mock.patch("chat.views.call_openai_api", return_value="Резюме"):
+            summarize_session.delay(self.session.id)
+
+        self.assertIsNone(cache.get(summary_lock_key(self.session.id)))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "Резюме")
+
+
+@override_settings(AI_SUMMARY_TRIGGER_TOKENS=100, AI_SUMMARY_KEEP_RECENT=2)
+class SummaryQueueFailureTests(ChatTransactionTestCase):
+    """Outside a transaction on_commit callbacks run at once, inside the view"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=user, title="Консультация")
+        for i in range(6):
+            Message.objects.create(session=self.session, role="user", content=f"реплика {i}", token_count=30)
+
+    def test_broker_failure_does_not_fail_the_reply(self):
+        client = APIClient()
+        client.force_authenticate(self.session.user)
+
+        with mock.patch("chat.views.call_openai_api", return_value="Ответ"), \
+                mock.patch("chat.tasks.summarize_session.delay", side_effect=OSError("broker down")):
+            response = client.post(
+                f"/api/chat/gpt/chats/{self.session.id}/send_message/", {"content": "Вопрос"}, format="json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["reply"], "Ответ")
+        replies = self.session.messages.filter(role="assistant").order_by("-id")
+        self.assertEqual([m.content for m in replies[:1]], ["Ответ"])
+        self.assertFalse(replies.filter(model_used="error").exists())
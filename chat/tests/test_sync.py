@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat import messaging
+from chat.models import Message1
+from chat.views import CHAT_SYNC_MAX_PAGE_SIZE, parse_sync_params
+
+from .utils import ChatTestCase, DoctorPatientChatMixin
+
+
+class SyncParamsTests(SimpleTestCase):
+    def test_parsing(self):
+        after, since, limit = parse_sync_params({"after": "12", "limit": "100000"})
+        self.assertEqual((after, since, limit), (12, None, CHAT_SYNC_MAX_PAGE_SIZE))
+
+        # "+" of the offset arrives as a space when the client does not escape it
+        _, since, limit = parse_sync_params({"since": "2026-03-01T10:00:00 05:00", "limit": "0"})
+        self.assertEqual(since.utcoffset(), timedelta(hours=5))
+        self.assertEqual(limit, 1)
+
+        _, since, _ = parse_sync_params({"since": "2026-03-01T10:00:00"})
+        self.assertTrue(timezone.is_aware(since))
+
+    def test_malformed(self):
+        for params in ({"after": "x"}, {"since": "yesterday"}, {"limit": "many"}):
+            with self.subTest(params=params), self.assertRaises(ValueError):
+                parse_sync_params(params)
+
+
+class KeysetSyncTests(DoctorPatientChatMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor_user)
+        self.url = f"/api/chat/{self.chat.id}/messages/"
+
+    def send(self, count, user=None, sender_type="patient"):
+        return [
+            messaging.send(self.chat, user or self.patient_user, sender_type, content=f"Сообщение {i}")
+            for i in range(count)
+        ]
+
+    def test_after_returns_only_newer_messages_oldest_first(self):
+        first, second, third = self.send(3)
+
+        data = self.client.get(self.url, {"after": first.id}).data
+
+        self.assertEqual([m["id"] for m in data["results"]], [second.id, third.id])
+        self.assertFalse(data["has_more"])
+        self.assertEqual(data["next_after"], third.id)
+        # Fetching the other side's messages reads them
+        self.assertTrue(all(m["is_read"] for m in data["results"]))
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.unread_for_doctor, 0)
+
+    def test_pages_follow_next_after(self):
+        messages = self.send(5)
+
+        first = self.client.get(self.url, {"after": 0, "limit": 3}).data
+        second = self.client.get(self.url, {"after": first["next_after"], "limit": 3}).data
+
+        self.assertTrue(first["has_more"])
+        self.assertEqual([m["id"] for m in first["results"] + second["results"]], [m.id for m in messages])
+        self.assertFalse(second["has_more"])
+
+    def test_nothing_new_keeps_the_cursor(self):
+        [message] = self.send(1)
+
+        data = self.client.get(self.url, {"after": message.id}).data
+
+        self.assertEqual(data, {"results": [], "has_more": False, "next_after": message.id})
+
+    def test_since(self):
+        [old] = self.send(1)
+        Message1.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(hours=1))
+        [new] = self.send(1)
+
+        since = (timezone.now() - timedelta(minutes=5)).isoformat()
+        data = self.client.get(self.url, {"since": since}).data
+
+        self.assertEqual([m["id"] for m in data["results"]], [new.id])
+
+    def test_poll_cost_does_not_grow_with_the_chat(self):
+        def poll_queries(after):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(self.url, {"after": after}).status_code, 200)
+            return [query["sql"] for query in queries]
+
+        last = self.send(2)[-1]
+        few = poll_queries(last.id)
+        last = self.send(30)[-1]
+        many = poll_queries(last.id)
+
+        self.assertEqual(len(many), len(few))
+        self.assertFalse(any("COUNT(" in sql.upper() for sql in many))
+
+    def test_sender_own_messages_do_not_mark_read(self):
+        self.send(1)
+        [own] = self.send(1, user=self.doctor_user, sender_type="doctor")
+
+        self.client.get(self.url, {"after": own.id - 1})
+
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.unread_for_doctor, 1)
+
+    def test_bad_cursor_and_outsiders(self):
+        from accounts.models import User
+
+        self.assertEqual(self.client.get(self.url, {"after": "x"}).status_code, 400)
+        self.client.force_authenticate(User.objects.create(username="x", email="x@example.com"))
+        self.assertEqual(self.client.get(self.url, {"after": 0}).status_code, 403)
+
+
+class LongPollTests(DoctorPatientChatMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.doctor_user)
+        self.url = f"/api/chat/{self.chat.id}/messages/poll/"
+
+    def test_returns_at_once_when_messages_are_waiting(self):
+        message = messaging.send(self.chat, self.patient_user, "patient", content="Есть новости")
+
+        data = self.client.get(self.url, {"after": 0, "wait": 10}).json()
+
+        self.assertEqual([m["id"] for m in data["results"]], [message.id])
+
+    def test_times_out_empty(self):
+        data = self.client.get(self.url, {"after": 0, "wait": 0.05}).json()
+
+        self.assertEqual(data, {"results": [], "has_more": False, "next_after": 0})
+
+    def test_requires_a_participant(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, {"after": 0, "wait": 0}).status_code, 401)
+        self.client.force_login(self.patient_user)
+        self.assertEqual(self.client.get(f"/api/chat/{self.chat.id + 1}/messages/poll/", {"wait": 0}).status_code, 404)
@@ -0,0 +1,86 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from chat import telemetry
+from chat.models import AICall, ChatSession, Message
+from chat.telemetry import CallMetrics, call_context, percentile, summarize, worker_context
+
+from .utils import ChatTestCase
+
+
+class CallContextTests(SimpleTestCase):
+    def test_worker_contexts_get_their_own_record(self):
+        with call_context(endpoint="analyze-instrumental-images", language="uz"):
+            telemetry.annotate(pending_calls=[1])
+            first, second = worker_context(), worker_context()
+            first.run(telemetry.annotate, pending_calls=[2])
+
+            self.assertEqual(first.run(telemetry.current)["pending_calls"], [2])
+            self.assertEqual(second.run(telemetry.current), {"endpoint": "analyze-instrumental-images", "language": "uz"})
+            # The request's own record is untouched
+            self.assertEqual(telemetry.current()["pending_calls"], [1])
+
+    def test_call_context_is_restored(self):
+        with call_context(endpoint="summary"):
+            self.assertEqual(telemetry.current(), {"endpoint": "summary"})
+        self.assertIsNone(telemetry.current())
+
+    def test_annotate_outside_a_context_does_nothing(self):
+        telemetry.annotate(language="ru", budget_remaining={})
+        self.assertIsNone(telemetry.current())
+
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary_groups_calls(self):
+        rows = [
+            {"endpoint": "send-message", "model": "gpt-4o", "language": "ru", "outcome": outcome,
+             "retries": 1, "queue_wait_ms": 5, "latency_ms": latency, "ttft_ms": None,
+             "prompt_tokens": 100, "completion_tokens": 10}
+            for outcome, latency in (("ok", 200), ("ok", 400), ("timeout", 9000))
+        ]
+        [group] = summarize(rows)
+        self.assertEqual((group["calls"], group["errors"], group["retries"]), (3, 1, 3))
+        self.assertEqual(group["latency_ms"], {"p50": 400, "p95": 9000, "p99": 9000})
+        self.assertEqual(group["ttft_ms"]["p50"], None)
+
+
+class RequestTelemetryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="doc", email="doc@example.com")
+        self.session = ChatSession.objects.create(user=self.user, title="Консультация")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_calls_are_recorded_and_linked_to_the_reply(self):
+        with call_context(endpoint="send-message"):
+            metrics = CallMetrics("gpt-4o", self.user.id)
+            metrics.acquired()
+            metrics.save([{"role": "user", "content": "Привет"}], "Здравствуйте")
+            message = Message.objects.create(session=self.session, role="assistant", content="Здравствуйте")
+
+        call = AICall.objects.get()
+        self.assertEqual((call.endpoint, call.outcome, call.message_id), ("send-message", "ok", message.id))
+        self.assertGreater(call.prompt_tokens, 0)
+
+    def test_context_is_cleared_after_a_request(self):
+        with mock.patch("chat.views.call_openai_api", return_value="Ответ"):
+            self.client.post(f"/api/chat/gpt/chats/{self.session.id}/send_message/", {"content": "Вопрос"})
+        self.assertIsNone(telemetry.current())
+
+    def test_context_is_cleared_when_a_stream_closes(self):
+        url = f"/api/chat/gpt/chats/{self.session.id}/send_message_stream/"
+        with mock.patch("chat.views.stream_openai_api", side_effect=lambda *a, **k: iter(["Ответ"])):
+            response = self.client.post(url, {"content": "Вопрос"})
+            # The body still runs with the request's context
+            self.assertEqual(telemetry.current()["endpoint"], response.resolver_match.url_name)
+            b"".join(response.streaming_content)
+
+        self.assertIsNone(telemetry.current())
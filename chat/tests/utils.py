@@ -0,0 +1,54 @@
+import io
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from accounts.models import User
+from chat import image_cache
+from chat.models import Chat
+from doctors.models import Doctor
+from patients.models import Patient
+
+
+def image_bytes(size=(64, 48), color=(200, 30, 30), mode="RGB", fmt="PNG"):
+    output = io.BytesIO()
+    Image.new(mode, size, color).save(output, fmt)
+    return output.getvalue()
+
+
+def image_upload(name="scan.png", **kwargs):
+    return SimpleUploadedFile(name, image_bytes(**kwargs), content_type="image/png")
+
+
+class ClearCachesMixin:
+    """Clears the process-wide caches (coalescing, image analyses) between tests"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        image_cache._memory.clear()
+
+
+# Indexing and other on-commit work is queued to Celery; there is no broker in tests
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ChatTestCase(ClearCachesMixin, TestCase):
+    pass
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ChatTransactionTestCase(ClearCachesMixin, TransactionTestCase):
+    """For views that write from worker threads, which cannot see the test transaction"""
+
+
+class DoctorPatientChatMixin:
+    """A Chat between a doctor and a patient"""
+
+    def setUp(self):
+        super().setUp()
+        self.doctor_user = User.objects.create(username="doctor", email="doctor@example.com", user_type="doctor")
+        self.patient_user = User.objects.create(username="patient", email="patient@example.com")
+        self.doctor = Doctor.objects.create(user=self.doctor_user)
+        self.patient = Patient.objects.create(user=self.patient_user, patient_id="P-1")
+        self.chat = Chat.objects.create(doctor=self.doctor, patient=self.patient)
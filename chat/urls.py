@@ -3,6 +3,7 @@ from .views import (
     ChatListView,
     ChatDetailView,
     ChatMessagesView,
+    chat_messages_poll,
     ChatSessionViewSet,
     UploadedImageViewSet,
     send_message,
@@ -10,6 +11,13 @@ from .views import (
     mark_messages_read,
     analyze_medical_form,
     analyze_instrumental_image,
+    analyze_instrumental_images,
+    ai_job_detail,
+    extract_lab_values_view,
+    lab_flags,
+    prompt_inventory,
+    ai_telemetry,
+    search_chat_history,
 )
 
 from rest_framework.routers import DefaultRouter
@@ -27,11 +35,19 @@ urlpatterns = [
     path("create/", create_or_get_chat, name="create-chat"),
     path("<int:pk>/", ChatDetailView.as_view(), name="chat-detail"),
     path("<int:chat_id>/messages/", ChatMessagesView.as_view(), name="chat-messages"),
+    path("<int:chat_id>/messages/poll/", chat_messages_poll, name="chat-messages-poll"),
     path("<int:chat_id>/send/", send_message, name="send-message"),
     path("<int:chat_id>/read/", mark_messages_read, name="mark-read"),
     path("analyze-medical-form/", analyze_medical_form, name="analyze-medical-form"),
     path("analyze-instrumental-image/", analyze_instrumental_image, name="analyze-instrumental-image"),
-
+    path("analyze-instrumental-images/", analyze_instrumental_images, name="analyze-instrumental-images"),
+    path("extract-lab-values/", extract_lab_values_view, name="extract-lab-values"),
+    path("lab-flags/", lab_flags, name="lab-flags"),
+    path("jobs/<uuid:job_id>/", ai_job_detail, name="ai-job-detail"),
+    path("prompts/", prompt_inventory, name="prompt-inventory"),
+    path("telemetry/", ai_telemetry, name="ai-telemetry"),
+
+    path('gpt/search/', search_chat_history, name='chat-search'),
     path('gpt/', include(router.urls)),
     
 ]
@@ -0,0 +1,174 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0005_doctor_bio_doctor_specializations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Specialization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(help_text="Internal value (e.g., 'cardiologist')", max_length=50, unique=True)),
+                ('label', models.CharField(help_text="Display label (e.g., 'Кардиолог')", max_length=255)),
+                ('description', models.TextField(blank=True, help_text='Optional description', null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this specialization is active')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Specialization',
+                'verbose_name_plural': 'Specializations',
+                'ordering': ['label'],
+            },
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='active_patients',
+            field=models.PositiveIntegerField(default=0, help_text='Активные пациенты'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='address',
+            field=models.TextField(blank=True, help_text='Полный адрес врача', null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='availability',
+            field=models.CharField(blank=True, help_text="Доступность (например: 'Понедельник - Пятница')", max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='availability_status',
+            field=models.CharField(blank=True, help_text="Статус доступности (например: 'Доступен', 'В отпуске', 'Занят')", max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='awards',
+            field=models.JSONField(blank=True, default=list, help_text='Награды и достижения'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='completed_treatments',
+            field=models.PositiveIntegerField(default=0, help_text='Завершенные курсы лечения'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='conferences_attended',
+            field=models.PositiveIntegerField(default=0, help_text='Количество посещенных конференций'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='country',
+            field=models.CharField(blank=True, help_text='Страна', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='date_of_birth',
+            field=models.DateField(blank=True, help_text='Дата рождения врача', null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='district',
+            field=models.CharField(blank=True, help_text='Район', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='emergency_contact',
+            field=models.CharField(blank=True, help_text='Экстренный контакт', max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='gender',
+            field=models.CharField(choices=[('male', 'Мужской'), ('female', 'Женский'), ('other', 'Другой'), ('not_specified', 'Не указано')], default='not_specified', help_text='Пол врача', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='insurance',
+            field=models.TextField(blank=True, help_text='Страховая информация', null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='insurance_info',
+            field=models.TextField(blank=True, help_text='Информация о страховке', null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='medical_license',
+            field=models.CharField(blank=True, help_text='Медицинская лицензия', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='monthly_consultations',
+            field=models.PositiveIntegerField(default=0, help_text='Количество консультаций в месяц'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='monthly_income',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Месячный доход', max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='region',
+            field=models.CharField(blank=True, help_text='Область/Регион', max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='research_papers',
+            field=models.PositiveIntegerField(default=0, help_text='Количество научных работ'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='total_income',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Общий доход врача', max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='total_patients',
+            field=models.PositiveIntegerField(default=0, help_text='Общее количество пациентов'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='total_reviews',
+            field=models.PositiveIntegerField(default=0, help_text='Общее количество отзывов'),
+        ),
+        # Filled per row in 0007 and made unique in 0008 - the default is
+        # evaluated once, so existing rows would all share one value
+        migrations.AddField(
+            model_name='doctor',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Unique identifier for public-facing URLs', null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='working_hours',
+            field=models.TextField(blank=True, help_text='Рабочие часы в текстовом формате', null=True),
+        ),
+        # The JSON list is kept as specializations_legacy, the name goes to the M2M
+        migrations.RenameField(
+            model_name='doctor',
+            old_name='specializations',
+            new_name='specializations_legacy',
+        ),
+        migrations.AlterField(
+            model_name='doctor',
+            name='specializations_legacy',
+            field=models.JSONField(blank=True, default=list, help_text='Legacy field - use specializations ManyToMany instead'),
+        ),
+        migrations.AlterField(
+            model_name='doctor',
+            name='specialty',
+            field=models.CharField(blank=True, choices=[('general_practitioner', 'Врач общей практики (терапевт)'), ('pediatrician', 'Педиатр (детский врач)'), ('family_doctor', 'Семейный врач'), ('cardiologist', 'Кардиолог'), ('vascular_surgeon', 'Сосудистый хирург'), ('hematologist', 'Гематолог'), ('pulmonologist', 'Пульмонолог (лёгкие)'), ('phthisiologist', 'Фтизиатр (туберкулёз)'), ('gastroenterologist', 'Гастроэнтеролог'), ('proctologist', 'Проктолог (колопроктолог)'), ('hepatologist', 'Гепатолог (печень)'), ('urologist', 'Уролог'), ('andrologist', 'Андролог (мужское здоровье)'), ('nephrologist', 'Нефролог (почки)'), ('gynecologist', 'Гинеколог'), ('reproductologist', 'Репродуктолог (ЭКО, бесплодие)'), ('obstetrician_gynecologist', 'Акушер-гинеколог'), ('endocrinologist', 'Эндокринолог (щитовидка, диабет)'), ('neurologist', 'Невролог'), ('neurosurgeon', 'Нейрохирург'), ('psychiatrist', 'Психиатр'), ('psychotherapist', 'Психотерапевт'), ('narcologist', 'Нарколог'), ('pediatric_cardiologist', 'Детский кардиолог'), ('pediatric_neurologist', 'Детский невролог'), ('pediatric_endocrinologist', 'Детский эндокринолог'), ('pediatric_surgeon', 'Детский хирург'), ('neonatologist', 'Неонатолог'), ('general_surgeon', 'Хирург общей практики'), ('traumatologist_orthopedist', 'Травматолог-ортопед'), ('oncosurgeon', 'Онкохирург'), ('plastic_surgeon', 'Пластический хирург'), ('maxillofacial_surgeon', 'Челюстно-лицевой хирург'), ('thoracic_surgeon', 'Торакальный хирург'), ('cardiosurgeon', 'Кардиохирург'), ('ophthalmologist', 'Офтальмолог (глазной врач)'), ('otolaryngologist', 'Отоларинголог (ЛОР)'), ('audiologist', 'Сурдолог (слух)'), ('dermatologist', 'Дерматолог'), ('cosmetologist', 'Косметолог'), ('venereologist', 'Венеролог'), ('oncologist', 'Онколог'), ('pediatric_oncologist', 'Детский онколог'), ('radiologist', 'Радиолог (рентген, МРТ, КТ)'), ('ultrasound_specialist', 'УЗИ-диагност'), ('laboratory_technician', 'Лаборант (клиническая лаборатория)'), ('pathologist', 'Патологоанатом'), ('geneticist', 'Генетик'), ('physiotherapist', 'Физиотерапевт'), ('rehabilitologist', 'Реабилитолог'), ('exercise_therapist', 'ЛФК-врач'), ('palliative_doctor', 'Паллиативный врач'), ('anesthesiologist_resuscitator', 'Анестезиолог-реаниматолог'), ('emergency_doctor', 'Врач скорой помощи'), ('toxicologist', 'Токсиколог'), ('epidemiologist', 'Врач-эпидемиолог'), ('hygienist', 'Врач-гигиенист'), ('preventive_medicine_doctor', 'Врач по медико-профилактическому делу'), ('dental_therapist', 'Стоматолог-терапевт'), ('dental_surgeon', 'Стоматолог-хирург'), ('dental_orthopedist', 'Стоматолог-ортопед'), ('orthodontist', 'Ортодонт'), ('pediatric_dentist', 'Детский стоматолог'), ('implantologist', 'Имплантолог'), ('sports_doctor', 'Спортивный врач'), ('forensic_medical_expert', 'Судебно-медицинский эксперт'), ('disaster_medicine_doctor', 'Врач медицины катастроф'), ('internal_medicine', 'Терапия (внутренние болезни)'), ('cardiology', 'Кардиология'), ('endocrinology', 'Эндокринология'), ('pulmonology', 'Пульмонология'), ('gastroenterology', 'Гастроэнтерология'), ('nephrology', 'Нефрология'), ('hematology', 'Гематология'), ('rheumatology', 'Ревматология'), ('allergy_immunology', 'Аллергология и иммунология'), ('infectious_diseases', 'Инфекционные болезни'), ('general_surgery', 'Общая хирургия'), ('cardiovascular_surgery', 'Сердечно-сосудистая хирургия'), ('neurosurgery', 'Нейрохирургия'), ('orthopedics_traumatology', 'Ортопедия и травматология'), ('urology', 'Урология'), ('plastic_surgery', 'Пластическая хирургия'), ('pediatric_surgery', 'Детская хирургия'), ('oncological_surgery', 'Онкохирургия'), ('thoracic_surgery', 'Торакальная хирургия'), ('maxillofacial_surgery', 'Челюстно-лицевая хирургия'), ('obstetrics_gynecology', 'Акушерство и гинекология'), ('pediatrics', 'Педиатрия'), ('neurology', 'Неврология'), ('psychiatry', 'Психиатрия'), ('dermatovenereology', 'Дерматовенерология'), ('ophthalmology', 'Офтальмология'), ('dentistry', 'Стоматология'), ('radiology', 'Радиология'), ('ultrasound_diagnostics', 'Ультразвуковая диагностика'), ('laboratory_diagnostics', 'Лабораторная диагностика'), ('pathomorphology', 'Патоморфология (патанатомия)'), ('functional_diagnostics', 'Функциональная диагностика'), ('medical_genetics', 'Медицинская генетика'), ('medical_rehabilitation', 'Медицинская реабилитация'), ('geriatrics', 'Гериатрия'), ('palliative_care', 'Паллиативная медицина'), ('sports_medicine', 'Спортивная медицина'), ('clinical_oncology', 'Клиническая онкология'), ('medical_cybernetics_ai', 'Медицинская кибернетика и ИИ в медицине'), ('transplantology', 'Трансплантология'), ('reproductive_medicine', 'Репродуктивная медицина')], max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='specializations',
+            field=models.ManyToManyField(blank=True, help_text='Doctor specializations', related_name='doctors', to='doctors.specialization'),
+        ),
+    ]
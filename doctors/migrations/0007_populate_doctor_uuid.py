@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+import uuid
+
+from django.db import migrations
+
+
+def gen_uuid(apps, schema_editor):
+    Doctor = apps.get_model('doctors', 'Doctor')
+    # AddField gave every existing row the same default
+    for doctor in Doctor.objects.only('id'):
+        doctor.uuid = uuid.uuid4()
+        doctor.save(update_fields=['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0006_doctor_profile_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(gen_uuid, migrations.RunPython.noop),
+    ]
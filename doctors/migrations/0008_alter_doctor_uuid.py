@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:22
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0007_populate_doctor_uuid'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctor',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Unique identifier for public-facing URLs', unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcare_api.settings')
+
+# Set up Django before the consumers import models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from chat.routing import websocket_urlpatterns  # noqa: E402
+from healthcare_api.ws_auth import JWTAuthMiddleware  # noqa: E402
+
+# HTTP keeps working as under WSGI; run with e.g. daphne healthcare_api.asgi:application.
+# No origin check: like the REST API (CORS allows all origins), sockets are
+# authenticated by the JWT in the URL, not by cookies.
+application = ProtocolTypeRouter(
+    {
+        'http': django_asgi_app,
+        'websocket': JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+    }
+)
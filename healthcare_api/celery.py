@@ -0,0 +1,10 @@
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcare_api.settings')
+
+app = Celery('healthcare_api')
+
+# Read every CELERY_* option from Django settings
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,196 @@
+"""
+Compressed storage for long text columns (AI answers).
+
+CompressedTextField keeps text as DEFLATE data in a binary column. A shared
+preset dictionary with the headings, markdown and phrases the answers
+repeat makes even short answers shrink well.
+
+Stored values start with a format byte:
+
+- 0x00: UTF-8 text, for values too short to be worth compressing;
+- 0x01 + dictionary id: raw DEFLATE, compressed with that dictionary
+  (id 0 = no dictionary).
+
+Dictionaries live in compression_dicts/<id>.txt and must never change once
+rows use them. A new dictionary gets a new id (see the
+train_compression_dict command); COMPRESSED_TEXT_DICTIONARY picks the one
+used for new writes, and old rows stay readable.
+
+Values are decompressed only when the attribute is read, and at most once
+per instance. Saving a row whose text was never read writes the stored
+bytes back unchanged. Database lookups on the text itself (contains,
+Substr, ...) do not work on these columns.
+"""
+import os
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+
+PLAIN = 0
+DEFLATE = 1
+
+MIN_COMPRESS_BYTES = 64
+DICTIONARY_DIR = os.path.join(os.path.dirname(__file__), "compression_dicts")
+# zlib's window is 32 KB; leave most of it for the text itself
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+@lru_cache(maxsize=None)
+def get_dictionary(dictionary_id):
+    if dictionary_id == 0:
+        return b""
+    path = os.path.join(DICTIONARY_DIR, f"{dictionary_id}.txt")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise ValueError(f"Compression dictionary {dictionary_id} not found at {path}")
+
+
+def compress(text, dictionary_id=None, level=None):
+    """Stored bytes for text (None stays None)"""
+    if text is None:
+        return None
+    data = text.encode("utf-8")
+    if len(data) < MIN_COMPRESS_BYTES:
+        return bytes([PLAIN]) + data
+
+    if dictionary_id is None:
+        dictionary_id = _setting("COMPRESSED_TEXT_DICTIONARY", 1)
+    level = _setting("COMPRESSED_TEXT_LEVEL", 6) if level is None else level
+    dictionary = get_dictionary(dictionary_id)
+    compressor = (
+        zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+        if dictionary
+        else zlib.compressobj(level, zlib.DEFLATED, -15)
+    )
+    packed = compressor.compress(data) + compressor.flush()
+    if len(packed) + 2 >= len(data) + 1:
+        return bytes([PLAIN]) + data
+    return bytes([DEFLATE, dictionary_id]) + packed
+
+
+def decompress(value):
+    """Text for stored bytes; plain str (rows written before compression) passes through"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value:
+        return ""
+    if value[0] == PLAIN:
+        return value[1:].decode("utf-8")
+    if value[0] == DEFLATE:
+        dictionary = get_dictionary(value[1])
+        decompressor = (
+            zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+        )
+        return (decompressor.decompress(value[2:]) + decompressor.flush()).decode("utf-8")
+    raise ValueError(f"Unknown compressed text format {value[0]}")
+
+
+def train_dictionary(samples, size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Preset dictionary from sample texts.
+
+    Lines are scored by how many samples contain them times their length, so
+    headings and boilerplate that every answer repeats win. The best lines go
+    last, where DEFLATE back-references are cheapest.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update({line.strip() for line in sample.splitlines() if len(line.strip()) >= 4})
+
+    min_samples = 2 if len(samples) > 1 else 1
+    scored = sorted(
+        (
+            (count * len(line.encode("utf-8")), line)
+            for line, count in counts.items()
+            if count >= min_samples
+        ),
+        reverse=True,
+    )
+    chosen, used = [], 0
+    for _, line in scored:
+        encoded = (line + "\n").encode("utf-8")
+        if used + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        used += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Keeps the stored bytes in __dict__ and decompresses them on first read"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        cache_key = self.field.text_cache_name
+        if cache_key in instance.__dict__:
+            return instance.__dict__[cache_key]
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = decompress(value)
+            instance.__dict__[cache_key] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__.pop(self.field.text_cache_name, None)
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField stored compressed in a binary column.
+
+    Reads like a TextField (forms, serializers, admin), but the database
+    only sees bytes, so filter on other columns.
+    """
+
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    @property
+    def text_cache_name(self):
+        return f"_{self.attname}_text"
+
+    def from_db_value(self, value, expression, connection):
+        # Keep the bytes; CompressedTextDescriptor decompresses on access
+        if isinstance(value, memoryview):
+            return bytes(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Untouched values are still the stored bytes; write them back as they are
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, memoryview)):
+            return bytes(value) if value is not None else None
+        return compress(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
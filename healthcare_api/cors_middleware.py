@@ -37,9 +37,12 @@ class CustomCorsMiddleware(MiddlewareMixin):
         response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
         response['Access-Control-Allow-Headers'] = (
             'Content-Type, Authorization, X-Requested-With, '
-            'Accept, Origin, X-CSRFToken, Cache-Control, Pragma'
+            'Accept, Origin, X-CSRFToken, Cache-Control, Pragma, Idempotency-Key'
         )
         response['Access-Control-Max-Age'] = '86400'
-        response['Access-Control-Expose-Headers'] = 'Content-Type, X-CSRFToken'
+        response['Access-Control-Expose-Headers'] = (
+            'Content-Type, X-CSRFToken, X-Coalesced, Idempotent-Replayed, Retry-After, '
+            'X-AI-Budget-Remaining-Daily, X-AI-Budget-Remaining-Minute'
+        )
         
         return response
@@ -55,6 +55,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chat.telemetry.AITelemetryMiddleware',
+    'chat.budgets.AIBudgetHeadersMiddleware',
 ]
 
 
@@ -80,6 +82,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'healthcare_api.wsgi.application'
+# WebSockets for doctor–patient chats (chat/realtime.py); serve with daphne or uvicorn
+ASGI_APPLICATION = 'healthcare_api.asgi.application'
 
 # Database
 # DATABASES = {
@@ -204,6 +208,7 @@ CORS_ALLOW_HEADERS = [
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
+    "idempotency-key",
 ]
 
 # Additional CORS settings for better compatibility
@@ -212,15 +217,170 @@ CORS_ALLOW_PRIVATE_NETWORK = True
 CORS_EXPOSE_HEADERS = [
     "content-type",
     "x-csrftoken",
+    "x-coalesced",
+    "idempotent-replayed",
+    "retry-after",
+    "x-ai-budget-remaining-daily",
+    "x-ai-budget-remaining-minute",
 ]
 
 # Celery Configuration
-CELERY_BROKER_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=config('REDIS_URL', default='redis://localhost:6379/0'))
 CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Run tasks inline (no broker/worker needed) - use with CELERY_BROKER_URL=memory:// for tests
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+# Slow OpenAI calls go to their own queue so they never starve other tasks
+# OCR is CPU-bound: run its queue on a separate worker, e.g. celery worker -Q ocr -c 2
+CELERY_TASK_ROUTES = {
+    'chat.tasks.ocr_uploaded_image': {'queue': 'ocr'},
+    'chat.tasks.*': {'queue': 'ai'},
+}
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# OpenAI gateway (chat/ai_gateway.py): connection pool, concurrency limits,
+# retries with jittered backoff and a circuit breaker
+AI_HTTP_MAX_CONNECTIONS = config('AI_HTTP_MAX_CONNECTIONS', default=20, cast=int)
+AI_HTTP_MAX_KEEPALIVE = 10
+AI_HTTP_CONNECT_TIMEOUT = 5
+AI_HTTP_READ_TIMEOUT = config('AI_HTTP_READ_TIMEOUT', default=120, cast=int)
+AI_MAX_CONCURRENCY = config('AI_MAX_CONCURRENCY', default=8, cast=int)  # per process
+AI_MAX_CONCURRENCY_PER_USER = config('AI_MAX_CONCURRENCY_PER_USER', default=2, cast=int)
+AI_QUEUE_TIMEOUT = 30  # seconds to wait for a free slot
+AI_MAX_RETRIES = 3
+AI_BACKOFF_BASE = 0.5
+AI_BACKOFF_CAP = 8.0
+AI_CIRCUIT_FAILURE_THRESHOLD = 5
+AI_CIRCUIT_RESET_TIMEOUT = 30
+
+# Point the OpenAI client at another OpenAI-compatible server, e.g. the local
+# stand-in from `manage.py run_fake_openai` (http://127.0.0.1:8765/v1)
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='')
+# Answer AI calls in-process from chat/fake_openai.py (benchmarks, offline tests)
+AI_FAKE_MODE = config('AI_FAKE_MODE', default=False, cast=bool)
+AI_FAKE_OPENAI = {
+    'latency': config('AI_FAKE_LATENCY', default=0.3, cast=float),
+    'token_delay': 0.005,
+    'error_rate': config('AI_FAKE_ERROR_RATE', default=0.0, cast=float),
+    'error_status': 503,
+}
+
+# AI context window (tokens). Chat history is packed newest-first into the
+# budget, after reserving max_tokens for the reply.
+AI_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+}
+AI_CONTEXT_BUDGETS = {
+    'gpt-4o': config('AI_CONTEXT_BUDGET', default=24000, cast=int),
+}
+
+# Rolling chat summaries: once a session's unsummarized history passes the
+# trigger, older turns are folded into ChatSession.summary in the background
+AI_SUMMARY_TRIGGER_TOKENS = config('AI_SUMMARY_TRIGGER_TOKENS', default=8000, cast=int)
+AI_SUMMARY_KEEP_RECENT = 6  # messages always sent verbatim
+AI_SUMMARY_INPUT_TOKENS = 12000  # max history folded per run
+AI_SUMMARY_MODEL = config('AI_SUMMARY_MODEL', default='gpt-4o-mini')
+AI_SUMMARY_MAX_TOKENS = 800
+
+# Recall of a doctor's other sessions and case histories (chat/recall.py):
+# the closest snippets are added to send_message within this token budget
+AI_RECALL_ENABLED = config('AI_RECALL_ENABLED', default=True, cast=bool)
+AI_RECALL_MAX_TOKENS = config('AI_RECALL_MAX_TOKENS', default=800, cast=int)
+AI_RECALL_TOP_K = 5
+AI_RECALL_MIN_SCORE = 0.25  # cosine in LSA space
+AI_RECALL_MAX_CHUNKS = 5000  # latest chunks per doctor kept in memory
+AI_RECALL_CACHED_DOCTORS = 32  # doctor indexes per process
+
+# Vision uploads are normalized before base64 encoding (chat/imaging.py)
+AI_IMAGE_MAX_EDGE = config('AI_IMAGE_MAX_EDGE', default=2048, cast=int)  # gpt-4o high detail limit
+AI_IMAGE_JPEG_QUALITY = 85
+AI_IMAGE_WORKERS = 2  # Pillow thread pool size per process
+AI_IMAGE_PREP_TIMEOUT = 30
+
+# OCR of uploaded images (chat/ocr.py): Tesseract with rus/uzb/uzb_cyrl/eng packs
+AI_OCR_BACKEND = config('AI_OCR_BACKEND', default='celery')  # or 'process' (pool in the web process)
+AI_OCR_WORKERS = config('AI_OCR_WORKERS', default=2, cast=int)  # 'process' backend pool size
+AI_OCR_MAX_EDGE = 3000  # px; larger scans are downscaled before Tesseract
+AI_OCR_TIMEOUT = 120  # seconds per image
+
+# Batch image analysis (analyze-instrumental-images/)
+AI_BATCH_MAX_IMAGES = 20
+AI_BATCH_MAX_WORKERS = 10  # concurrent images per request, also capped by AI_MAX_CONCURRENCY
+
+# Image analysis cache (SHA-256 of image + prompt/language/model)
+AI_IMAGE_CACHE_TTL = config('AI_IMAGE_CACHE_TTL', default=30 * 24 * 3600, cast=int)  # seconds
+AI_IMAGE_CACHE_MAX_ENTRIES = 256  # in-process LRU
+AI_IMAGE_CACHE_MAX_ROWS = 50000  # database table, see chat.tasks.prune_image_analysis_cache
+
+# Prompt registry (chat/prompts.py): pin a template version per feature,
+# e.g. {'medical_form.system': 1}; the newest version is used otherwise
+AI_PROMPT_VERSIONS = {}
+
+# Per-call AI telemetry (chat.AICall), see /api/chat/telemetry/
+AI_TELEMETRY_RETENTION_DAYS = config('AI_TELEMETRY_RETENTION_DAYS', default=30, cast=int)
+
+# AI token budgets (chat/budgets.py): token bucket + daily quota per user and
+# per hospital, checked in the AI gateway. 0 switches a limit off.
+AI_BUDGETS_ENABLED = config('AI_BUDGETS_ENABLED', default=True, cast=bool)
+AI_BUDGET_BACKEND = config('AI_BUDGET_BACKEND', default='redis')  # or 'memory' (single process / tests)
+AI_BUDGET_REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+AI_BUDGETS = {
+    'user': {
+        'tokens_per_minute': config('AI_USER_TOKENS_PER_MINUTE', default=60000, cast=int),
+        'burst': 60000,
+        'daily_tokens': config('AI_USER_DAILY_TOKENS', default=1000000, cast=int),
+    },
+    'hospital': {
+        'tokens_per_minute': config('AI_HOSPITAL_TOKENS_PER_MINUTE', default=400000, cast=int),
+        'burst': 400000,
+        'daily_tokens': config('AI_HOSPITAL_DAILY_TOKENS', default=20000000, cast=int),
+    },
+}
+
+# Django cache: Redis in production, 'locmem' for tests and single-process
+# runs. Request coalescing and Idempotency-Key replays (chat/coalescing.py)
+# only work across workers with a shared cache
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHES = {
+    'default': (
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        if CACHE_BACKEND == 'locmem'
+        else {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL', default='redis://localhost:6379/0'),
+        }
+    ),
+}
+
+# Duplicate AI requests (double-clicks, frontend retries) share one upstream call
+AI_COALESCE_ENABLED = config('AI_COALESCE_ENABLED', default=True, cast=bool)
+AI_COALESCE_WINDOW = 10  # seconds a finished response stays visible to duplicates waiting in other workers
+AI_COALESCE_WAIT = 120  # max seconds a duplicate waits for the first request
+AI_IDEMPOTENCY_TTL = 24 * 3600  # responses kept for Idempotency-Key retries
+
+# Compressed AI answers (Message.content, KasallikTarixi.ai_tahlil), see healthcare_api/compression.py
+COMPRESSED_TEXT_DICTIONARY = config('COMPRESSED_TEXT_DICTIONARY', default=1, cast=int)  # id for new writes
+COMPRESSED_TEXT_LEVEL = 6  # zlib level
+
+# Channel layer for chat WebSocket events: Redis in production, 'memory' for
+# tests and single-process runs (events do not cross processes)
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='redis')
+CHANNEL_LAYERS = {
+    'default': (
+        {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+        if CHANNEL_LAYER_BACKEND == 'memory'
+        else {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [config('REDIS_URL', default='redis://localhost:6379/0')]},
+        }
+    ),
+}
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -0,0 +1,34 @@
+"""
+JWT authentication for WebSocket connections.
+
+Browsers cannot set an Authorization header on a WebSocket, so the access
+token comes as ?token=<JWT>; scope["user"] is the token's user or
+AnonymousUser.
+"""
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+
+
+@database_sync_to_async
+def get_user(raw_token):
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+    if not raw_token:
+        return AnonymousUser()
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        scope = dict(scope, user=await get_user(query.get("token", [None])[0]))
+        return await super().__call__(scope, receive, send)
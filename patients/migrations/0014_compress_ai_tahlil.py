@@ -0,0 +1,61 @@
+from django.db import migrations
+
+import healthcare_api.compression
+
+BATCH_SIZE = 500
+
+
+def compress_ai_tahlil(apps, schema_editor):
+    KasallikTarixi = apps.get_model("patients", "KasallikTarixi")
+    batch = []
+    for record in KasallikTarixi.objects.only("id", "ai_tahlil").iterator(chunk_size=BATCH_SIZE):
+        record.ai_tahlil_compressed = record.ai_tahlil
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            KasallikTarixi.objects.bulk_update(batch, ["ai_tahlil_compressed"])
+            batch = []
+    if batch:
+        KasallikTarixi.objects.bulk_update(batch, ["ai_tahlil_compressed"])
+
+
+def decompress_ai_tahlil(apps, schema_editor):
+    KasallikTarixi = apps.get_model("patients", "KasallikTarixi")
+    batch = []
+    for record in KasallikTarixi.objects.only("id", "ai_tahlil_compressed").iterator(chunk_size=BATCH_SIZE):
+        record.ai_tahlil = record.ai_tahlil_compressed or ""
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            KasallikTarixi.objects.bulk_update(batch, ["ai_tahlil"])
+            batch = []
+    if batch:
+        KasallikTarixi.objects.bulk_update(batch, ["ai_tahlil"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0013_kasalliktarixi_allergiyalar_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kasalliktarixi',
+            name='ai_tahlil_compressed',
+            field=healthcare_api.compression.CompressedTextField(null=True),
+        ),
+        migrations.RunPython(compress_ai_tahlil, decompress_ai_tahlil),
+        migrations.RemoveField(
+            model_name='kasalliktarixi',
+            name='ai_tahlil',
+        ),
+        migrations.RenameField(
+            model_name='kasalliktarixi',
+            old_name='ai_tahlil_compressed',
+            new_name='ai_tahlil',
+        ),
+        migrations.AlterField(
+            model_name='kasalliktarixi',
+            name='ai_tahlil',
+            field=healthcare_api.compression.CompressedTextField(blank=True, verbose_name='AI tahlili va tashxisi'),
+        ),
+    ]
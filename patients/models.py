@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings  # Для ссылки на User модель
 
+from healthcare_api.compression import CompressedTextField
+
 # Предполагается, что у вас есть модель Doctor в приложении doctors
 # from doctors.models import Doctor
 # Если модель Doctor в том же приложении accounts, что и User:
@@ -210,7 +212,7 @@ class KasallikTarixi(models.Model):
     yurak_auskultatsiyasi = models.TextField("Yurak auskultatsiyasi", blank=True)
     qorin_auskultatsiyasi = models.TextField("Qorin auskultatsiyasi", blank=True)
 
-    ai_tahlil = models.TextField("AI tahlili va tashxisi", blank=True)
+    ai_tahlil = CompressedTextField("AI tahlili va tashxisi", blank=True)
 
     yuborilgan_vaqt = models.DateTimeField(auto_now_add=True)
 